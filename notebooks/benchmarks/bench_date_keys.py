@@ -0,0 +1,78 @@
+"""
+Benchmark: lookup date keys bằng DateKeyLookup (NumPy) so với 5 lần pd.merge với dim_date.
+
+Chạy từ thư mục notebooks:
+    python -m benchmarks.bench_date_keys --rows 99441
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+
+from etl.main_etl import lookup_date_keys_array, lookup_date_keys_merge
+
+DATE_LOOKUP_COLS = {
+    'purchase_date': 'purchase_date_key',
+    'approved_date': 'approved_date_key',
+    'delivered_carrier_date': 'delivered_carrier_date_key',
+    'delivered_customer_date': 'delivered_customer_date_key',
+    'estimated_delivery_date': 'estimated_delivery_date_key'
+}
+
+
+def make_dim_date():
+    dates = pd.date_range('2016-01-01', '2019-12-31', freq='D')
+    return pd.DataFrame({'date_key': dates.strftime('%Y%m%d').astype(int), 'full_date': dates})
+
+
+def make_fact_frame(rows, seed=42):
+    """Frame giống df_fact ở bước 6: các cột ngày dạng date (object), ~3% NULL."""
+    rng = np.random.default_rng(seed)
+    purchase = pd.Timestamp('2016-09-01') + pd.to_timedelta(rng.integers(0, 760 * 86400, rows), unit='s')
+    offsets_days = {
+        'purchase_date': 0, 'approved_date': 1, 'delivered_carrier_date': 3,
+        'delivered_customer_date': 10, 'estimated_delivery_date': 24,
+    }
+    df = pd.DataFrame({'order_id': [f'{i:032x}' for i in range(rows)]})
+    for col, offset in offsets_days.items():
+        ts = pd.Series(purchase + pd.to_timedelta(offset + rng.integers(0, 5, rows), unit='D'))
+        ts[rng.random(rows) < 0.03] = pd.NaT
+        df[col] = ts.dt.date
+    return df
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark date key lookup")
+    parser.add_argument('--rows', type=int, default=99441, help="Số order (mặc định = số order Olist)")
+    args = parser.parse_args()
+
+    df_dim_date = make_dim_date()
+    df_fact = make_fact_frame(args.rows)
+
+    df_merge, merge_s, merge_peak = measure(lookup_date_keys_merge, df_fact.copy(), df_dim_date, DATE_LOOKUP_COLS)
+    df_array, array_s, array_peak = measure(lookup_date_keys_array, df_fact.copy(), df_dim_date, DATE_LOOKUP_COLS)
+
+    key_cols = list(DATE_LOOKUP_COLS.values())
+    pd.testing.assert_frame_equal(
+        df_merge[key_cols].astype('Int64').reset_index(drop=True),
+        df_array[key_cols].reset_index(drop=True)
+    )
+
+    print(tabulate([
+        {'lookup': 'merge', 'seconds': round(merge_s, 3), 'peak_mb': round(merge_peak / 2**20, 1)},
+        {'lookup': 'array', 'seconds': round(array_s, 3), 'peak_mb': round(array_peak / 2**20, 1)},
+    ], headers='keys', tablefmt='psql'))
+    print(f"Speedup: {merge_s / array_s:.1f}x, peak memory: {merge_peak / max(array_peak, 1):.1f}x nhỏ hơn")
@@ -0,0 +1,156 @@
+"""
+Benchmark toàn bộ pipeline (staging -> dimensions -> fact) trên dữ liệu Olist tổng hợp
+(benchmarks/synthetic_olist.py) ở nhiều scale, với Postgres local (DATABASE_URI trong .env).
+
+Mỗi scale chạy trong một process riêng để peak RSS của scale trước không lẫn vào scale sau.
+Mỗi stage được đo bằng span (etl/run_metrics.py): wall time, CPU time, peak RSS của riêng stage
+(peak_rss_mb, lấy mẫu RSS trong khi stage chạy), peak tích lũy của process khi stage kết thúc
+(process_peak_rss_mb), số dòng nguồn và rows/sec. Kết quả được lưu để so sánh giữa các lần chạy:
+    - results_dir/etl_run_*.json: run record đầy đủ (mọi span con) của mỗi scale
+    - results_dir/etl_benchmark_results.csv: một dòng mỗi (run, scale, stage), append qua các lần chạy
+    - dwh.etl_run_metrics (run_name = bench_x<scale>)
+Sau khi chạy, in bảng so sánh với lần chạy trước cùng scale (--compare chỉ in bảng, không chạy).
+
+Chạy từ thư mục notebooks:
+    python -m benchmarks.bench_etl_pipeline --scales 1 10 100
+"""
+import argparse
+import logging
+import multiprocessing
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from tabulate import tabulate
+
+from benchmarks.synthetic_olist import generate_olist
+from etl.main_etl import (CSV_FILES, database_uri_from_env, extract_load_to_staging,
+                          transform_and_load_dimensions, transform_and_load_fact)
+from etl.run_metrics import etl_run, span
+
+BENCH_DIR = Path(__file__).resolve().parent
+STAGES = ['staging', 'dimensions', 'fact']
+RESULT_COLUMNS = ['run_id', 'run_started_at', 'git_commit', 'scale', 'seed', 'transform_engine',
+                  'stage', 'rows', 'wall_seconds', 'cpu_seconds', 'peak_rss_mb', 'process_peak_rss_mb',
+                  'rows_per_second']
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_scale(scale, seed, data_root, results_dir, transform_engine='pandas', staging_method='copy', max_workers=1):
+    """Sinh dữ liệu (nếu chưa có) và chạy full load 3 stage. Trả về list dòng kết quả (mỗi stage một dòng)."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    load_dotenv()
+    data_dir = Path(data_root) / f"scale_{scale:g}"
+    file_rows = generate_olist(data_dir, scale=scale, seed=seed)
+    stage_rows = {
+        'staging': sum(file_rows[f] for f in CSV_FILES),
+        'dimensions': sum(file_rows[f] for f in [
+            'olist_customers_dataset.csv', 'olist_sellers_dataset.csv', 'olist_products_dataset.csv'
+        ]),
+        'fact': file_rows['olist_orders_dataset.csv'],
+    }
+
+    engine = create_engine(database_uri_from_env())
+    stage_spans = {}
+    try:
+        with etl_run(engine, f"bench_x{scale:g}", record_dir=results_dir) as run:
+            with span('bench.staging', rows=stage_rows['staging']) as stage_spans['staging']:
+                extract_load_to_staging(CSV_FILES, data_dir, engine, method=staging_method, max_workers=max_workers)
+            with span('bench.dimensions', rows=stage_rows['dimensions']) as stage_spans['dimensions']:
+                transform_and_load_dimensions(engine, full_reload=True)
+            with span('bench.fact', rows=stage_rows['fact']) as stage_spans['fact']:
+                transform_and_load_fact(engine, mode='full', transform_engine=transform_engine)
+    finally:
+        engine.dispose()
+
+    commit = git_commit()
+    return [{
+        'run_id': run.run_id,
+        'run_started_at': run.started_at.isoformat(timespec='seconds'),
+        'git_commit': commit,
+        'scale': scale,
+        'seed': seed,
+        'transform_engine': transform_engine,
+        'stage': stage,
+        'rows': stage_span.rows,
+        'wall_seconds': round(stage_span.wall_seconds, 3),
+        'cpu_seconds': round(stage_span.cpu_seconds, 3),
+        'peak_rss_mb': round(stage_span.peak_rss_mb, 1),
+        'process_peak_rss_mb': round(stage_span.process_peak_rss_mb, 1),
+        'rows_per_second': round(stage_span.rows_per_second or 0),
+    } for stage, stage_span in stage_spans.items()]
+
+
+def append_results(rows, results_path):
+    df = pd.DataFrame(rows, columns=RESULT_COLUMNS)
+    if results_path.exists():
+        df_old = pd.read_csv(results_path)
+        if 'process_peak_rss_mb' not in df_old.columns:
+            # File cũ: peak_rss_mb khi đó là peak tích lũy của process (ru_maxrss), không phải peak của stage
+            df_old = df_old.rename(columns={'peak_rss_mb': 'process_peak_rss_mb'})
+            pd.concat([df_old, df]).reindex(columns=RESULT_COLUMNS).to_csv(results_path, index=False)
+            return
+    df.to_csv(results_path, mode='a', header=not results_path.exists(), index=False)
+
+
+def compare_runs(results_path, scales=None):
+    """Với mỗi (scale, transform_engine, stage): lần chạy mới nhất so với lần trước đó."""
+    if not results_path.exists():
+        return []
+    df = pd.read_csv(results_path)
+    if scales:
+        df = df[df['scale'].isin(scales)]
+    rows = []
+    for (scale, engine_name, stage), group in df.groupby(['scale', 'transform_engine', 'stage'], sort=False):
+        group = group.sort_values('run_started_at')
+        latest = group.iloc[-1]
+        row = {
+            'scale': scale, 'engine': engine_name, 'stage': stage, 'rows': latest['rows'],
+            'seconds': latest['wall_seconds'], 'rows_per_s': latest['rows_per_second'],
+            'peak_rss_mb': latest['peak_rss_mb'], 'process_peak_rss_mb': latest['process_peak_rss_mb'],
+            'commit': latest['git_commit'],
+        }
+        if len(group) > 1:
+            previous = group.iloc[-2]
+            row['prev_seconds'] = previous['wall_seconds']
+            row['prev_commit'] = previous['git_commit']
+            row['change_%'] = round((latest['wall_seconds'] / previous['wall_seconds'] - 1) * 100, 1) \
+                if previous['wall_seconds'] else None
+        rows.append(row)
+    order = {stage: i for i, stage in enumerate(STAGES)}
+    return sorted(rows, key=lambda r: (r['scale'], r['engine'], order.get(r['stage'], len(order))))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ETL end-to-end trên dữ liệu Olist tổng hợp")
+    parser.add_argument('--scales', type=float, nargs='+', default=[1.0], help="Các scale factor (1 = kích thước Olist thật)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--data-root', type=Path, default=BENCH_DIR / 'data', help="Thư mục chứa dữ liệu tổng hợp theo scale")
+    parser.add_argument('--results-dir', type=Path, default=BENCH_DIR / 'results')
+    parser.add_argument('--transform-engine', default='pandas', choices=['pandas', 'sql'])
+    parser.add_argument('--staging-method', default='copy')
+    parser.add_argument('--workers', type=int, default=1, help="Số bảng staging load song song")
+    parser.add_argument('--compare', action='store_true', help="Chỉ in bảng so sánh các lần chạy đã lưu")
+    args = parser.parse_args()
+
+    args.results_dir.mkdir(parents=True, exist_ok=True)
+    results_path = args.results_dir / 'etl_benchmark_results.csv'
+    if not args.compare:
+        for scale in args.scales:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                rows = executor.submit(run_scale, scale, args.seed, args.data_root, args.results_dir,
+                                       args.transform_engine, args.staging_method, args.workers).result()
+            append_results(rows, results_path)
+            print(tabulate(rows, headers='keys', tablefmt='psql'))
+
+    print(tabulate(compare_runs(results_path, args.scales if not args.compare else None), headers='keys', tablefmt='psql'))
@@ -0,0 +1,93 @@
+"""
+Benchmark: tính measures thời gian của Fact bằng số học datetime64 (compute_fact_measures)
+so với đường cũ (cột .dt.date dạng object + pd.to_datetime lại cho mỗi measure).
+
+Chạy từ thư mục notebooks:
+    python -m benchmarks.bench_fact_measures --rows 10000000
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+
+from etl.main_etl import FACT_DATE_COLUMNS, compute_fact_measures
+
+MEASURE_COLS = [
+    'delivery_time_days', 'estimated_delivery_time_days', 'delivery_time_difference_days',
+    'time_to_approve_hours', 'seller_processing_hours', 'carrier_shipping_hours', 'is_late_delivery_flag'
+]
+
+
+def compute_fact_measures_legacy(df_fact):
+    """Bước 4-5 của build_fact_frame trước khi chuyển sang datetime64 (để so sánh)."""
+    for ts_col, date_col in FACT_DATE_COLUMNS.items():
+        df_fact[date_col] = df_fact[ts_col].dt.date
+    df_fact['delivery_time_days'] = (pd.to_datetime(df_fact['delivered_customer_date'], errors='coerce') - pd.to_datetime(df_fact['approved_date'], errors='coerce')).dt.days
+    df_fact['estimated_delivery_time_days'] = (pd.to_datetime(df_fact['estimated_delivery_date'], errors='coerce') - pd.to_datetime(df_fact['approved_date'], errors='coerce')).dt.days
+    df_fact['delivery_time_difference_days'] = (pd.to_datetime(df_fact['delivered_customer_date'], errors='coerce') - pd.to_datetime(df_fact['estimated_delivery_date'], errors='coerce')).dt.days
+    df_fact['time_to_approve_hours'] = (df_fact['order_approved_at'] - df_fact['order_purchase_timestamp']) / pd.Timedelta(hours=1)
+    df_fact['seller_processing_hours'] = (df_fact['order_delivered_carrier_date'] - df_fact['order_approved_at']) / pd.Timedelta(hours=1)
+    df_fact['carrier_shipping_hours'] = (df_fact['order_delivered_customer_date'] - df_fact['order_delivered_carrier_date']) / pd.Timedelta(hours=1)
+    for col in ['time_to_approve_hours', 'seller_processing_hours', 'carrier_shipping_hours']:
+        df_fact[col] = df_fact[col].round(2)
+    df_fact['is_late_delivery_flag'] = (df_fact['delivery_time_difference_days'] > 0) & (df_fact['delivered_customer_date'].notna())
+    df_fact['is_late_delivery_flag'] = df_fact['is_late_delivery_flag'].fillna(False).astype(bool)
+    for col in MEASURE_COLS[:-1]:
+        df_fact.loc[df_fact[col] < 0, col] = None
+    # Bước 6 cũ chuyển các cột date (object) về datetime thêm một lần nữa
+    for date_col in FACT_DATE_COLUMNS.values():
+        df_fact[date_col] = pd.to_datetime(df_fact[date_col], errors='coerce')
+    return df_fact
+
+
+def make_orders_frame(rows, seed=42):
+    """Frame giống df_fact ở bước 4: 5 cột timestamp datetime64, ~3% NULL (trừ purchase)."""
+    rng = np.random.default_rng(seed)
+    purchase = pd.Timestamp('2016-09-01') + pd.to_timedelta(rng.integers(0, 760 * 86400, rows), unit='s')
+    offsets_hours = {
+        'order_approved_at': (0, 48),
+        'order_delivered_carrier_date': (24, 24 * 6),
+        'order_delivered_customer_date': (24 * 3, 24 * 30),
+        'order_estimated_delivery_date': (24 * 10, 24 * 30),
+    }
+    df = pd.DataFrame({'order_purchase_timestamp': purchase})
+    for col, (low, high) in offsets_hours.items():
+        ts = pd.Series(purchase + pd.to_timedelta(rng.integers(low * 3600, high * 3600, rows), unit='s'))
+        ts[rng.random(rows) < 0.03] = pd.NaT
+        df[col] = ts
+    return df
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark fact time measures")
+    parser.add_argument('--rows', type=int, default=10_000_000, help="Số order tổng hợp")
+    args = parser.parse_args()
+
+    df_orders = make_orders_frame(args.rows)
+
+    df_legacy, legacy_s, legacy_peak = measure(compute_fact_measures_legacy, df_orders.copy())
+    df_new, new_s, new_peak = measure(compute_fact_measures, df_orders.copy())
+
+    pd.testing.assert_frame_equal(
+        df_legacy[MEASURE_COLS].astype({col: 'Float64' for col in MEASURE_COLS[:-1]}),
+        df_new[MEASURE_COLS].astype({col: 'Float64' for col in MEASURE_COLS[:-1]}),
+    )
+
+    print(tabulate([
+        {'measures': 'legacy (date object)', 'seconds': round(legacy_s, 3), 'peak_mb': round(legacy_peak / 2**20, 1)},
+        {'measures': 'datetime64', 'seconds': round(new_s, 3), 'peak_mb': round(new_peak / 2**20, 1)},
+    ], headers='keys', tablefmt='psql'))
+    print(f"Speedup: {legacy_s / new_s:.1f}x, peak memory: {legacy_peak / max(new_peak, 1):.1f}x nhỏ hơn")
@@ -0,0 +1,137 @@
+"""
+Benchmark: join natural key (order_id/customer_id/seller_id/product_id, hex 32 ký tự) trên code
+KeyDictionary so với merge/map trên chuỗi, cho build_fact_frame + build_fact_item_frame.
+
+Frame nguồn có kiểu như staging typed (02b: timestamp/numeric đã parse) để thời gian đo được
+chủ yếu là phần join theo natural key. Đo thời gian (tốt nhất của --repeat lần, không bật
+tracemalloc), peak bộ nhớ (tracemalloc, một lần chạy riêng) và bộ nhớ các cột id dạng chuỗi
+so với code int32.
+
+Chạy từ thư mục notebooks:
+    python -m benchmarks.bench_key_encoding --orders 99441
+"""
+import argparse
+import logging
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+
+from etl.main_etl import build_fact_frame, build_fact_item_frame, build_key_dictionaries
+
+ID_COLUMNS = {'orders': ['order_id', 'customer_id'], 'items': ['order_id', 'seller_id', 'product_id']}
+
+
+def hex_ids(rng, count):
+    """Id dạng Olist: hex 32 ký tự."""
+    return [f'{high:016x}{low:016x}' for high, low in rng.integers(0, 2**63, size=(count, 2))]
+
+
+def make_frames(orders, seed=42):
+    """Frame giống staging typed và Dimension hiện hành; ~1.15 item mỗi order, ~3% seller không có trong Dimension."""
+    rng = np.random.default_rng(seed)
+    customer_ids = hex_ids(rng, orders)
+    seller_ids = hex_ids(rng, max(orders // 32, 1))
+    product_ids = hex_ids(rng, max(orders // 3, 1))
+    order_ids = hex_ids(rng, orders)
+
+    purchase = pd.Timestamp('2017-01-01') + pd.to_timedelta(rng.integers(0, 600 * 86400, orders), unit='s')
+    df_orders = pd.DataFrame({
+        'order_id': order_ids,
+        'customer_id': customer_ids,
+        'order_status': 'delivered',
+        'order_purchase_timestamp': purchase,
+        'order_approved_at': purchase + pd.Timedelta(hours=2),
+        'order_delivered_carrier_date': purchase + pd.Timedelta(days=2),
+        'order_delivered_customer_date': purchase + pd.Timedelta(days=9),
+        'order_estimated_delivery_date': (purchase + pd.Timedelta(days=20)).normalize(),
+        'source_row_hash': hex_ids(rng, orders),
+    })
+
+    items_per_order = 1 + (rng.random(orders) < 0.12) + (rng.random(orders) < 0.03)
+    item_orders = np.repeat(np.arange(orders), items_per_order)
+    df_items = pd.DataFrame({
+        'order_id': df_orders['order_id'].to_numpy()[item_orders],
+        'order_item_id': np.arange(len(item_orders)) - np.repeat(np.cumsum(items_per_order) - items_per_order, items_per_order) + 1,
+        'product_id': np.asarray(product_ids, dtype=object)[rng.integers(0, len(product_ids), len(item_orders))],
+        'seller_id': np.asarray(seller_ids, dtype=object)[rng.integers(0, len(seller_ids), len(item_orders))],
+        'shipping_limit_date': df_orders['order_approved_at'].to_numpy()[item_orders],
+        'price': rng.uniform(5, 500, len(item_orders)).round(2),
+        'freight_value': rng.uniform(0, 50, len(item_orders)).round(2),
+    })
+
+    dates = pd.date_range('2016-01-01', '2019-12-31', freq='D')
+    df_dim_date = pd.DataFrame({'date_key': dates.strftime('%Y%m%d').astype(int), 'full_date': dates})
+    df_dim_cust = pd.DataFrame({
+        'customer_key': np.arange(1, orders + 1), 'customer_id': customer_ids,
+        'customer_lat': rng.uniform(-30, -5, orders), 'customer_lng': rng.uniform(-60, -35, orders),
+    })
+    known_sellers = seller_ids[:max(int(len(seller_ids) * 0.97), 1)]
+    df_dim_seller = pd.DataFrame({
+        'seller_key': np.arange(1, len(known_sellers) + 1), 'seller_id': known_sellers,
+        'seller_lat': rng.uniform(-30, -5, len(known_sellers)), 'seller_lng': rng.uniform(-60, -35, len(known_sellers)),
+    })
+    df_dim_product = pd.DataFrame({'product_key': np.arange(1, len(product_ids) + 1), 'product_id': product_ids})
+    return df_orders, df_items, df_dim_date, df_dim_cust, df_dim_seller, df_dim_product
+
+
+def build_both(key_lookup, df_orders, df_items, df_dim_date, df_dim_cust, df_dim_seller, df_dim_product):
+    """Một partition của transform_and_load_fact (engine pandas) với key_lookup cho trước."""
+    key_dictionaries = None
+    if key_lookup == 'dictionary':
+        key_dictionaries = build_key_dictionaries(df_dim_cust, df_dim_seller, df_dim_product)
+    df_item = build_fact_item_frame(df_orders.copy(), df_items.copy(), df_dim_date, df_dim_cust, df_dim_seller,
+                                    df_dim_product, key_lookup=key_lookup, key_dictionaries=key_dictionaries)
+    df_fact = build_fact_frame(df_orders.copy(), df_items.copy(), df_dim_date, df_dim_cust, df_dim_seller,
+                               key_lookup=key_lookup, key_dictionaries=key_dictionaries)
+    return df_fact, df_item
+
+
+def measure(func, *args, repeat=3):
+    """Thời gian tốt nhất của repeat lần chạy và peak tracemalloc của một lần chạy thêm."""
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed.append(time.perf_counter() - start)
+    tracemalloc.start()
+    result = func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, min(elapsed), peak
+
+
+def id_column_memory(df_orders, df_items):
+    """Bộ nhớ (MB) các cột id: chuỗi (deep) so với code int32 sau khi encode."""
+    frames = {'orders': df_orders, 'items': df_items}
+    object_bytes = sum(frames[name][col].memory_usage(deep=True, index=False)
+                       for name, cols in ID_COLUMNS.items() for col in cols)
+    code_bytes = sum(len(frames[name]) * np.dtype(np.int32).itemsize for name, cols in ID_COLUMNS.items() for col in cols)
+    return object_bytes / 2**20, code_bytes / 2**20
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark join natural key: KeyDictionary so với merge trên chuỗi")
+    parser.add_argument('--orders', type=int, default=99441, help="Số order (mặc định = số order Olist)")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    frames = make_frames(args.orders)
+    (fact_merge, item_merge), merge_s, merge_peak = measure(build_both, 'merge', *frames, repeat=args.repeat)
+    (fact_dict, item_dict), dict_s, dict_peak = measure(build_both, 'dictionary', *frames, repeat=args.repeat)
+
+    for df_dict, df_merge in [(fact_dict, fact_merge), (item_dict, item_merge)]:
+        pd.testing.assert_frame_equal(
+            df_dict.drop(columns=['dw_load_timestamp']),
+            df_merge.drop(columns=['dw_load_timestamp'])
+        )
+
+    object_mb, code_mb = id_column_memory(frames[0], frames[1])
+    print(tabulate([
+        {'key_lookup': 'merge', 'seconds': round(merge_s, 3), 'peak_mb': round(merge_peak / 2**20, 1), 'id_columns_mb': round(object_mb, 1)},
+        {'key_lookup': 'dictionary', 'seconds': round(dict_s, 3), 'peak_mb': round(dict_peak / 2**20, 1), 'id_columns_mb': round(code_mb, 1)},
+    ], headers='keys', tablefmt='psql'))
+    print(f"Speedup: {merge_s / dict_s:.1f}x, peak memory: {merge_peak / max(dict_peak, 1):.1f}x nhỏ hơn")
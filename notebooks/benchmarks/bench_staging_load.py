@@ -0,0 +1,61 @@
+"""
+Benchmark: so sánh load staging bằng COPY FROM STDIN với đường df.to_sql cũ.
+
+Chạy từ thư mục notebooks:
+    python -m benchmarks.bench_staging_load --data-dir ../data --repeat 3
+"""
+import argparse
+import logging
+import statistics
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from tabulate import tabulate
+
+from etl.main_etl import CSV_FILES, STAGING_LOADERS, database_uri_from_env, extract_load_to_staging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def run_benchmark(data_dir, db_engine, methods, repeat, max_workers=1):
+    """Chạy extract_load_to_staging cho từng method, trả về list các dòng kết quả."""
+    timings = {}  # (method, table) -> list[(rows, seconds)]
+    for method in methods:
+        for _ in range(repeat):
+            stats = extract_load_to_staging(CSV_FILES, data_dir, db_engine, method=method, max_workers=max_workers)
+            for table_name, table_stats in stats.items():
+                timings.setdefault((method, table_name), []).append((table_stats['rows'], table_stats['seconds']))
+
+    rows = []
+    for table_name in CSV_FILES.values():
+        row = {'table': table_name}
+        for method in methods:
+            samples = timings.get((method, table_name))
+            if not samples:
+                continue
+            seconds = statistics.median(s for _, s in samples)
+            row['rows'] = samples[0][0]
+            row[f'{method}_s'] = round(seconds, 3)
+            row[f'{method}_rows_per_s'] = round(samples[0][0] / seconds) if seconds > 0 else None
+        if 'copy_s' in row and 'to_sql_s' in row and row['copy_s'] > 0:
+            row['speedup'] = round(row['to_sql_s'] / row['copy_s'], 1)
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark COPY vs to_sql cho extract_load_to_staging")
+    parser.add_argument('--data-dir', type=Path, default=Path(__file__).resolve().parents[2] / 'data')
+    parser.add_argument('--methods', nargs='+', default=['to_sql', 'copy'], choices=sorted(STAGING_LOADERS))
+    parser.add_argument('--repeat', type=int, default=1, help="Số lần chạy mỗi method (lấy median)")
+    parser.add_argument('--workers', type=int, default=1, help="Số bảng staging load song song")
+    args = parser.parse_args()
+
+    load_dotenv()
+    engine = create_engine(database_uri_from_env())
+    try:
+        results = run_benchmark(args.data_dir, engine, args.methods, args.repeat, args.workers)
+    finally:
+        engine.dispose()
+    print(tabulate(results, headers='keys', tablefmt='psql'))
@@ -0,0 +1,309 @@
+"""
+Sinh bộ dữ liệu Olist tổng hợp (cùng header/định dạng với các file CSV Kaggle) cho benchmark ETL.
+
+scale=1 ~ kích thước bộ Olist thật (99.441 orders, ~112.650 order items, 3.095 sellers,
+32.951 products); orders, order_items, customers, sellers và products tăng tuyến tính theo scale.
+Geolocation (~19.015 prefix, ~1 triệu điểm) và bảng dịch category là dữ liệu tham chiếu
+nên giữ nguyên ở mọi scale.
+Cardinality và tỷ lệ NULL lấy theo bộ dữ liệu thật:
+    - mỗi order có một customer_id riêng, ~3% customer_unique_id mua lại
+    - ~90% order có 1 item, seller/product phân bố lệch (vài seller chiếm phần lớn item)
+    - NULL của các cột ngày đi theo order_status (canceled/unavailable không có ngày giao...)
+    - ~0,05% điểm geolocation là outlier (tọa độ ngoài Brazil hoặc lệch khỏi prefix)
+    - 73 category, ~1,85% product không có category, 2 category không có bản dịch
+
+Sinh theo từng chunk order (seed cố định cho mỗi chunk) nên bộ nhớ không tăng theo scale
+và cùng (scale, seed) luôn cho ra cùng dữ liệu.
+
+Chạy từ thư mục notebooks:
+    python -m benchmarks.synthetic_olist --scale 10 --out-dir benchmarks/data/scale_10
+"""
+import argparse
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+BASE_ORDERS = 99_441
+BASE_SELLERS = 3_095
+BASE_PRODUCTS = 32_951
+ZIP_PREFIXES = 19_015
+GEO_POINTS_PER_PREFIX = 52
+REPEAT_CUSTOMER_RATE = 0.031
+GEO_OUTLIER_RATE = 0.0005
+CHUNK_ORDERS = 500_000
+PRODUCT_CATEGORIES = 73
+UNTRANSLATED_CATEGORIES = 2
+MISSING_CATEGORY_RATE = 0.0185
+
+PURCHASE_START = pd.Timestamp('2016-09-04')
+PURCHASE_DAYS = 774
+
+# (state, khoảng 2 chữ số đầu của CEP, lat, lng, tỷ lệ customer)
+STATES = [
+    ('SP', (1, 19), -23.2, -47.3, 0.420), ('RJ', (20, 28), -22.5, -43.2, 0.129),
+    ('ES', (29, 29), -19.8, -40.5, 0.020), ('MG', (30, 39), -19.2, -44.4, 0.117),
+    ('BA', (40, 48), -12.8, -40.5, 0.034), ('SE', (49, 49), -10.8, -37.3, 0.004),
+    ('PE', (50, 56), -8.3, -36.6, 0.017), ('AL', (57, 57), -9.6, -36.4, 0.004),
+    ('PB', (58, 58), -7.2, -36.2, 0.005), ('RN', (59, 59), -5.8, -36.3, 0.005),
+    ('CE', (60, 63), -4.5, -39.3, 0.013), ('PI', (64, 64), -6.7, -42.3, 0.005),
+    ('MA', (65, 65), -4.2, -44.8, 0.008), ('PA', (66, 68), -3.2, -51.2, 0.010),
+    ('AM', (69, 69), -3.4, -61.9, 0.002), ('DF', (70, 73), -15.8, -47.9, 0.022),
+    ('GO', (74, 76), -16.3, -49.6, 0.020), ('TO', (77, 77), -10.2, -48.3, 0.003),
+    ('MT', (78, 78), -13.4, -56.0, 0.009), ('MS', (79, 79), -20.6, -54.8, 0.007),
+    ('PR', (80, 87), -24.6, -51.3, 0.051), ('SC', (88, 89), -27.2, -49.8, 0.037),
+    ('RS', (90, 99), -29.7, -52.4, 0.058),
+]
+
+# order_status -> (tỷ lệ, các cột ngày là NULL)
+ORDER_STATUSES = {
+    'delivered': (0.9702, []),
+    'shipped': (0.0111, ['order_delivered_customer_date']),
+    'canceled': (0.0063, ['order_delivered_carrier_date', 'order_delivered_customer_date']),
+    'unavailable': (0.0061, ['order_delivered_carrier_date', 'order_delivered_customer_date']),
+    'invoiced': (0.0032, ['order_delivered_carrier_date', 'order_delivered_customer_date']),
+    'processing': (0.0030, ['order_delivered_carrier_date', 'order_delivered_customer_date']),
+    'created': (0.0001, ['order_approved_at', 'order_delivered_carrier_date', 'order_delivered_customer_date']),
+    'approved': (0.00002, ['order_delivered_carrier_date', 'order_delivered_customer_date']),
+}
+# Tỷ lệ NULL lẻ tẻ còn lại trong order delivered (dữ liệu thật có vài order như vậy)
+DELIVERED_NULL_RATES = {
+    'order_approved_at': 0.0001,
+    'order_delivered_carrier_date': 0.0000,
+    'order_delivered_customer_date': 0.0001,
+}
+
+# Số item mỗi order: 1 (~90%), 2 (~7,6%), 3..6
+ITEMS_PER_ORDER = np.array([1, 2, 3, 4, 5, 6])
+ITEMS_PER_ORDER_P = np.array([0.9013, 0.0759, 0.0138, 0.0051, 0.0020, 0.0019])
+
+OLIST_FILES = {
+    'orders': 'olist_orders_dataset.csv',
+    'order_items': 'olist_order_items_dataset.csv',
+    'customers': 'olist_customers_dataset.csv',
+    'sellers': 'olist_sellers_dataset.csv',
+    'geolocation': 'olist_geolocation_dataset.csv',
+    'products': 'olist_products_dataset.csv',
+    'category_translation': 'product_category_name_translation.csv',
+}
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def hex_ids(rng, n):
+    """n id dạng hex 32 ký tự giống các id md5 của Olist."""
+    return np.frombuffer(rng.bytes(16 * n).hex().encode('ascii'), dtype='S32').astype(str)
+
+
+def zip_prefixes(rng, n=ZIP_PREFIXES):
+    """Tập zip prefix (5 chữ số) theo từng state, số prefix tỷ lệ với số customer của state."""
+    weights = np.array([w for *_, w in STATES])
+    counts = np.maximum(np.round(weights / weights.sum() * n).astype(int), 1)
+    frames = []
+    for (state, (lo, hi), lat, lng, _), count in zip(STATES, counts):
+        domain = np.arange(max(lo * 1000, 1000), (hi + 1) * 1000)
+        prefixes = np.sort(rng.choice(domain, size=min(count, len(domain)), replace=False))
+        frames.append(pd.DataFrame({
+            'zip_prefix': prefixes,
+            'state': state,
+            # Tâm của mỗi prefix lệch quanh tâm state, thành phố ~ 100 prefix liền nhau
+            'lat': lat + rng.normal(0, 1.2, len(prefixes)),
+            'lng': lng + rng.normal(0, 1.2, len(prefixes)),
+            'city': [f"{state.lower()} city {p // 100:03d}" for p in prefixes],
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def format_zip(prefixes):
+    return pd.Series(prefixes).map('{:05d}'.format)
+
+
+def make_geolocation(rng, df_zip, points_per_prefix=GEO_POINTS_PER_PREFIX):
+    """~points_per_prefix điểm quanh tâm mỗi prefix, một phần nhỏ là outlier."""
+    counts = rng.poisson(points_per_prefix - 1, len(df_zip)) + 1
+    idx = np.repeat(np.arange(len(df_zip)), counts)
+    n = len(idx)
+    lat = df_zip['lat'].to_numpy()[idx] + rng.normal(0, 0.03, n)
+    lng = df_zip['lng'].to_numpy()[idx] + rng.normal(0, 0.03, n)
+    outliers = rng.random(n) < GEO_OUTLIER_RATE
+    lat[outliers] = rng.uniform(-60, 45, outliers.sum())
+    lng[outliers] = rng.uniform(-120, 10, outliers.sum())
+    return pd.DataFrame({
+        'geolocation_zip_code_prefix': format_zip(df_zip['zip_prefix'].to_numpy()[idx]),
+        'geolocation_lat': lat.round(14),
+        'geolocation_lng': lng.round(14),
+        'geolocation_city': df_zip['city'].to_numpy()[idx],
+        'geolocation_state': df_zip['state'].to_numpy()[idx],
+    })
+
+
+def _pick_prefixes(rng, df_zip, n):
+    rows = rng.integers(0, len(df_zip), n)
+    return (format_zip(df_zip['zip_prefix'].to_numpy()[rows]),
+            df_zip['city'].to_numpy()[rows], df_zip['state'].to_numpy()[rows])
+
+
+def make_sellers(rng, df_zip, n_sellers):
+    zips, cities, states = _pick_prefixes(rng, df_zip, n_sellers)
+    return pd.DataFrame({
+        'seller_id': hex_ids(rng, n_sellers),
+        'seller_zip_code_prefix': zips,
+        'seller_city': cities,
+        'seller_state': states,
+    })
+
+
+def make_products(rng, product_ids):
+    """(products, bảng dịch category): category phân bố lệch, product không có category thì thiếu cả các thuộc tính mô tả."""
+    categories = np.array([f"categoria_{i:02d}" for i in range(PRODUCT_CATEGORIES)])
+    df_translation = pd.DataFrame({
+        'product_category_name': categories[:PRODUCT_CATEGORIES - UNTRANSLATED_CATEGORIES],
+        'product_category_name_english': [f"category_{i:02d}" for i in range(PRODUCT_CATEGORIES - UNTRANSLATED_CATEGORIES)],
+    })
+    n = len(product_ids)
+    missing = rng.random(n) < MISSING_CATEGORY_RATE
+    dims = {
+        'product_weight_g': np.clip(rng.lognormal(6.7, 1.2, n), 50, 40425),
+        'product_length_cm': np.clip(rng.normal(30, 16, n), 7, 105),
+        'product_height_cm': np.clip(rng.lognormal(2.6, 0.7, n), 2, 105),
+        'product_width_cm': np.clip(rng.normal(23, 12, n), 6, 118),
+    }
+    df_products = pd.DataFrame({
+        'product_id': product_ids,
+        'product_category_name': pd.Series(categories[skewed_index(rng, PRODUCT_CATEGORIES, n, power=2.0)]).where(~missing),
+        'product_name_lenght': pd.array(rng.integers(5, 77, n), dtype='Int64'),
+        'product_description_lenght': pd.array(np.clip(rng.lognormal(6.4, 0.8, n), 4, 3992).astype(int), dtype='Int64'),
+        'product_photos_qty': pd.array(rng.choice([1, 2, 3, 4, 5, 6], size=n, p=[0.51, 0.2, 0.12, 0.08, 0.05, 0.04]), dtype='Int64'),
+    })
+    for col in ['product_name_lenght', 'product_description_lenght', 'product_photos_qty']:
+        df_products.loc[missing, col] = pd.NA
+    for col, values in dims.items():
+        df_products[col] = pd.array(values.round().astype(int), dtype='Int64')
+    return df_products, df_translation
+
+
+def skewed_index(rng, n_values, size, power=3.0):
+    """Chỉ số trong [0, n_values) phân bố lệch: các giá trị đầu được chọn nhiều hơn."""
+    return np.minimum((n_values * rng.random(size) ** power).astype(np.int64), n_values - 1)
+
+
+def make_orders_chunk(rng, start, n_orders, df_zip, seller_ids, product_ids, unique_ids):
+    """Sinh (orders, order_items, customers) cho các order [start, start + n_orders)."""
+    order_ids = hex_ids(rng, n_orders)
+    customer_ids = hex_ids(rng, n_orders)
+
+    # --- Customers: một customer_id cho mỗi order, các order sau len(unique_ids) là khách mua lại ---
+    order_no = np.arange(start, start + n_orders)
+    unique_idx = np.where(order_no < len(unique_ids), order_no, rng.integers(0, len(unique_ids), n_orders))
+    zips, cities, states = _pick_prefixes(rng, df_zip, n_orders)
+    df_customers = pd.DataFrame({
+        'customer_id': customer_ids,
+        'customer_unique_id': unique_ids[unique_idx],
+        'customer_zip_code_prefix': zips,
+        'customer_city': cities,
+        'customer_state': states,
+    })
+
+    # --- Orders: status và các mốc thời gian ---
+    statuses = list(ORDER_STATUSES)
+    status_p = np.array([p for p, _ in ORDER_STATUSES.values()])
+    status = rng.choice(statuses, size=n_orders, p=status_p / status_p.sum())
+    purchase = (PURCHASE_START + pd.to_timedelta(rng.integers(0, PURCHASE_DAYS * 86400, n_orders), unit='s')).values
+    hours = lambda low, high: pd.to_timedelta(rng.gamma(2.0, (high - low) / 4, n_orders) + low, unit='h').values
+    timestamps = {
+        'order_purchase_timestamp': purchase,
+        'order_approved_at': purchase + hours(0.1, 20),
+        'order_delivered_carrier_date': purchase + hours(24, 24 * 5),
+        'order_delivered_customer_date': purchase + hours(24 * 3, 24 * 16),
+        # Ngày dự kiến giao không có giờ, thường trễ hơn ngày giao thực tế
+        'order_estimated_delivery_date': (pd.DatetimeIndex(purchase + hours(24 * 10, 24 * 30)).normalize()).values,
+    }
+    df_orders = pd.DataFrame({'order_id': order_ids, 'customer_id': customer_ids, 'order_status': status})
+    for col, values in timestamps.items():
+        null_mask = np.zeros(n_orders, dtype=bool)
+        for status_name, (_, null_cols) in ORDER_STATUSES.items():
+            if col in null_cols:
+                null_mask |= status == status_name
+        null_mask |= (status == 'delivered') & (rng.random(n_orders) < DELIVERED_NULL_RATES.get(col, 0.0))
+        df_orders[col] = pd.Series(values).dt.strftime(TIMESTAMP_FORMAT).where(~null_mask)
+
+    # --- Order items: 1..6 item mỗi order (trừ vài order không có item như dữ liệu thật) ---
+    items_per_order = rng.choice(ITEMS_PER_ORDER, size=n_orders, p=ITEMS_PER_ORDER_P)
+    items_per_order[np.isin(status, ['unavailable', 'created'])] = 0
+    idx = np.repeat(np.arange(n_orders), items_per_order)
+    order_item_id = np.arange(len(idx)) - np.repeat(np.cumsum(items_per_order) - items_per_order, items_per_order) + 1
+    df_items = pd.DataFrame({
+        'order_id': order_ids[idx],
+        'order_item_id': order_item_id,
+        'product_id': product_ids[skewed_index(rng, len(product_ids), len(idx))],
+        'seller_id': seller_ids[skewed_index(rng, len(seller_ids), len(idx))],
+        'shipping_limit_date': pd.Series(purchase[idx] + pd.to_timedelta(6, unit='D')).dt.strftime(TIMESTAMP_FORMAT),
+        'price': np.round(np.clip(rng.lognormal(4.4, 0.9, len(idx)), 0.85, 6735.0), 2),
+        'freight_value': np.round(np.clip(rng.lognormal(2.85, 0.5, len(idx)), 0.0, 409.68), 2),
+    })
+    return df_orders, df_items, df_customers
+
+
+def generate_olist(out_dir, scale=1.0, seed=42, chunk_orders=CHUNK_ORDERS, geo_points_per_prefix=GEO_POINTS_PER_PREFIX):
+    """
+    Ghi 5 file CSV Olist tổng hợp vào out_dir. Bỏ qua nếu out_dir đã có đúng (scale, seed).
+    Trả về dict {tên file: số dòng}.
+    """
+    out_dir = Path(out_dir)
+    manifest_path = out_dir / 'synthetic_olist.json'
+    params = {'scale': scale, 'seed': seed, 'chunk_orders': chunk_orders, 'geo_points_per_prefix': geo_points_per_prefix}
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text(encoding='utf-8'))
+        if manifest.get('params') == params and set(manifest.get('rows', {})) == set(OLIST_FILES.values()):
+            logging.info(f"Dữ liệu tổng hợp scale={scale} đã có trong {out_dir}, bỏ qua.")
+            return manifest['rows']
+        manifest_path.unlink()
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    n_orders = max(int(round(BASE_ORDERS * scale)), 1)
+    df_zip = zip_prefixes(rng)
+    df_sellers = make_sellers(rng, df_zip, max(int(round(BASE_SELLERS * scale)), 1))
+    product_ids = hex_ids(rng, max(int(round(BASE_PRODUCTS * scale)), 1))
+    unique_ids = hex_ids(rng, max(int(round(n_orders * (1 - REPEAT_CUSTOMER_RATE))), 1))
+
+    rows = {}
+    df_geo = make_geolocation(rng, df_zip, geo_points_per_prefix)
+    df_geo.to_csv(out_dir / OLIST_FILES['geolocation'], index=False)
+    rows[OLIST_FILES['geolocation']] = len(df_geo)
+    del df_geo
+    df_sellers.to_csv(out_dir / OLIST_FILES['sellers'], index=False)
+    rows[OLIST_FILES['sellers']] = len(df_sellers)
+    df_products, df_translation = make_products(rng, product_ids)
+    df_products.to_csv(out_dir / OLIST_FILES['products'], index=False)
+    rows[OLIST_FILES['products']] = len(df_products)
+    df_translation.to_csv(out_dir / OLIST_FILES['category_translation'], index=False)
+    rows[OLIST_FILES['category_translation']] = len(df_translation)
+    del df_products
+
+    seller_ids = df_sellers['seller_id'].to_numpy()
+    chunk_starts = range(0, n_orders, chunk_orders)
+    for chunk_no, start in enumerate(chunk_starts):
+        chunk_rng = np.random.default_rng([seed, chunk_no])
+        frames = make_orders_chunk(chunk_rng, start, min(chunk_orders, n_orders - start), df_zip,
+                                   seller_ids, product_ids, unique_ids)
+        for key, df in zip(['orders', 'order_items', 'customers'], frames):
+            file_name = OLIST_FILES[key]
+            df.to_csv(out_dir / file_name, mode='w' if chunk_no == 0 else 'a', header=chunk_no == 0, index=False)
+            rows[file_name] = rows.get(file_name, 0) + len(df)
+        logging.info(f"Sinh chunk {chunk_no + 1}/{len(chunk_starts)} ({start + len(frames[0])}/{n_orders} orders).")
+
+    manifest_path.write_text(json.dumps({'params': params, 'rows': rows}, indent=2), encoding='utf-8')
+    return rows
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Sinh bộ dữ liệu Olist tổng hợp")
+    parser.add_argument('--scale', type=float, default=1.0, help="1 = kích thước bộ Olist thật")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out-dir', type=Path, required=True)
+    args = parser.parse_args()
+    for file_name, count in generate_olist(args.out_dir, args.scale, args.seed).items():
+        print(f"{file_name}: {count} dòng")
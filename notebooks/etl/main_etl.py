@@ -1,188 +1,1164 @@
-def extract_load_to_staging(csv_files_map, data_dir, db_engine):
+import io
+import os
+import csv
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from etl.run_metrics import current_rss_mb, instrumented, peak_rss_mb, span
+
+# Danh sách các file CSV và bảng staging tương ứng
+CSV_FILES = {
+    'olist_orders_dataset.csv': 'staging.stg_orders',
+    'olist_order_items_dataset.csv': 'staging.stg_order_items',
+    'olist_customers_dataset.csv': 'staging.stg_customers',
+    'olist_sellers_dataset.csv': 'staging.stg_sellers',
+    'olist_geolocation_dataset.csv': 'staging.stg_geolocation',
+    'olist_products_dataset.csv': 'staging.stg_products',
+    'product_category_name_translation.csv': 'staging.stg_product_category_translation',
+}
+
+
+def database_uri_from_env():
+    """Tạo DATABASE_URI từ các biến môi trường giống notebook và run_validations.py."""
+    db_user = os.getenv('POSTGRES_USER')
+    db_password = os.getenv('POSTGRES_PASSWORD')
+    db_host = os.getenv('POSTGRES_HOST', 'postgres')
+    db_port = os.getenv('POSTGRES_PORT', '5432')
+    db_name = os.getenv('POSTGRES_DB')
+    return f'postgresql+psycopg2://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}'
+
+
+class CsvCopyStream:
     """
-    Extract dữ liệu từ các file CSV và load vào bảng staging tương ứng.
-    Xóa dữ liệu cũ trong staging trước khi load.
+    File-like object để stream nội dung CSV thô vào COPY FROM STDIN.
+    Nối thêm cột _load_timestamp vào cuối mỗi record mà không cần parse CSV
+    (các dòng nằm trong field có dấu nháy kép được giữ nguyên).
     """
-    logging.info("Bắt đầu quá trình Extract và Load vào Staging...")
-    with db_engine.connect() as connection:
-        for csv_file, table_name in csv_files_map.items():
-            start_time = time.time()
-            file_path = data_dir / csv_file
-            if not file_path.exists():
-                logging.warning(f"File không tồn tại: {file_path}, bỏ qua.")
+
+    def __init__(self, fileobj, load_timestamp):
+        self._lines = iter(fileobj)
+        self._suffix = b',' + str(load_timestamp).encode('utf-8')
+        self._buffer = b''
+        self._in_quotes = False
+        self.rows = 0
+
+        header = next(self._lines, b'').decode('utf-8-sig').strip()
+        self.columns = next(csv.reader([header])) if header else []
+
+    def _next_record_chunk(self):
+        for line in self._lines:
+            content = line.rstrip(b'\r\n')
+            if self._in_quotes:
+                # Dòng tiếp nối của một field nhiều dòng
+                self._in_quotes = (content.count(b'"') % 2 == 0)
+                if self._in_quotes:
+                    return content + b'\n'
+                self.rows += 1
+                return content + self._suffix + b'\n'
+            if not content:
                 continue
+            if content.count(b'"') % 2 == 1:
+                self._in_quotes = True
+                return content + b'\n'
+            self.rows += 1
+            return content + self._suffix + b'\n'
+        return b''
 
-            try:
-                logging.info(f"Đọc file: {csv_file}")
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = self._next_record_chunk()
+            if not chunk:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def copy_csv_to_staging(file_path, table_name, connection, load_timestamp=None):
+    """
+    Load một file CSV vào bảng staging bằng COPY FROM STDIN (không tạo DataFrame).
+    Trả về số dòng đã load.
+    """
+    load_timestamp = load_timestamp or pd.Timestamp.now()
+    with open(file_path, 'rb') as f:
+        stream = CsvCopyStream(f, load_timestamp)
+        columns = ', '.join(f'"{col}"' for col in stream.columns + ['_load_timestamp'])
+        copy_sql = f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv, ENCODING 'UTF8')"
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(copy_sql, stream, size=1 << 16)
+        finally:
+            cursor.close()
+    return stream.rows
+
+
+def _to_sql_csv_to_staging(file_path, table_name, connection, load_timestamp=None):
+    """Đường load cũ: đọc CSV thành DataFrame (dtype=str) rồi df.to_sql."""
+    df = pd.read_csv(file_path, dtype=str)
+    df['_load_timestamp'] = load_timestamp or pd.Timestamp.now() # Thêm metadata thời gian load
+    df.to_sql(
+        name=table_name.split('.')[1], # Chỉ lấy tên bảng
+        con=connection,
+        schema=table_name.split('.')[0], # Chỉ lấy tên schema
+        if_exists='append', # Vì đã truncate nên dùng append
+        index=False,
+        chunksize=10000 # Load theo chunk để tiết kiệm bộ nhớ
+    )
+    return len(df)
+
+
+# Hàm parse an toàn (07_create_etl_functions.sql) cho từng kiểu cột của typed staging (02b)
+TYPED_STAGING_CASTS = {
+    'numeric': 'dwh.try_cast_numeric',
+    'timestamp without time zone': 'dwh.try_cast_timestamp',
+    'double precision': 'dwh.try_cast_double',
+    'integer': 'dwh.try_cast_integer',
+}
+
+# Parse toàn bộ bảng raw một lần: dòng có giá trị không cast được -> staging.stg_rejects,
+# các dòng còn lại -> bảng staging. Trả về một dòng (loaded, rejected).
+TYPED_STAGING_INSERT_SQL = """
+    WITH parsed AS (
+        SELECT r AS raw, {parsed_list}
+        FROM {raw_table} r
+    ),
+    checked AS (
+        SELECT p.*, ARRAY_REMOVE(ARRAY[{invalid_list}]::TEXT[], NULL) AS invalid_columns
+        FROM parsed p
+    ),
+    rejected AS (
+        INSERT INTO staging.stg_rejects (table_name, raw_record, reject_reason)
+        SELECT :table_name, to_jsonb(c.raw), 'invalid value in: ' || array_to_string(c.invalid_columns, ', ')
+        FROM checked c
+        WHERE cardinality(c.invalid_columns) > 0
+        RETURNING 1
+    ),
+    loaded AS (
+        INSERT INTO {table_name} ({column_list})
+        SELECT {column_list} FROM checked c
+        WHERE cardinality(c.invalid_columns) = 0
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM loaded), (SELECT COUNT(*) FROM rejected);
+"""
+
+
+def staging_column_types(connection, table_name):
+    """Trả về dict {column_name: data_type} của một bảng (theo information_schema)."""
+    schema, table = table_name.split('.')
+    result = connection.execute(text("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = :schema AND table_name = :table
+        ORDER BY ordinal_position;
+    """), {'schema': schema, 'table': table})
+    return dict(result.fetchall())
+
+
+def copy_csv_to_typed_staging(file_path, table_name, connection, load_timestamp=None):
+    """
+    Load một file CSV vào bảng staging có kiểu (02b_create_typed_staging_tables.sql).
+    CSV thô được COPY vào một bảng tạm toàn TEXT, rồi parse một lần bằng các hàm
+    dwh.try_cast_* theo kiểu cột của bảng đích. Dòng có giá trị không hợp lệ
+    được ghi vào staging.stg_rejects thay vì làm hỏng cả lần load.
+    Trả về số dòng đã load (không tính dòng bị reject).
+    """
+    load_timestamp = load_timestamp or pd.Timestamp.now()
+    column_types = staging_column_types(connection, table_name)
+    raw_table = f"tmp_{table_name.split('.')[1]}_raw"
+
+    with open(file_path, 'rb') as f:
+        stream = CsvCopyStream(f, load_timestamp)
+        columns = stream.columns + ['_load_timestamp']
+        unknown = [col for col in columns if col not in column_types]
+        if unknown:
+            raise ValueError(f"Columns not found in {table_name}: {unknown}")
+        connection.execute(text(
+            f"CREATE TEMP TABLE {raw_table} ("
+            + ', '.join(f'"{col}" TEXT' for col in columns)
+            + ") ON COMMIT DROP;"
+        ))
+        column_list = ', '.join(f'"{col}"' for col in columns)
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {raw_table} ({column_list}) FROM STDIN WITH (FORMAT csv, ENCODING 'UTF8')",
+                stream, size=1 << 16
+            )
+        finally:
+            cursor.close()
+
+    connection.execute(
+        text("DELETE FROM staging.stg_rejects WHERE table_name = :table_name;"),
+        {'table_name': table_name}
+    )
+    parsed, invalid = [], []
+    for col in columns:
+        cast_func = TYPED_STAGING_CASTS.get(column_types[col])
+        if cast_func is None:
+            parsed.append(f'r."{col}" AS "{col}"')
+            continue
+        parsed.append(f'{cast_func}(NULLIF(r."{col}", \'\')) AS "{col}"')
+        # Giá trị rỗng/NULL là hợp lệ; chỉ reject khi có giá trị mà cast ra NULL
+        invalid.append(f"CASE WHEN (p.raw).\"{col}\" <> '' AND p.\"{col}\" IS NULL THEN '{col}' END")
+
+    loaded, rejected = connection.execute(text(TYPED_STAGING_INSERT_SQL.format(
+        parsed_list=', '.join(parsed),
+        invalid_list=', '.join(invalid),
+        raw_table=raw_table,
+        table_name=table_name,
+        column_list=column_list,
+    )), {'table_name': table_name}).one()
+    if rejected:
+        logging.warning(f"{rejected} dòng của {file_path.name} bị ghi vào staging.stg_rejects (giá trị không hợp lệ).")
+    return loaded
+
+
+# Kiểu dữ liệu khi chuyển CSV sang Parquet ở landing zone; các cột còn lại giữ dạng string
+# (zip prefix, id... có số 0 ở đầu).
+LANDING_SCHEMAS = {
+    'olist_orders_dataset.csv': {
+        'timestamp': [
+            'order_purchase_timestamp', 'order_approved_at', 'order_delivered_carrier_date',
+            'order_delivered_customer_date', 'order_estimated_delivery_date'
+        ],
+    },
+    'olist_order_items_dataset.csv': {
+        'timestamp': ['shipping_limit_date'],
+        'integer': ['order_item_id'],
+        'numeric': ['price', 'freight_value'],
+    },
+    'olist_geolocation_dataset.csv': {
+        'numeric': ['geolocation_lat', 'geolocation_lng'],
+    },
+    'olist_products_dataset.csv': {
+        'integer': [
+            'product_name_lenght', 'product_description_lenght', 'product_photos_qty',
+            'product_weight_g', 'product_length_cm', 'product_height_cm', 'product_width_cm'
+        ],
+    },
+}
+
+
+def file_checksum(file_path, chunk_size=1 << 20):
+    """sha256 của nội dung file (đọc theo chunk)."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def land_csv_to_parquet(csv_path, landing_dir=None):
+    """
+    Chuyển một file CSV thô sang Parquet (có kiểu, nén zstd) trong landing zone, một lần
+    cho mỗi nội dung file: tên file Parquet chứa checksum của CSV nguồn, nên file không đổi
+    sẽ không bị parse lại. Các phiên bản cũ của cùng file được xóa.
+    landing_dir mặc định là <thư mục CSV>/landing. Trả về đường dẫn file Parquet.
+    """
+    csv_path = Path(csv_path)
+    landing_dir = Path(landing_dir) if landing_dir else csv_path.parent / 'landing'
+    landing_dir.mkdir(parents=True, exist_ok=True)
+    checksum = file_checksum(csv_path)
+    parquet_path = landing_dir / f"{csv_path.stem}.{checksum[:16]}.parquet"
+    if parquet_path.exists():
+        logging.info(f"Landing: {csv_path.name} không thay đổi, dùng lại {parquet_path.name}.")
+        return parquet_path
+
+    with span(f"landing.{csv_path.stem}") as landing_span:
+        df = pd.read_csv(csv_path, dtype=str, keep_default_na=False, na_values=[''])
+        schema = LANDING_SCHEMAS.get(csv_path.name, {})
+        for col in schema.get('timestamp', []):
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+        for col in schema.get('integer', []):
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+        for col in schema.get('numeric', []):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+        # Ghi ra file tạm rồi rename để một lần chạy lỗi không để lại Parquet dở dang
+        tmp_path = parquet_path.with_suffix('.parquet.tmp')
+        df.to_parquet(tmp_path, index=False, compression='zstd')
+        tmp_path.replace(parquet_path)
+        for stale in landing_dir.glob(f"{csv_path.stem}.*.parquet"):
+            if stale != parquet_path:
+                stale.unlink()
+        landing_span.rows = len(df)
+    logging.info(f"Landing: {csv_path.name} -> {parquet_path.name} ({len(df)} dòng).")
+    return parquet_path
 
-                df = pd.read_csv(file_path, dtype=str)
-                df['_load_timestamp'] = pd.Timestamp.now() # Thêm metadata thời gian load
 
-                logging.info(f"Load dữ liệu vào bảng: {table_name}")
+def read_landed(csv_path, columns=None, landing_dir=None):
+    """Đọc bản Parquet của một file CSV (land nếu cần), chỉ đọc các cột cần thiết, memory-mapped."""
+    parquet_path = land_csv_to_parquet(csv_path, landing_dir)
+    return pd.read_parquet(parquet_path, columns=columns, memory_map=True)
+
+
+def copy_parquet_to_staging(file_path, table_name, connection, load_timestamp=None):
+    """
+    Load một file CSV vào bảng staging qua landing zone: đọc bản Parquet (chỉ parse CSV
+    khi nội dung file thay đổi) rồi COPY vào bảng staging. Trả về số dòng đã load.
+    """
+    df = read_landed(file_path)
+    df['_load_timestamp'] = load_timestamp or pd.Timestamp.now()
+    copy_dataframe(df, table_name, connection)
+    return len(df)
+
+
+STAGING_LOADERS = {
+    'copy': copy_csv_to_staging,
+    'to_sql': _to_sql_csv_to_staging,
+    'typed': copy_csv_to_typed_staging,
+    'parquet': copy_parquet_to_staging,
+}
+
+
+def copy_dataframe(df, table_name, connection):
+    """Ghi DataFrame vào bảng có sẵn bằng COPY FROM STDIN (NA/NaN -> NULL)."""
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    columns = ', '.join(f'"{col}"' for col in df.columns)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+
+SOURCE_MANIFEST_SELECT_SQL = """
+SELECT file_size, file_mtime_ns, content_hash, row_count
+FROM staging.etl_source_manifest
+WHERE table_name = :table_name;
+"""
+
+SOURCE_MANIFEST_UPSERT_SQL = """
+INSERT INTO staging.etl_source_manifest (table_name, file_name, file_size, file_mtime_ns, content_hash, row_count, loaded_at)
+VALUES (:table_name, :file_name, :file_size, :file_mtime_ns, :content_hash, :row_count, :loaded_at)
+ON CONFLICT (table_name) DO UPDATE SET
+    file_name = EXCLUDED.file_name,
+    file_size = EXCLUDED.file_size,
+    file_mtime_ns = EXCLUDED.file_mtime_ns,
+    content_hash = EXCLUDED.content_hash,
+    row_count = EXCLUDED.row_count,
+    loaded_at = EXCLUDED.loaded_at;
+"""
+
+
+def source_fingerprint(file_path, previous=None):
+    """
+    Fingerprint của một file nguồn: {'file_size', 'file_mtime_ns', 'content_hash'}.
+    Nếu size và mtime khớp với previous (bản ghi manifest của lần load trước) thì dùng lại
+    content_hash cũ mà không đọc file; ngược lại tính sha256 nội dung (file_checksum).
+    """
+    stat = Path(file_path).stat()
+    fingerprint = {'file_size': stat.st_size, 'file_mtime_ns': stat.st_mtime_ns}
+    if previous is not None and all(previous[key] == value for key, value in fingerprint.items()):
+        fingerprint['content_hash'] = previous['content_hash']
+    else:
+        fingerprint['content_hash'] = file_checksum(file_path)
+    return fingerprint
+
+
+def _load_staging_table(connection, csv_file, table_name, data_dir, loader, skip_unchanged=False):
+    """
+    TRUNCATE + load một file CSV vào một bảng staging, commit riêng cho bảng đó cùng với
+    fingerprint của file trong staging.etl_source_manifest.
+    skip_unchanged=True: bỏ qua file có nội dung (sha256) giống lần load trước.
+    Lỗi được log và rollback; trả về dict thống kê hoặc None nếu bỏ qua/lỗi.
+    """
+    file_path = Path(data_dir) / csv_file
+    if not file_path.exists():
+        logging.warning(f"File không tồn tại: {file_path}, bỏ qua.")
+        return None
+
+    try:
+        with span(f"staging.{table_name.split('.')[-1]}") as load_span:
+            previous = connection.execute(text(SOURCE_MANIFEST_SELECT_SQL), {'table_name': table_name}).mappings().first()
+            fingerprint = source_fingerprint(file_path, previous)
+            unchanged = (
+                skip_unchanged and previous is not None
+                and previous['content_hash'] == fingerprint['content_hash']
+                # Bảng staging bị TRUNCATE bên ngoài ETL thì vẫn load lại
+                and (previous['row_count'] == 0
+                     or connection.execute(text(f"SELECT EXISTS (SELECT 1 FROM {table_name});")).scalar())
+            )
+            if unchanged:
+                if previous['file_mtime_ns'] != fingerprint['file_mtime_ns']:
+                    # Chỉ mtime đổi (file được ghi lại cùng nội dung): lần sau không cần hash lại
+                    connection.execute(
+                        text("UPDATE staging.etl_source_manifest SET file_mtime_ns = :file_mtime_ns WHERE table_name = :table_name;"),
+                        {'file_mtime_ns': fingerprint['file_mtime_ns'], 'table_name': table_name}
+                    )
+                    connection.commit()
+                load_span.rows = 0
+            else:
+                logging.info(f"Load file {csv_file} vào bảng: {table_name}")
                 # Xóa dữ liệu cũ trong bảng staging
                 connection.execute(text(f"TRUNCATE TABLE {table_name};"))
                 # Load dữ liệu mới
-                df.to_sql(
-                    name=table_name.split('.')[1], # Chỉ lấy tên bảng
-                    con=connection,
-                    schema=table_name.split('.')[0], # Chỉ lấy tên schema
-                    if_exists='append', # Vì đã truncate nên dùng append
-                    index=False,
-                    chunksize=10000 # Load theo chunk để tiết kiệm bộ nhớ
-                )
+                load_span.rows = loader(file_path, table_name, connection)
+                connection.execute(text(SOURCE_MANIFEST_UPSERT_SQL), {
+                    'table_name': table_name, 'file_name': csv_file, 'row_count': load_span.rows,
+                    'loaded_at': pd.Timestamp.now(), **fingerprint,
+                })
                 connection.commit() # Commit sau mỗi bảng staging
-                end_time = time.time()
-                logging.info(f"Hoàn thành load {table_name} trong {end_time - start_time:.2f} giây.")
+        if unchanged:
+            logging.info(f"{csv_file} không thay đổi kể từ lần load trước ({previous['row_count']} dòng), bỏ qua {table_name}.")
+        else:
+            logging.info(f"Hoàn thành load {load_span.rows} dòng vào {table_name}.")
+        return {'rows': load_span.rows, 'seconds': load_span.wall_seconds, 'rows_per_sec': load_span.rows_per_second,
+                'skipped': unchanged}
 
-            except Exception as e:
-                logging.error(f"Lỗi khi xử lý file {csv_file} hoặc load vào {table_name}: {e}")
-                connection.rollback()
+    except Exception as e:
+        logging.error(f"Lỗi khi xử lý file {csv_file} hoặc load vào {table_name}: {e}")
+        connection.rollback()
+        return None
+
+
+def _load_staging_table_pooled(pool_engine, csv_file, table_name, data_dir, loader, skip_unchanged=False):
+    """Chạy _load_staging_table trên một connection riêng lấy từ pool."""
+    with pool_engine.connect() as connection:
+        return _load_staging_table(connection, csv_file, table_name, data_dir, loader, skip_unchanged)
+
+
+def extract_load_to_staging(csv_files_map, data_dir, db_engine, method='copy', max_workers=1, skip_unchanged=False):
+    """
+    Extract dữ liệu từ các file CSV và load vào bảng staging tương ứng.
+    Xóa dữ liệu cũ trong staging trước khi load.
+
+    method: 'copy' (mặc định, stream CSV thô bằng COPY FROM STDIN),
+            'typed' (COPY rồi parse một lần vào staging có kiểu của 02b, dòng lỗi -> stg_rejects),
+            'parquet' (đọc bản Parquet trong landing zone, chỉ parse lại CSV khi checksum thay đổi)
+            hoặc 'to_sql' (đường cũ qua pandas DataFrame).
+    max_workers: > 1 để load song song mỗi cặp csv_file -> bảng staging trên
+            một connection riêng (pool giới hạn đúng max_workers connection).
+    skip_unchanged: bỏ qua các file có fingerprint (size + mtime, sha256 nội dung) khớp với
+            staging.etl_source_manifest của lần load trước; mọi lần load đều ghi lại fingerprint.
+    Trả về dict {table_name: {'rows', 'seconds', 'rows_per_sec', 'skipped'}}.
+    """
+    if method not in STAGING_LOADERS:
+        raise ValueError(f"Unknown staging load method: {method}")
+    loader = STAGING_LOADERS[method]
+
+    logging.info(f"Bắt đầu quá trình Extract và Load vào Staging (method={method}, max_workers={max_workers})...")
+    load_stats = {}
+    with span('staging') as stage_span:
+        if max_workers <= 1:
+            with db_engine.connect() as connection:
+                for csv_file, table_name in csv_files_map.items():
+                    stats = _load_staging_table(connection, csv_file, table_name, data_dir, loader, skip_unchanged)
+                    if stats is not None:
+                        load_stats[table_name] = stats
+        else:
+            # Pool riêng, giới hạn số connection bằng số worker
+            pool_engine = create_engine(db_engine.url, pool_size=max_workers, max_overflow=0)
+            try:
+                with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='staging') as executor:
+                    futures = {
+                        table_name: executor.submit(
+                            _load_staging_table_pooled, pool_engine, csv_file, table_name, data_dir, loader,
+                            skip_unchanged
+                        )
+                        for csv_file, table_name in csv_files_map.items()
+                    }
+                    for table_name, future in futures.items():
+                        stats = future.result()
+                        if stats is not None:
+                            load_stats[table_name] = stats
+            finally:
+                pool_engine.dispose()
+
+        stage_span.rows = sum(stats['rows'] for stats in load_stats.values())
+
+    sum_table_time = sum(stats['seconds'] for stats in load_stats.values())
+    skipped = sum(stats['skipped'] for stats in load_stats.values())
+    logging.info(
+        f"Hoàn thành Extract và Load vào Staging: {len(load_stats)}/{len(csv_files_map)} bảng "
+        f"({skipped} bảng không thay đổi), "
+        f"wall-clock {stage_span.wall_seconds:.2f} giây, tổng thời gian từng bảng {sum_table_time:.2f} giây."
+    )
+    return load_stats
+
+
+# Input của mỗi stage: bảng staging (content_hash trong etl_source_manifest) hoặc stage phía trước
+STAGE_INPUTS = {
+    'dim_customer': ['staging.stg_customers', 'staging.stg_geolocation'],
+    'dim_seller': ['staging.stg_sellers', 'staging.stg_geolocation'],
+    'dim_product': ['staging.stg_products', 'staging.stg_product_category_translation'],
+    'fact': ['staging.stg_orders', 'staging.stg_order_items', 'dim_customer', 'dim_seller', 'dim_product'],
+}
+
+STAGE_INPUTS_SQL = """
+SELECT table_name, content_hash
+FROM staging.etl_source_manifest
+WHERE table_name = ANY(:inputs)
+UNION ALL
+SELECT stage_name, COALESCE(input_fingerprint, '') || '@' || completed_at::text
+FROM dwh.etl_stage_state
+WHERE stage_name = ANY(:inputs);
+"""
+
+STAGE_STATE_UPSERT_SQL = """
+INSERT INTO dwh.etl_stage_state (stage_name, input_fingerprint, completed_at)
+VALUES (:stage_name, :input_fingerprint, clock_timestamp())
+ON CONFLICT (stage_name) DO UPDATE SET
+    input_fingerprint = EXCLUDED.input_fingerprint,
+    completed_at = EXCLUDED.completed_at;
+"""
+
+
+def stage_input_fingerprint(connection, stage_name):
+    """
+    sha256 của fingerprint mọi input của stage (STAGE_INPUTS). Stage phía trước được tính theo
+    lần build gần nhất của nó, nên build lại một Dimension thì Fact cũng phải build lại.
+    None nếu có input chưa có fingerprint (vd. bảng staging load trước khi có manifest).
+    """
+    inputs = STAGE_INPUTS[stage_name]
+    rows = connection.execute(text(STAGE_INPUTS_SQL), {'inputs': inputs}).all()
+    if len(rows) < len(inputs):
+        return None
+    digest = hashlib.sha256()
+    for input_name, fingerprint in sorted(rows):
+        digest.update(f"{input_name}={fingerprint}\n".encode())
+    return digest.hexdigest()
+
+
+def stage_is_current(connection, stage_name, input_fingerprint):
+    """True nếu lần build gần nhất của stage đã dùng đúng các input có fingerprint này."""
+    if input_fingerprint is None:
+        return False
+    built = connection.execute(
+        text("SELECT input_fingerprint FROM dwh.etl_stage_state WHERE stage_name = :stage_name;"),
+        {'stage_name': stage_name}
+    ).scalar()
+    return built == input_fingerprint
+
+
+def record_stage_state(connection, stage_name, input_fingerprint):
+    """Ghi input của lần build này; gọi trong transaction của stage nên build lỗi sẽ không được ghi."""
+    connection.execute(text(STAGE_STATE_UPSERT_SQL), {'stage_name': stage_name, 'input_fingerprint': input_fingerprint})
+
+
+# Cấu hình session khi build lại index sau bulk load
+BULK_LOAD_MAINTENANCE_WORK_MEM = '512MB'
+BULK_LOAD_PARALLEL_WORKERS = 4
+
+
+def drop_indexes_for_bulk_load(connection, table_name):
+    """
+    Bulk load: đọc định nghĩa các index (trừ index của PRIMARY KEY/UNIQUE constraint)
+    và foreign key của bảng từ catalog, rồi DROP chúng để load không phải cập nhật
+    index/kiểm tra FK từng dòng. Trả về dict định nghĩa để rebuild_indexes_after_bulk_load dùng.
+    DDL nằm trong transaction của load: lỗi -> rollback khôi phục lại index/FK.
+    """
+    span_prefix = f"bulk_load.{table_name.split('.')[-1]}"
+    indexes = connection.execute(text("""
+        SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        WHERE i.indrelid = CAST(:table_name AS regclass)
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_constraint c
+              WHERE c.conrelid = i.indrelid AND c.conindid = i.indexrelid
+          )
+        ORDER BY 1;
+    """), {'table_name': table_name}).all()
+    foreign_keys = connection.execute(text("""
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = CAST(:table_name AS regclass) AND contype = 'f'
+        ORDER BY 1;
+    """), {'table_name': table_name}).all()
+    partitioned = connection.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = CAST(:table_name AS regclass));"
+    ), {'table_name': table_name}).scalar()
+
+    logging.info(f"Bulk load {table_name}: drop {len(indexes)} index, {len(foreign_keys)} FK.")
+    with span(f"{span_prefix}.drop"):
+        for constraint_name, _ in foreign_keys:
+            connection.execute(text(f"ALTER TABLE {table_name} DROP CONSTRAINT {constraint_name};"))
+        for index_name, _ in indexes:
+            connection.execute(text(f"DROP INDEX {index_name};"))
+    return {'table_name': table_name, 'indexes': indexes, 'foreign_keys': foreign_keys, 'partitioned': partitioned}
+
+
+def rebuild_indexes_after_bulk_load(connection, dropped):
+    """
+    Tạo lại các index/FK đã drop bởi drop_indexes_for_bulk_load sau khi load xong.
+    Index: build song song (max_parallel_maintenance_workers) với maintenance_work_mem lớn.
+    FK: thêm NOT VALID rồi VALIDATE CONSTRAINT (một lần quét thay vì kiểm tra từng dòng);
+    bảng partitioned chưa hỗ trợ NOT VALID nên FK được thêm và kiểm tra trực tiếp.
+    """
+    table_name = dropped['table_name']
+    span_prefix = f"bulk_load.{table_name.split('.')[-1]}"
+    connection.execute(text("SELECT set_config('maintenance_work_mem', :value, true);"),
+                       {'value': BULK_LOAD_MAINTENANCE_WORK_MEM})
+    connection.execute(text("SELECT set_config('max_parallel_maintenance_workers', :value, true);"),
+                       {'value': str(BULK_LOAD_PARALLEL_WORKERS)})
+
+    with span(f"{span_prefix}.rebuild_indexes"):
+        for index_name, index_def in dropped['indexes']:
+            # pg_get_indexdef của bảng partitioned là "ON ONLY": bỏ ONLY để build index cho mọi partition
+            with span(f"{span_prefix}.index.{index_name.split('.')[-1]}"):
+                connection.execute(text(index_def.replace(' ON ONLY ', ' ON ', 1)))
+
+    not_valid = '' if dropped['partitioned'] else ' NOT VALID'
+    with span(f"{span_prefix}.validate_foreign_keys"):
+        for constraint_name, constraint_def in dropped['foreign_keys']:
+            connection.execute(text(f"ALTER TABLE {table_name} ADD CONSTRAINT {constraint_name} {constraint_def}{not_valid};"))
+        if not dropped['partitioned']:
+            for constraint_name, _ in dropped['foreign_keys']:
+                connection.execute(text(f"ALTER TABLE {table_name} VALIDATE CONSTRAINT {constraint_name};"))
+
+    with span(f"{span_prefix}.analyze"):
+        connection.execute(text(f"ANALYZE {table_name};"))
+
+
+# Surrogate key và natural key của dòng Unknown trong mỗi Dimension (Fact dùng khi natural key NULL)
+UNKNOWN_MEMBER_KEY = -1
+UNKNOWN_MEMBER_ID = 'Unknown'
+
+# (surrogate key, natural key) của mỗi Dimension
+DIMENSION_KEYS = {
+    'dwh.dim_customer': ('customer_key', 'customer_id'),
+    'dwh.dim_seller': ('seller_key', 'seller_id'),
+    'dwh.dim_product': ('product_key', 'product_id'),
+}
+
+# Giá trị các cột NOT NULL của dòng Unknown và của các bản ghi inferred
+UNKNOWN_MEMBER_ATTRIBUTES = {
+    'dwh.dim_customer': {
+        'customer_unique_id': 'Unknown', 'customer_zip_code_prefix': '00000',
+        'customer_city': 'Unknown', 'customer_state': 'NA',
+    },
+    'dwh.dim_seller': {'seller_zip_code_prefix': '00000', 'seller_city': 'Unknown', 'seller_state': 'NA'},
+    'dwh.dim_product': {'product_category_name': 'Unknown', 'product_category_name_english': 'Unknown'},
+}
+
+# Nơi Fact đọc natural key của mỗi Dimension: (bảng staging, cột natural key), nối với tmp_fact_source qua order_id
+INFERRED_MEMBER_SOURCES = {
+    'dwh.dim_customer': ('staging.stg_orders', 'customer_id'),
+    'dwh.dim_seller': ('staging.stg_order_items', 'seller_id'),
+    'dwh.dim_product': ('staging.stg_order_items', 'product_id'),
+}
+
+
+def seed_unknown_members(connection, table_names=None):
+    """
+    Thêm dòng Unknown (surrogate key -1) vào các Dimension nếu chưa có, để key -1 của Fact
+    luôn thỏa FK. Idempotent (ON CONFLICT DO NOTHING); gọi sau TRUNCATE và trước mỗi lần load Fact.
+    """
+    for table_name in table_names or DIMENSION_KEYS:
+        key_col, natural_key = DIMENSION_KEYS[table_name]
+        member = {key_col: UNKNOWN_MEMBER_KEY, natural_key: UNKNOWN_MEMBER_ID, **UNKNOWN_MEMBER_ATTRIBUTES[table_name]}
+        connection.execute(text(f"""
+            INSERT INTO {table_name} ({', '.join(member)}, effective_start_date, is_current)
+            VALUES ({', '.join(f':{col}' for col in member)}, '1900-01-01', TRUE)
+            ON CONFLICT ({key_col}) DO NOTHING;
+        """), member)
+
+
+def create_inferred_members(connection):
+    """
+    Late-arriving dimension: thêm bản ghi inferred (is_inferred = TRUE, thuộc tính Unknown)
+    cho mọi natural key mà các order trong tmp_fact_source tham chiếu nhưng chưa có bản ghi
+    hiện hành trong Dimension, bằng một câu INSERT ... SELECT mỗi Dimension. Fact nhận
+    surrogate key thật thay vì -1; khi bản ghi thật xuất hiện trong staging,
+    merge_scd2_dimension ghi đè bản ghi inferred tại chỗ (giữ nguyên key).
+    Trả về {table_name: số bản ghi inferred đã thêm}.
+    """
+    created = {}
+    for table_name, (source_table, natural_key) in INFERRED_MEMBER_SOURCES.items():
+        attributes = UNKNOWN_MEMBER_ATTRIBUTES[table_name]
+        created[table_name] = connection.execute(text(f"""
+            INSERT INTO {table_name} ({natural_key}, {', '.join(attributes)}, is_inferred)
+            SELECT k.{natural_key}, {', '.join(f':{col}' for col in attributes)}, TRUE
+            FROM (
+                SELECT DISTINCT s.{natural_key}
+                FROM {source_table} s
+                JOIN tmp_fact_source t ON t.order_id = s.order_id
+                WHERE s.{natural_key} IS NOT NULL
+            ) k
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {table_name} d
+                WHERE d.{natural_key} = k.{natural_key} AND d.is_current = TRUE
+            );
+        """), attributes).rowcount
+    return created
+
+
+def merge_scd2_dimension(connection, df_dim, table_name, natural_key, load_timestamp):
+    """
+    Merge SCD Type 2 dạng set-based cho một Dimension.
+
+    So sánh hash (md5) các thuộc tính được theo dõi của staging với bản ghi hiện hành:
+    - bản ghi thay đổi: đóng bản ghi cũ (effective_end_date, is_current = FALSE) và thêm version mới
+    - natural key mới: thêm bản ghi mới
+    - không đổi: giữ nguyên (surrogate key ổn định, Fact không cần load lại)
+    - bản ghi inferred (create_inferred_members) của natural key nay đã có trong staging:
+      ghi đè tại chỗ, giữ surrogate key mà Fact đang tham chiếu
+    Trả về dict số lượng {'expired', 'inserted', 'unchanged', 'resolved'}.
+    """
+    tracked_cols = [col for col in df_dim.columns if col != natural_key]
+    source_cols = [natural_key] + tracked_cols
+    source_table = f"tmp_{table_name.split('.')[1]}_source"
+    column_list = ', '.join(source_cols)
+    tracked_hash_d = "md5(ROW(" + ', '.join(f"d.{col}" for col in tracked_cols) + ")::text)"
+    tracked_hash_s = "md5(ROW(" + ', '.join(f"s.{col}" for col in tracked_cols) + ")::text)"
+
+    # Bảng tạm có cùng kiểu cột với Dimension, load bằng COPY
+    connection.execute(text(
+        f"CREATE TEMP TABLE {source_table} ON COMMIT DROP AS "
+        f"SELECT {column_list} FROM {table_name} WITH NO DATA;"
+    ))
+    copy_dataframe(df_dim[source_cols], source_table, connection)
+    connection.execute(text(f"ANALYZE {source_table};"))
+
+    resolved = connection.execute(text(f"""
+        UPDATE {table_name} d
+        SET {', '.join(f'{col} = s.{col}' for col in tracked_cols)},
+            is_inferred = FALSE
+        FROM {source_table} s
+        WHERE d.{natural_key} = s.{natural_key}
+          AND d.is_current = TRUE
+          AND d.is_inferred = TRUE;
+    """)).rowcount
+
+    expired = connection.execute(text(f"""
+        UPDATE {table_name} d
+        SET effective_end_date = :load_ts,
+            is_current = FALSE
+        FROM {source_table} s
+        WHERE d.{natural_key} = s.{natural_key}
+          AND d.is_current = TRUE
+          AND {tracked_hash_d} <> {tracked_hash_s};
+    """), {'load_ts': load_timestamp}).rowcount
+
+    inserted = connection.execute(text(f"""
+        INSERT INTO {table_name} ({column_list}, effective_start_date, effective_end_date, is_current)
+        SELECT {', '.join(f's.{col}' for col in source_cols)}, :load_ts, NULL, TRUE
+        FROM {source_table} s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {table_name} d
+            WHERE d.{natural_key} = s.{natural_key} AND d.is_current = TRUE
+        );
+    """), {'load_ts': load_timestamp}).rowcount
+
+    return {'expired': expired, 'inserted': inserted, 'unchanged': len(df_dim) - inserted - resolved, 'resolved': resolved}
+
+
+def load_dimension_scd2(connection, df_dim, table_name, natural_key, full_reload=False,
+                        load_timestamp=None, chunksize=10000, bulk_load=False):
+    """
+    Load một Dimension: merge SCD2 (mặc định) hoặc load lại toàn bộ (full_reload=True: bảng đã được
+    truncate_for_full_reload làm rỗng trước đó, cùng với Fact).
+    bulk_load=True (chỉ khi full_reload): drop index/FK trước khi load và build lại sau đó.
+    """
+    load_timestamp = load_timestamp or pd.Timestamp.now()
+    if not full_reload:
+        seed_unknown_members(connection, [table_name])
+        counts = merge_scd2_dimension(connection, df_dim, table_name, natural_key, load_timestamp)
+        logging.info(
+            f"SCD2 merge {table_name}: {counts['inserted'] - counts['expired']} mới, "
+            f"{counts['expired']} thay đổi (version mới), {counts['resolved']} inferred được cập nhật, "
+            f"{counts['unchanged']} không đổi."
+        )
+        return counts
+
+    # Thêm các cột SCD (snake_case)
+    df_dim = df_dim.copy()
+    df_dim['effective_start_date'] = load_timestamp
+    df_dim['effective_end_date'] = pd.NaT # NULL trong DB
+    df_dim['is_current'] = True
+
+    dropped = drop_indexes_for_bulk_load(connection, table_name) if bulk_load else None
+
+    logging.info(f"Loading {len(df_dim)} rows into {table_name}...")
+    df_dim.to_sql(
+        name=table_name.split('.')[1],
+        con=connection,
+        schema=table_name.split('.')[0],
+        if_exists='append', # Đã truncate nên dùng append
+        index=False,
+        chunksize=chunksize
+    )
+    seed_unknown_members(connection, [table_name])
+    if dropped:
+        rebuild_indexes_after_bulk_load(connection, dropped)
+    return {'expired': 0, 'inserted': len(df_dim), 'unchanged': 0, 'resolved': 0}
+
+
+# Lọc tọa độ khi tính centroid: ngoài khung lãnh thổ Brazil hoặc cách median của prefix
+# quá GEO_OUTLIER_MAX_DEGREES (~110 km mỗi độ) bị loại.
+BRAZIL_LAT_RANGE = (-34.0, 5.5)
+BRAZIL_LNG_RANGE = (-74.0, -34.5)
+GEO_OUTLIER_MAX_DEGREES = 1.0
+
+
+class GeoLookup:
+    """
+    Tra cứu city/state chuẩn hóa và centroid (lat/lng) theo zip prefix (5 chữ số) bằng mảng
+    đánh index theo zip prefix dạng số nguyên (0..99999): city/state là mã categorical
+    (-1 = không có), lat/lng là float (NaN = không có).
+    City/state: mỗi prefix giữ bản ghi đầu tiên như drop_duplicates(keep='first');
+    chuẩn hóa chuỗi (lower/upper + strip) chỉ chạy trên các bản ghi được giữ.
+    """
+
+    size = 100_000
+    # Tăng khi thay đổi nội dung/định dạng cache
+    cache_version = 2
+
+    def __init__(self, city_codes, state_codes, cities, states, lat=None, lng=None):
+        self.city_codes = city_codes
+        self.state_codes = state_codes
+        self.cities = np.asarray(cities, dtype=str)
+        self.states = np.asarray(states, dtype=str)
+        self.lat = lat if lat is not None else np.full(self.size, np.nan)
+        self.lng = lng if lng is not None else np.full(self.size, np.nan)
+
+    @staticmethod
+    def zip_index(zip_prefixes):
+        """Zip prefix (chuỗi/số) -> mảng int64; giá trị không hợp lệ hoặc ngoài khoảng -> -1."""
+        values = pd.to_numeric(pd.Series(zip_prefixes), errors='coerce').to_numpy(dtype='float64')
+        valid = ~np.isnan(values) & (values >= 0) & (values < GeoLookup.size)
+        return np.where(valid, values, -1).astype(np.int64)
+
+    @classmethod
+    def from_frame(cls, df_geo):
+        """Build từ các cột geolocation_zip_code_prefix/city/state của stg_geolocation."""
+        # Giữ bản ghi đầu tiên của mỗi prefix trước, rồi mới parse/chuẩn hóa (~20k dòng thay vì ~1M)
+        df_first = df_geo.drop_duplicates(subset=['geolocation_zip_code_prefix'], keep='first')
+        zips = cls.zip_index(df_first['geolocation_zip_code_prefix'].to_numpy())
+        # Prefix khác chuỗi nhưng cùng số ('01037' / '1037'): giữ dòng đầu tiên
+        keep = zips >= 0
+        unique_zips, first = np.unique(zips[keep], return_index=True)
+        rows = np.flatnonzero(keep)[first]
+
+        cities, city_names = pd.factorize(df_first['geolocation_city'].str.lower().str.strip().to_numpy()[rows])
+        states, state_names = pd.factorize(df_first['geolocation_state'].str.upper().str.strip().to_numpy()[rows])
+        city_codes = np.full(cls.size, -1, dtype=np.int32)
+        state_codes = np.full(cls.size, -1, dtype=np.int32)
+        city_codes[unique_zips] = cities
+        state_codes[unique_zips] = states
+
+        lat = lng = None
+        if {'geolocation_lat', 'geolocation_lng'} <= set(df_geo.columns):
+            lat, lng = cls.centroids(df_geo)
+        return cls(city_codes, state_codes, city_names, state_names, lat, lng)
+
+    @classmethod
+    def centroids(cls, df_geo):
+        """
+        Centroid (trung bình lat/lng) của mọi tọa độ thuộc mỗi prefix, sau khi loại tọa độ
+        ngoài Brazil và tọa độ cách median của prefix quá GEO_OUTLIER_MAX_DEGREES.
+        Trả về hai mảng float đánh index theo zip prefix, làm tròn 6 chữ số (~0.1 m).
+        """
+        zips = cls.zip_index(df_geo['geolocation_zip_code_prefix'].to_numpy())
+        lat = pd.to_numeric(df_geo['geolocation_lat'], errors='coerce').to_numpy(dtype='float64')
+        lng = pd.to_numeric(df_geo['geolocation_lng'], errors='coerce').to_numpy(dtype='float64')
+        valid = (
+            (zips >= 0)
+            & (lat >= BRAZIL_LAT_RANGE[0]) & (lat <= BRAZIL_LAT_RANGE[1])
+            & (lng >= BRAZIL_LNG_RANGE[0]) & (lng <= BRAZIL_LNG_RANGE[1])
+        )
+        df_points = pd.DataFrame({'zip': zips[valid], 'lat': lat[valid], 'lng': lng[valid]})
+        grouped = df_points.groupby('zip', sort=False)[['lat', 'lng']]
+        median = grouped.transform('median')
+        near = (
+            (df_points['lat'] - median['lat']).abs().le(GEO_OUTLIER_MAX_DEGREES)
+            & (df_points['lng'] - median['lng']).abs().le(GEO_OUTLIER_MAX_DEGREES)
+        )
+        mean = df_points[near].groupby('zip')[['lat', 'lng']].mean().round(6)
+
+        centroid_lat = np.full(cls.size, np.nan)
+        centroid_lng = np.full(cls.size, np.nan)
+        centroid_lat[mean.index.to_numpy()] = mean['lat'].to_numpy()
+        centroid_lng[mean.index.to_numpy()] = mean['lng'].to_numpy()
+        return centroid_lat, centroid_lng
+
+    def lookup(self, zip_prefixes):
+        """Trả về DataFrame (city, state, lat, lng) theo thứ tự đầu vào; prefix không có -> NaN."""
+        index = zip_prefixes.index if isinstance(zip_prefixes, pd.Series) else None
+        zips = self.zip_index(zip_prefixes)
+        found = zips >= 0
+        positions = np.where(found, zips, 0)
+        city_codes = np.where(found, self.city_codes[positions], -1)
+        state_codes = np.where(found, self.state_codes[positions], -1)
+        return pd.DataFrame({
+            'city': pd.Categorical.from_codes(city_codes, categories=self.cities).astype(object),
+            'state': pd.Categorical.from_codes(state_codes, categories=self.states).astype(object),
+            'lat': np.where(found, self.lat[positions], np.nan),
+            'lng': np.where(found, self.lng[positions], np.nan),
+        }, index=index)
+
+    def __len__(self):
+        return int((self.city_codes >= 0).sum())
+
+    def save(self, path):
+        tmp_path = Path(f"{path}.tmp")
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, city_codes=self.city_codes, state_codes=self.state_codes,
+                     cities=self.cities, states=self.states, lat=self.lat, lng=self.lng)
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['city_codes'], data['state_codes'], data['cities'], data['states'], data['lat'], data['lng'])
+
+
+# Cache của GeoLookup: trong process và trên đĩa, theo thời điểm load + số dòng của stg_geolocation
+GEO_CACHE_DIR = Path(os.getenv('ETL_CACHE_DIR', Path.home() / '.cache' / 'olist_etl'))
+_geo_lookup_cache = {}
+_geo_lookup_lock = threading.Lock() # các Dimension load song song (etl/pipeline.py) chỉ build một lần
+
+
+def load_geo_lookup(connection, cache_dir=None):
+    """
+    Trả về GeoLookup cho nội dung hiện tại của staging.stg_geolocation.
+    Chỉ đọc và chuẩn hóa toàn bộ bảng khi staging được load lại (khóa cache thay đổi).
+    """
+    with _geo_lookup_lock:
+        cache_dir = Path(cache_dir) if cache_dir else GEO_CACHE_DIR
+        load_ts, row_count = connection.execute(text(
+            "SELECT MAX(_load_timestamp), COUNT(*) FROM staging.stg_geolocation;"
+        )).one()
+        cache_key = hashlib.sha256(f"{GeoLookup.cache_version}|{load_ts}|{row_count}".encode()).hexdigest()[:16]
+        cache_path = cache_dir / f"geo_lookup.{cache_key}.npz"
+
+        if cache_key in _geo_lookup_cache:
+            logging.info("Geo lookup: dùng cache trong bộ nhớ.")
+            return _geo_lookup_cache[cache_key]
+        if cache_path.exists():
+            geo_lookup = GeoLookup.load(cache_path)
+            logging.info(f"Geo lookup: đọc cache {cache_path.name}.")
+        else:
+            with span('dimensions.geo_lookup.build', rows=row_count):
+                df_geo = pd.read_sql(
+                    "SELECT geolocation_zip_code_prefix, geolocation_lat, geolocation_lng, geolocation_city, geolocation_state "
+                    "FROM staging.stg_geolocation",
+                    connection
+                )
+                geo_lookup = GeoLookup.from_frame(df_geo)
+                del df_geo
+                cache_dir.mkdir(parents=True, exist_ok=True)
+                geo_lookup.save(cache_path)
+                for stale in cache_dir.glob("geo_lookup.*.npz"):
+                    if stale != cache_path:
+                        stale.unlink()
+            logging.info(f"Geo lookup: build từ {row_count} dòng staging, lưu {cache_path.name}.")
+        _geo_lookup_cache.clear()
+        _geo_lookup_cache[cache_key] = geo_lookup
+        return geo_lookup
+
+
+# Cột số của stg_products (giữ tên gốc của file Olist) -> cột của dim_product
+PRODUCT_NUMERIC_COLUMNS = {
+    'product_name_lenght': 'product_name_length',
+    'product_description_lenght': 'product_description_length',
+    'product_photos_qty': 'product_photos_qty',
+    'product_weight_g': 'product_weight_g',
+    'product_length_cm': 'product_length_cm',
+    'product_height_cm': 'product_height_cm',
+    'product_width_cm': 'product_width_cm',
+}
+
+
+def build_dim_product(df_products, df_translation):
+    """
+    Dựng các dòng dim_product từ stg_products và bảng dịch tên category.
+    Category trống -> 'Unknown'; category không có bản dịch giữ tên tiếng Bồ Đào Nha.
+    """
+    df_dim_product = df_products[['product_id', 'product_category_name']].copy()
+    df_dim_product['product_category_name'] = df_dim_product['product_category_name'].fillna('Unknown')
+    translation = df_translation.set_index('product_category_name')['product_category_name_english']
+    df_dim_product['product_category_name_english'] = (
+        df_dim_product['product_category_name'].map(translation).fillna(df_dim_product['product_category_name'])
+    )
+    for source_col, dim_col in PRODUCT_NUMERIC_COLUMNS.items():
+        df_dim_product[dim_col] = pd.to_numeric(df_products[source_col], errors='coerce').astype('Int64')
+    return df_dim_product.drop_duplicates(subset=['product_id'], keep='last')
+
+
+def load_dim_customer(connection, load_timestamp, full_reload=False, bulk_load=False, geo_cache_dir=None):
+    """Transform staging.stg_customers (city/state/tọa độ theo GeoLookup) và load SCD2 vào dwh.dim_customer."""
+    logging.info("Load dữ liệu vào dwh.dim_customer...")
+    with span('dimensions.geo_lookup'):
+        geo_lookup = load_geo_lookup(connection, geo_cache_dir)
+    with span('dimensions.dim_customer') as dim_span:
+        df_cust_staging = pd.read_sql("SELECT * FROM staging.stg_customers", connection)
+
+        # Tra cứu city/state chuẩn hóa theo zip prefix
+        df_cust_staging['customer_zip_code_prefix'] = df_cust_staging['customer_zip_code_prefix'].astype(str)
+        df_cust_geo = geo_lookup.lookup(df_cust_staging['customer_zip_code_prefix'])
+
+        df_dim_cust = df_cust_staging[[
+            'customer_id',
+            'customer_unique_id',
+            'customer_zip_code_prefix'
+        ]].copy()
+        df_dim_cust['customer_city'] = df_cust_geo['city']
+        df_dim_cust['customer_state'] = df_cust_geo['state']
+        df_dim_cust['customer_lat'] = df_cust_geo['lat']
+        df_dim_cust['customer_lng'] = df_cust_geo['lng']
+
+        # Xử lý NULL sau merge và chuẩn hóa thêm nếu cần
+        df_dim_cust['customer_city'] = df_dim_cust['customer_city'].fillna('Unknown')
+        df_dim_cust['customer_state'] = df_dim_cust['customer_state'].fillna('NA')
+
+
+        dim_customer_cols = [
+            'customer_id', 'customer_unique_id', 'customer_zip_code_prefix',
+            'customer_city', 'customer_state', 'customer_lat', 'customer_lng'
+            #, 'customer_state_name', 'customer_region'
+        ]
+        df_dim_cust = df_dim_cust[dim_customer_cols]
+
+        # Lấy bản ghi cuối cùng cho mỗi customer_id nếu có trùng lặp trong staging
+        df_dim_cust = df_dim_cust.drop_duplicates(subset=['customer_id'], keep='last')
+
+        load_dimension_scd2(
+            connection, df_dim_cust, 'dwh.dim_customer', 'customer_id',
+            full_reload=full_reload, load_timestamp=load_timestamp, chunksize=10000,
+            bulk_load=bulk_load
+        )
+        dim_span.rows = len(df_dim_cust)
+    return dim_span.rows
+
+
+def load_dim_seller(connection, load_timestamp, full_reload=False, bulk_load=False, geo_cache_dir=None):
+    """Transform staging.stg_sellers (cùng GeoLookup với dim_customer) và load SCD2 vào dwh.dim_seller."""
+    logging.info("Load dữ liệu vào dwh.dim_seller...")
+    with span('dimensions.geo_lookup'):
+        geo_lookup = load_geo_lookup(connection, geo_cache_dir)
+    with span('dimensions.dim_seller') as dim_span:
+        df_seller_staging = pd.read_sql("SELECT * FROM staging.stg_sellers", connection)
+
+        # Tra cứu city/state chuẩn hóa theo zip prefix (cùng GeoLookup)
+        df_seller_staging['seller_zip_code_prefix'] = df_seller_staging['seller_zip_code_prefix'].astype(str)
+        df_seller_geo = geo_lookup.lookup(df_seller_staging['seller_zip_code_prefix'])
+
+        df_dim_seller = df_seller_staging[[
+            'seller_id',
+            'seller_zip_code_prefix'
+        ]].copy()
+        df_dim_seller['seller_city'] = df_seller_geo['city']
+        df_dim_seller['seller_state'] = df_seller_geo['state']
+        df_dim_seller['seller_lat'] = df_seller_geo['lat']
+        df_dim_seller['seller_lng'] = df_seller_geo['lng']
+        df_dim_seller['seller_city'] = df_dim_seller['seller_city'].fillna('Unknown')
+        df_dim_seller['seller_state'] = df_dim_seller['seller_state'].fillna('NA')
+
+
+        dim_seller_cols = [
+            'seller_id', 'seller_zip_code_prefix', 'seller_city', 'seller_state', 'seller_lat', 'seller_lng'
+        ]
+        df_dim_seller = df_dim_seller[dim_seller_cols]
+
+        df_dim_seller = df_dim_seller.drop_duplicates(subset=['seller_id'], keep='last')
+
+        load_dimension_scd2(
+            connection, df_dim_seller, 'dwh.dim_seller', 'seller_id',
+            full_reload=full_reload, load_timestamp=load_timestamp, chunksize=1000,
+            bulk_load=bulk_load
+        )
+        dim_span.rows = len(df_dim_seller)
+    return dim_span.rows
+
+
+def load_dim_product(connection, load_timestamp, full_reload=False, bulk_load=False, geo_cache_dir=None):
+    """Transform staging.stg_products + bản dịch category và load SCD2 vào dwh.dim_product (không dùng GeoLookup)."""
+    logging.info("Load dữ liệu vào dwh.dim_product...")
+    with span('dimensions.dim_product') as dim_span:
+        df_product_staging = pd.read_sql("SELECT * FROM staging.stg_products", connection)
+        df_translation = pd.read_sql(
+            "SELECT product_category_name, product_category_name_english "
+            "FROM staging.stg_product_category_translation", connection
+        ).drop_duplicates(subset=['product_category_name'], keep='last')
+        df_dim_product = build_dim_product(df_product_staging, df_translation)
+
+        load_dimension_scd2(
+            connection, df_dim_product, 'dwh.dim_product', 'product_id',
+            full_reload=full_reload, load_timestamp=load_timestamp, chunksize=10000,
+            bulk_load=bulk_load
+        )
+        dim_span.rows = len(df_dim_product)
+    return dim_span.rows
 
-    logging.info("Hoàn thành Extract và Load vào Staging.")
 
-def transform_and_load_dimensions(db_engine):
+# Các Dimension theo thứ tự load; tên cũng là stage_name trong dwh.etl_stage_state
+DIMENSION_LOADERS = {
+    'dim_customer': load_dim_customer,
+    'dim_seller': load_dim_seller,
+    'dim_product': load_dim_product,
+}
+
+
+def truncate_for_full_reload(connection, dimensions=None):
+    """
+    Full reload: TRUNCATE Fact và các Dimension (mặc định tất cả) trong một lệnh, và xóa trạng thái
+    stage của chúng trong dwh.etl_stage_state để skip_unchanged không bỏ qua bảng vừa bị làm rỗng.
+    Sau đó các Dimension chỉ INSERT, không còn lock trên Fact, nên có thể load song song.
+    """
+    dimensions = list(dimensions or DIMENSION_LOADERS)
+    tables = ['dwh.fact_order_delivery', 'dwh.fact_order_item'] + [f"dwh.{dim_name}" for dim_name in dimensions]
+    logging.info(f"Truncating {', '.join(tables)}...")
+    connection.execute(text(f"TRUNCATE TABLE {', '.join(tables)} CASCADE;")) # CASCADE để xóa FK refs
+    connection.execute(
+        text("DELETE FROM dwh.etl_stage_state WHERE stage_name = ANY(:stage_names);"),
+        {'stage_names': dimensions + ['fact']}
+    )
+
+
+@instrumented('dimensions')
+def transform_and_load_dimensions(db_engine, full_reload=False, bulk_load=False, geo_cache_dir=None, skip_unchanged=False,
+                                  dimensions=None, truncate=True):
     """
     Transform dữ liệu từ staging và load vào các bảng Dimension
-    (dim_customer, dim_seller)
+    (dim_customer, dim_seller, dim_product) trong một transaction của lần gọi này.
+
+    Mặc định merge SCD Type 2 (chỉ ghi các bản ghi mới/thay đổi, giữ nguyên surrogate key).
+    full_reload=True: TRUNCATE (một lần, truncate_for_full_reload, xóa luôn Fact) và load lại toàn bộ.
+    truncate=False (cùng full_reload): các bảng đã được truncate_for_full_reload ở bước trước
+          (etl/pipeline.py, stage dimensions.truncate), chỉ load.
+    bulk_load=True (cùng full_reload): drop index trước khi load và build lại song song sau đó.
+    geo_cache_dir: thư mục cache của GeoLookup (mặc định GEO_CACHE_DIR).
+    skip_unchanged=True: bỏ qua các Dimension có bảng staging đầu vào (STAGE_INPUTS) không thay đổi
+          kể từ lần build trước (với full_reload thì mọi Dimension đều được load lại).
+    dimensions: chỉ load các Dimension này (tên trong DIMENSION_LOADERS, mặc định tất cả);
+          etl/pipeline.py load mỗi Dimension trong một transaction riêng, song song.
     """
-    logging.info("Bắt đầu quá trình Transform và Load Dimensions (snake_case)...")
+    dimensions = list(dimensions or DIMENSION_LOADERS)
+    unknown = set(dimensions) - set(DIMENSION_LOADERS)
+    if unknown:
+        raise ValueError(f"Unknown dimensions: {sorted(unknown)}")
+
+    logging.info(f"Bắt đầu quá trình Transform và Load Dimensions ({', '.join(dimensions)})...")
+    load_timestamp = pd.Timestamp.now()
     with db_engine.connect() as connection:
 
         with connection.begin(): 
             try:
-                # --- 1. Chuẩn hóa Geolocation ---
-                logging.info("Chuẩn hóa dữ liệu Geolocation...")
-                df_geo = pd.read_sql("SELECT * FROM staging.stg_geolocation", connection)
-                df_geo['geolocation_city'] = df_geo['geolocation_city'].str.lower().str.strip()
-                df_geo['geolocation_state'] = df_geo['geolocation_state'].str.upper().str.strip()
-                # Loại bỏ các prefix trùng lặp, giữ lại bản ghi đầu tiên
-                geo_map = df_geo.drop_duplicates(subset=['geolocation_zip_code_prefix'], keep='first')
-                # Tạo index bằng zip_code_prefix để merge dễ dàng
-                geo_map = geo_map.set_index('geolocation_zip_code_prefix')[['geolocation_city', 'geolocation_state']]
-                logging.info(f"Tạo mapping cho {len(geo_map)} zip code prefixes.")
-
-                # --- 2. Load dim_customer ---
-                logging.info("Load dữ liệu vào dwh.dim_customer...")
-                start_time = time.time()
-                df_cust_staging = pd.read_sql("SELECT * FROM staging.stg_customers", connection)
-
-                # Merge với geo_map để lấy city/state chuẩn hóa
-                # Đảm bảo kiểu dữ liệu cột join là string
-                df_cust_staging['customer_zip_code_prefix'] = df_cust_staging['customer_zip_code_prefix'].astype(str)
-                df_merged_cust = pd.merge(
-                    df_cust_staging,
-                    geo_map,
-                    left_on='customer_zip_code_prefix',
-                    right_index=True,
-                    how='left'
-                )
-                
-                df_dim_cust = df_merged_cust[[
-                    'customer_id',
-                    'customer_unique_id',
-                    'customer_zip_code_prefix',
-                    'geolocation_city',  
-                    'geolocation_state'
-                ]].copy() 
-                
-                df_dim_cust = df_dim_cust.rename(columns={
-                    'geolocation_city': 'customer_city',
-                    'geolocation_state': 'customer_state'
-                })
-
-                # Xử lý NULL sau merge và chuẩn hóa thêm nếu cần
-                df_dim_cust['customer_city'] = df_dim_cust['customer_city'].fillna('Unknown')
-                df_dim_cust['customer_state'] = df_dim_cust['customer_state'].fillna('NA')
-
-
-                dim_customer_cols = [
-                    'customer_id', 'customer_unique_id', 'customer_zip_code_prefix',
-                    'customer_city', 'customer_state' #, 'customer_state_name', 'customer_region'
-                ]
-                df_dim_cust = df_dim_cust[dim_customer_cols]
-
-                # Xử lý SCD Type 2 (Phiên bản đơn giản - Chỉ load bản ghi mới nhất/duy nhất)
-                # Lấy bản ghi cuối cùng cho mỗi customer_id nếu có trùng lặp trong staging
-                df_dim_cust = df_dim_cust.drop_duplicates(subset=['customer_id'], keep='last')
-
-                # Thêm các cột SCD (snake_case)
-                df_dim_cust['effective_start_date'] = pd.Timestamp.now()
-                df_dim_cust['effective_end_date'] = pd.NaT # NULL trong DB
-                df_dim_cust['is_current'] = True
-
-                # Xóa dữ liệu cũ trong DimCustomer (cho lần load đầu hoặc full load)
-                logging.info("Truncating dwh.dim_customer...")
-                connection.execute(text("TRUNCATE TABLE dwh.dim_customer CASCADE;")) # CASCADE để xóa FK refs
-
-                logging.info(f"Loading {len(df_dim_cust)} rows into dwh.dim_customer...")
-                df_dim_cust.to_sql(
-                    name='dim_customer', 
-                    con=connection,
-                    schema='dwh',
-                    if_exists='append', # Đã truncate nên dùng append
-                    index=False,
-                    chunksize=10000
-                )
-                end_time = time.time()
-                logging.info(f"Hoàn thành load dim_customer trong {end_time - start_time:.2f} giây.")
-
-                
-                # ------------ 3. LOAD DIM_SELLER ------------------
-                logging.info("Load dữ liệu vào dwh.dim_seller...")
-                start_time = time.time()
-                df_seller_staging = pd.read_sql("SELECT * FROM staging.stg_sellers", connection)
-
-                # Merge với geo_map
-                df_seller_staging['seller_zip_code_prefix'] = df_seller_staging['seller_zip_code_prefix'].astype(str)
-                df_merged_seller = pd.merge(
-                    df_seller_staging,
-                    geo_map,
-                    left_on='seller_zip_code_prefix',
-                    right_index=True,
-                    how='left'
-                )
-                
-                df_dim_seller = df_merged_seller[[
-                    'seller_id',
-                    'seller_zip_code_prefix',
-                    'geolocation_city', 
-                    'geolocation_state' 
-                ]].copy() 
-                
-                df_dim_seller = df_dim_seller.rename(columns={
-                    'geolocation_city': 'seller_city',
-                    'geolocation_state': 'seller_state'
-                })
-                df_dim_seller['seller_city'] = df_dim_seller['seller_city'].fillna('Unknown')
-                df_dim_seller['seller_state'] = df_dim_seller['seller_state'].fillna('NA')
-
-
-                dim_seller_cols = [
-                    'seller_id', 'seller_zip_code_prefix', 'seller_city', 'seller_state'
-                ]
-                df_dim_seller = df_dim_seller[dim_seller_cols]
-
-                # Xử lý SCD Type 2 (Đơn giản)
-                df_dim_seller = df_dim_seller.drop_duplicates(subset=['seller_id'], keep='last')
-                df_dim_seller['effective_start_date'] = pd.Timestamp.now()
-                df_dim_seller['effective_end_date'] = pd.NaT
-                df_dim_seller['is_current'] = True
-
-                # Xóa dữ liệu cũ (cho lần load đầu)
-                logging.info("Truncating dwh.dim_seller...")
-                connection.execute(text("TRUNCATE TABLE dwh.dim_seller CASCADE;"))
-
-                logging.info(f"Loading {len(df_dim_seller)} rows into dwh.dim_seller...")
-                df_dim_seller.to_sql(
-                    name='dim_seller', 
-                    con=connection,
-                    schema='dwh',
-                    if_exists='append',
-                    index=False,
-                    chunksize=1000
-                )
-                end_time = time.time()
-                logging.info(f"Hoàn thành load dim_seller trong {end_time - start_time:.2f} giây.")
+                if full_reload and truncate:
+                    truncate_for_full_reload(connection, dimensions)
+                for dim_name in dimensions:
+                    input_fingerprint = stage_input_fingerprint(connection, dim_name)
+                    if skip_unchanged and stage_is_current(connection, dim_name, input_fingerprint):
+                        logging.info(f"Input của dwh.{dim_name} không thay đổi kể từ lần build trước, bỏ qua.")
+                        continue
+                    record_stage_state(connection, dim_name, input_fingerprint)
+                    DIMENSION_LOADERS[dim_name](
+                        connection, load_timestamp, full_reload=full_reload, bulk_load=bulk_load,
+                        geo_cache_dir=geo_cache_dir
+                    )
 
             except Exception as e:
                 logging.error(f"Lỗi trong quá trình Transform và Load Dimensions: {e}")
@@ -191,190 +1167,911 @@ def transform_and_load_dimensions(db_engine):
     logging.info("Hoàn thành Transform và Load Dimensions.")
 
 
-def transform_and_load_fact(db_engine):
+FACT_COLUMNS = [
+    'order_id', 'purchase_date_key', 'approved_date_key', 'delivered_carrier_date_key',
+    'delivered_customer_date_key', 'estimated_delivery_date_key', 'customer_key', 'seller_key',
+    'order_status', 'delivery_time_days', 'estimated_delivery_time_days', 'delivery_time_difference_days',
+    'is_late_delivery_flag', 'time_to_approve_hours', 'seller_processing_hours', 'carrier_shipping_hours',
+    'customer_seller_distance_km', 'item_count', 'total_freight_value', 'total_price', 'order_count',
+    'dw_load_timestamp', 'source_row_hash'
+]
+
+# Cột của unique index uidx_fod_order_id (phải chứa partition key purchase_date_key).
+# Order đổi ngày mua trong nguồn không xung đột với dòng cũ: FACT_MOVED_ORDERS_DELETE_SQL xóa dòng cũ trước khi upsert.
+FACT_CONFLICT_COLUMNS = ['order_id', 'purchase_date_key']
+
+# Hash nội dung của mỗi order trong staging (order + toàn bộ items của nó).
+# Dùng để phát hiện order mới/thay đổi so với lần load trước (cột source_row_hash trong Fact).
+FACT_SOURCE_SQL = """
+    CREATE TEMP TABLE tmp_fact_source ON COMMIT DROP AS
+    WITH item_signature AS (
+        SELECT
+            order_id,
+            string_agg(
+                ROW(order_item_id, product_id, seller_id, shipping_limit_date, price, freight_value)::text,
+                ',' ORDER BY order_item_id
+            ) AS item_sig
+        FROM staging.stg_order_items
+        GROUP BY order_id
+    )
+    SELECT
+        o.order_id,
+        md5(ROW(
+            o.customer_id, o.order_status, o.order_purchase_timestamp, o.order_approved_at,
+            o.order_delivered_carrier_date, o.order_delivered_customer_date,
+            o.order_estimated_delivery_date, s.item_sig
+        )::text) AS source_row_hash
+    FROM staging.stg_orders o
+    JOIN item_signature s ON s.order_id = o.order_id;
+"""
+
+# Chỉ giữ lại các order mới hoặc có hash khác với dòng Fact hiện tại
+FACT_DELTA_SQL = """
+    DELETE FROM tmp_fact_source t
+    USING dwh.fact_order_delivery f
+    WHERE f.order_id = t.order_id
+      AND f.source_row_hash = t.source_row_hash;
+"""
+
+# Chỉ giữ lại các order có ngày mua thuộc một tháng (load lại một partition của Fact)
+FACT_MONTH_FILTER_SQL = """
+    DELETE FROM tmp_fact_source t
+    USING staging.stg_orders o
+    WHERE o.order_id = t.order_id
+      AND DATE_TRUNC('month', dwh.try_cast_timestamp(o.order_purchase_timestamp))
+          IS DISTINCT FROM CAST(:month_start AS TIMESTAMP);
+"""
+
+# Các tháng (theo ngày mua) của những order sắp được load, để tạo partition trước
+FACT_SOURCE_MONTHS_SQL = """
+    SELECT DISTINCT DATE_TRUNC('month', dwh.try_cast_timestamp(o.order_purchase_timestamp))::DATE
+    FROM staging.stg_orders o
+    JOIN tmp_fact_source t ON t.order_id = o.order_id
+    WHERE dwh.try_cast_timestamp(o.order_purchase_timestamp) IS NOT NULL;
+"""
+
+# Engine "sql": toàn bộ bước transform Fact chạy trong PostgreSQL bằng một câu
+# INSERT ... SELECT (cùng measures, quy tắc giá trị âm -> NULL, key -1 và is_late_delivery_flag
+# như build_fact_frame). Dữ liệu không rời khỏi database.
+FACT_INSERT_SQL = """
+    INSERT INTO dwh.fact_order_delivery (
+        order_id, purchase_date_key, approved_date_key, delivered_carrier_date_key,
+        delivered_customer_date_key, estimated_delivery_date_key, customer_key, seller_key,
+        order_status, delivery_time_days, estimated_delivery_time_days, delivery_time_difference_days,
+        is_late_delivery_flag, time_to_approve_hours, seller_processing_hours, carrier_shipping_hours,
+        customer_seller_distance_km, item_count, total_freight_value, total_price, order_count,
+        dw_load_timestamp, source_row_hash
+    )
+    WITH items_agg AS (
+        SELECT
+            i.order_id,
+            COUNT(i.order_item_id) AS item_count,
+            SUM(COALESCE(dwh.try_cast_numeric(i.freight_value), 0)) AS total_freight_value,
+            SUM(COALESCE(dwh.try_cast_numeric(i.price), 0)) AS total_price,
+            (ARRAY_AGG(i.seller_id ORDER BY dwh.try_cast_integer(i.order_item_id)) FILTER (WHERE i.seller_id IS NOT NULL))[1] AS seller_id
+        FROM staging.stg_order_items i
+        JOIN tmp_fact_source t ON t.order_id = i.order_id
+        GROUP BY i.order_id
+    ),
+    orders AS (
+        SELECT
+            o.order_id,
+            o.customer_id,
+            o.order_status,
+            t.source_row_hash,
+            dwh.try_cast_timestamp(o.order_purchase_timestamp) AS purchase_ts,
+            dwh.try_cast_timestamp(o.order_approved_at) AS approved_ts,
+            dwh.try_cast_timestamp(o.order_delivered_carrier_date) AS carrier_ts,
+            dwh.try_cast_timestamp(o.order_delivered_customer_date) AS delivered_ts,
+            dwh.try_cast_timestamp(o.order_estimated_delivery_date) AS estimated_ts
+        FROM staging.stg_orders o
+        JOIN tmp_fact_source t ON t.order_id = o.order_id
+    ),
+    measures AS (
+        SELECT
+            o.*,
+            a.item_count,
+            a.total_freight_value,
+            a.total_price,
+            a.seller_id,
+            o.delivered_ts::DATE - o.approved_ts::DATE AS delivery_time_days,
+            o.estimated_ts::DATE - o.approved_ts::DATE AS estimated_delivery_time_days,
+            o.delivered_ts::DATE - o.estimated_ts::DATE AS delivery_time_difference_days,
+            ROUND((EXTRACT(EPOCH FROM o.approved_ts - o.purchase_ts) / 3600)::NUMERIC, 2) AS time_to_approve_hours,
+            ROUND((EXTRACT(EPOCH FROM o.carrier_ts - o.approved_ts) / 3600)::NUMERIC, 2) AS seller_processing_hours,
+            ROUND((EXTRACT(EPOCH FROM o.delivered_ts - o.carrier_ts) / 3600)::NUMERIC, 2) AS carrier_shipping_hours
+        FROM orders o
+        JOIN items_agg a ON a.order_id = o.order_id
+    )
+    SELECT
+        m.order_id,
+        dd_purchase.date_key,
+        dd_approved.date_key,
+        dd_carrier.date_key,
+        dd_delivered.date_key,
+        dd_estimated.date_key,
+        COALESCE(dc.customer_key, -1),
+        COALESCE(ds.seller_key, -1),
+        m.order_status,
+        CASE WHEN m.delivery_time_days < 0 THEN NULL ELSE m.delivery_time_days END,
+        CASE WHEN m.estimated_delivery_time_days < 0 THEN NULL ELSE m.estimated_delivery_time_days END,
+        CASE WHEN m.delivery_time_difference_days < 0 THEN NULL ELSE m.delivery_time_difference_days END,
+        COALESCE(m.delivery_time_difference_days > 0 AND m.delivered_ts IS NOT NULL, FALSE),
+        CASE WHEN m.time_to_approve_hours < 0 THEN NULL ELSE m.time_to_approve_hours END,
+        CASE WHEN m.seller_processing_hours < 0 THEN NULL ELSE m.seller_processing_hours END,
+        CASE WHEN m.carrier_shipping_hours < 0 THEN NULL ELSE m.carrier_shipping_hours END,
+        ROUND(dwh.haversine_km(dc.customer_lat, dc.customer_lng, ds.seller_lat, ds.seller_lng)::NUMERIC, 2),
+        m.item_count,
+        m.total_freight_value,
+        m.total_price,
+        1,
+        CURRENT_TIMESTAMP,
+        m.source_row_hash
+    FROM measures m
+    LEFT JOIN dwh.dim_date dd_purchase ON dd_purchase.full_date = m.purchase_ts::DATE
+    LEFT JOIN dwh.dim_date dd_approved ON dd_approved.full_date = m.approved_ts::DATE
+    LEFT JOIN dwh.dim_date dd_carrier ON dd_carrier.full_date = m.carrier_ts::DATE
+    LEFT JOIN dwh.dim_date dd_delivered ON dd_delivered.full_date = m.delivered_ts::DATE
+    LEFT JOIN dwh.dim_date dd_estimated ON dd_estimated.full_date = m.estimated_ts::DATE
+    LEFT JOIN dwh.dim_customer dc ON dc.customer_id = m.customer_id AND dc.is_current = TRUE
+    LEFT JOIN dwh.dim_seller ds ON ds.seller_id = m.seller_id AND ds.is_current = TRUE
+    {on_conflict}
+"""
+
+FACT_ON_CONFLICT_SQL = f"ON CONFLICT ({', '.join(FACT_CONFLICT_COLUMNS)}) DO UPDATE SET " + ", ".join(
+    f"{col} = EXCLUDED.{col}" for col in FACT_COLUMNS if col not in FACT_CONFLICT_COLUMNS
+)
+
+
+FACT_ITEM_COLUMNS = [
+    'order_id', 'order_item_id', 'purchase_date_key', 'shipping_limit_date_key', 'customer_key',
+    'seller_key', 'product_key', 'order_status', 'price', 'freight_value', 'dw_load_timestamp'
+]
+
+# Fact grain item (dwh.fact_order_item) cho engine "sql": các item của những order trong
+# tmp_fact_source, cùng quy tắc với build_fact_item_frame (giá trị thiếu -> 0, key không tìm thấy -> -1).
+FACT_ITEM_INSERT_SQL = """
+    INSERT INTO dwh.fact_order_item (
+        order_id, order_item_id, purchase_date_key, shipping_limit_date_key, customer_key,
+        seller_key, product_key, order_status, price, freight_value, dw_load_timestamp
+    )
+    SELECT
+        i.order_id,
+        dwh.try_cast_integer(i.order_item_id),
+        dd_purchase.date_key,
+        dd_shipping.date_key,
+        COALESCE(dc.customer_key, -1),
+        COALESCE(ds.seller_key, -1),
+        COALESCE(dp.product_key, -1),
+        o.order_status,
+        COALESCE(dwh.try_cast_numeric(i.price), 0),
+        COALESCE(dwh.try_cast_numeric(i.freight_value), 0),
+        CURRENT_TIMESTAMP
+    FROM staging.stg_order_items i
+    JOIN tmp_fact_source t ON t.order_id = i.order_id
+    JOIN staging.stg_orders o ON o.order_id = i.order_id
+    LEFT JOIN dwh.dim_date dd_purchase ON dd_purchase.full_date = dwh.try_cast_timestamp(o.order_purchase_timestamp)::DATE
+    LEFT JOIN dwh.dim_date dd_shipping ON dd_shipping.full_date = dwh.try_cast_timestamp(i.shipping_limit_date)::DATE
+    LEFT JOIN dwh.dim_customer dc ON dc.customer_id = o.customer_id AND dc.is_current = TRUE
+    LEFT JOIN dwh.dim_seller ds ON ds.seller_id = i.seller_id AND ds.is_current = TRUE
+    LEFT JOIN dwh.dim_product dp ON dp.product_id = i.product_id AND dp.is_current = TRUE;
+"""
+
+# Xóa các item của những order sắp load lại (item có thể bị bỏ khỏi order nên không upsert)
+FACT_ITEM_DELTA_DELETE_SQL = """
+    DELETE FROM dwh.fact_order_item f
+    USING tmp_fact_source t
+    WHERE f.order_id = t.order_id;
+"""
+
+# Xóa dòng Fact của những order sắp load lại mà purchase_date_key đã đổi (ngày mua được sửa trong nguồn)
+# hoặc sẽ là NULL: ON CONFLICT (order_id, purchase_date_key) không khớp được các dòng này nên upsert
+# sẽ thêm dòng thứ hai cho cùng order_id. Tính key giống FACT_INSERT_SQL / build_fact_frame.
+FACT_MOVED_ORDERS_DELETE_SQL = """
+    DELETE FROM dwh.fact_order_delivery f
+    USING tmp_fact_source t
+    JOIN staging.stg_orders o ON o.order_id = t.order_id
+    LEFT JOIN dwh.dim_date dd ON dd.full_date = dwh.try_cast_timestamp(o.order_purchase_timestamp)::DATE
+    WHERE f.order_id = t.order_id
+      AND (dd.date_key IS NULL OR f.purchase_date_key IS DISTINCT FROM dd.date_key);
+"""
+
+
+def upsert_fact_rows(df_fact_final, connection):
+    """
+    Upsert các dòng Fact qua unique index uidx_fod_order_id (INSERT ... ON CONFLICT).
+    Dữ liệu được COPY vào một bảng tạm rồi merge bằng một câu lệnh duy nhất.
+    """
+    connection.execute(text(
+        "CREATE TEMP TABLE IF NOT EXISTS tmp_fact_upsert (LIKE dwh.fact_order_delivery INCLUDING DEFAULTS) ON COMMIT DROP;"
+    ))
+    connection.execute(text("TRUNCATE TABLE tmp_fact_upsert;"))
+    copy_dataframe(df_fact_final, 'tmp_fact_upsert', connection)
+
+    columns = list(df_fact_final.columns)
+    update_cols = [col for col in columns if col not in FACT_CONFLICT_COLUMNS]
+    column_list = ', '.join(columns)
+    update_list = ',\n            '.join(f"{col} = EXCLUDED.{col}" for col in update_cols)
+    result = connection.execute(text(f"""
+        INSERT INTO dwh.fact_order_delivery ({column_list})
+        SELECT {column_list} FROM tmp_fact_upsert
+        ON CONFLICT ({', '.join(FACT_CONFLICT_COLUMNS)}) DO UPDATE SET
+            {update_list};
+    """))
+    return result.rowcount
+
+
+class DateKeyLookup:
+    """
+    Tính date_key (YYYYMMDD) trực tiếp bằng số học NumPy trên datetime64,
+    thay cho việc merge với dim_date. Kiểm tra key có tồn tại trong dim_date
+    bằng một lần tra mảng boolean đánh index theo số ngày kể từ ngày nhỏ nhất.
+    """
+
+    def __init__(self, dim_full_dates):
+        days = np.asarray(pd.to_datetime(dim_full_dates).to_numpy(dtype='datetime64[D]'))
+        days = days[~np.isnat(days)]
+        self.min_day = days.min() if len(days) else np.datetime64('1970-01-01', 'D')
+        span = int((days.max() - self.min_day).astype(np.int64)) + 1 if len(days) else 0
+        self.valid_days = np.zeros(span, dtype=bool)
+        self.valid_days[(days - self.min_day).astype(np.int64)] = True
+
+    @staticmethod
+    def date_keys(days):
+        """datetime64[D] -> mảng int64 YYYYMMDD (giá trị tại vị trí NaT không có ý nghĩa)."""
+        months = days.astype('datetime64[M]')
+        year = months.astype('datetime64[Y]').astype(np.int64) + 1970
+        month = months.astype(np.int64) % 12 + 1
+        day = (days - months).astype(np.int64) + 1
+        return year * 10000 + month * 100 + day
+
+    def lookup(self, values):
+        """Trả về Series Int64 các date_key; NaT hoặc ngày ngoài dim_date -> NA."""
+        index = values.index if isinstance(values, pd.Series) else None
+        days = np.asarray(pd.to_datetime(values).to_numpy(dtype='datetime64[D]'))
+        found = ~np.isnat(days)
+        offsets = np.where(found, days - self.min_day, np.timedelta64(-1, 'D')).astype(np.int64)
+        found &= (offsets >= 0) & (offsets < len(self.valid_days))
+        found[found] = self.valid_days[offsets[found]]
+        keys = np.where(found, self.date_keys(np.where(found, days, self.min_day)), 0)
+        return pd.Series(pd.arrays.IntegerArray(keys, ~found), index=index)
+
+
+def lookup_date_keys_array(df_fact, df_dim_date, date_lookup_cols):
+    """Thêm các cột *_date_key bằng DateKeyLookup (không merge, không copy cả DataFrame)."""
+    date_key_lookup = DateKeyLookup(df_dim_date['full_date'])
+    for date_col_fact, date_key_col in date_lookup_cols.items():
+        df_fact[date_key_col] = date_key_lookup.lookup(df_fact[date_col_fact])
+    return df_fact
+
+
+def lookup_date_keys_merge(df_fact, df_dim_date, date_lookup_cols):
+    """Đường cũ: merge với dim_date một lần cho mỗi cột ngày."""
+    # Chuyển cột date trong fact sang datetime để join
+    for date_col_fact in date_lookup_cols.keys():
+         df_fact[date_col_fact] = pd.to_datetime(df_fact[date_col_fact], errors='coerce')
+
+    # Join với DimDate cho từng cột ngày
+    for date_col_fact, date_key_col in date_lookup_cols.items():
+        temp_dim_date = df_dim_date.rename(columns={'date_key': date_key_col})
+        df_fact = pd.merge(
+            df_fact,
+            temp_dim_date[['full_date', date_key_col]],
+            left_on=date_col_fact,
+            right_on='full_date',
+            how='left'
+        )
+        df_fact = df_fact.drop(columns=['full_date']) 
+    return df_fact
+
+
+class KeyDictionary:
+    """
+    Dictionary encoding cho natural key dạng chuỗi (order_id, customer_id, seller_id, product_id:
+    hex 32 ký tự): mỗi chuỗi được hash một lần thành code int32 = vị trí trong dictionary,
+    các group/join sau đó chạy trên code (tra mảng) thay vì hash lại chuỗi ở mỗi merge.
+    Giá trị trùng lặp giữ lần xuất hiện đầu tiên như drop_duplicates(keep='first'); NULL không
+    có code. Chuỗi chỉ được dựng lại (decode) khi ghi.
+    """
+
+    def __init__(self, values):
+        values = pd.Series(values)
+        codes, _ = pd.factorize(values)
+        # factorize đánh code theo thứ tự xuất hiện: dòng đầu tiên của mỗi code là dòng có code
+        # lớn hơn mọi code đứng trước (NULL có code -1 nên không bao giờ được chọn)
+        previous_max = np.full(len(codes), -1, dtype=codes.dtype)
+        previous_max[1:] = np.maximum.accumulate(codes)[:-1]
+        # Vị trí (trong values) của dòng sinh ra mỗi code, để lấy thuộc tính của dòng đó
+        self.positions = np.flatnonzero(codes > previous_max)
+        self.values = values.iloc[self.positions].reset_index(drop=True)
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, values):
+        """Mảng code int32; NULL hoặc giá trị không có trong dictionary -> -1."""
+        # Một lần factorize trên [dictionary, values]: các giá trị của dictionary giữ code 0..n-1
+        combined = pd.concat([self.values, pd.Series(values)], ignore_index=True)
+        codes = pd.factorize(combined)[0][len(self.values):]
+        return np.where(codes < len(self.values), codes, -1).astype(np.int32)
+
+    def decode(self, codes):
+        """Mảng chuỗi (object) cho các code; -1 -> None."""
+        return np.append(self.values.to_numpy(dtype=object), None)[codes]
+
+    def lookup(self, codes, column):
+        """Giá trị cột số `column` (cùng thứ tự dòng với values lúc tạo dictionary) cho các code; -1 -> NaN."""
+        return np.append(np.asarray(column, dtype=float)[self.positions], np.nan)[codes]
+
+
+def build_key_dictionaries(df_dim_cust, df_dim_seller, df_dim_product=None):
+    """KeyDictionary theo natural key của các Dimension (tạo một lần, dùng chung cho mọi partition của Fact)."""
+    dims = [(df_dim_cust, 'customer_id'), (df_dim_seller, 'seller_id'), (df_dim_product, 'product_id')]
+    return {natural_key: KeyDictionary(df_dim[natural_key]) for df_dim, natural_key in dims if df_dim is not None}
+
+
+# Cột timestamp của order -> cột ngày (datetime64 đã normalize về 00:00) dùng cho measures và date key
+FACT_DATE_COLUMNS = {
+    'order_purchase_timestamp': 'purchase_date',
+    'order_approved_at': 'approved_date',
+    'order_delivered_carrier_date': 'delivered_carrier_date',
+    'order_delivered_customer_date': 'delivered_customer_date',
+    'order_estimated_delivery_date': 'estimated_delivery_date'
+}
+
+
+def compute_fact_measures(df_fact):
+    """
+    Tính các measure thời gian từ các cột timestamp (datetime64) của order.
+    Chỉ dùng số học datetime64: ngày = dt.normalize(), số ngày = // 1 ngày,
+    không tạo cột object (datetime.date) và không parse lại.
+    Giá trị âm -> NULL; measure theo ngày là Int64 (nullable).
+    """
+    one_day = np.timedelta64(1, 'D')
+    one_hour = np.timedelta64(1, 'h')
+    for ts_col, date_col in FACT_DATE_COLUMNS.items():
+        df_fact[date_col] = df_fact[ts_col].dt.normalize()
+
+    day_measures = {
+        'delivery_time_days': ('delivered_customer_date', 'approved_date'),
+        'estimated_delivery_time_days': ('estimated_delivery_date', 'approved_date'),
+        'delivery_time_difference_days': ('delivered_customer_date', 'estimated_delivery_date'),
+    }
+    hour_measures = {
+        'time_to_approve_hours': ('order_approved_at', 'order_purchase_timestamp'),
+        'seller_processing_hours': ('order_delivered_carrier_date', 'order_approved_at'),
+        'carrier_shipping_hours': ('order_delivered_customer_date', 'order_delivered_carrier_date'),
+    }
+    # Giá trị âm -> NULL
+    for col, (end_col, start_col) in day_measures.items():
+        days = ((df_fact[end_col] - df_fact[start_col]) // one_day).to_numpy(dtype='float64')
+        df_fact[col] = pd.array(np.where(days < 0, np.nan, days), dtype='Int64')
+    for col, (end_col, start_col) in hour_measures.items():
+        hours = ((df_fact[end_col] - df_fact[start_col]) / one_hour).round(2).to_numpy(dtype='float64')
+        df_fact[col] = np.where(hours < 0, np.nan, hours)
+
+    # Trễ hạn: delivery_time_difference_days > 0 (NULL khi chưa giao -> False)
+    df_fact['is_late_delivery_flag'] = df_fact['delivery_time_difference_days'].gt(0).fillna(False).astype(bool)
+    return df_fact
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """
+    Khoảng cách great-circle (km) giữa các cặp tọa độ, vectorized trên mảng NumPy/Series
+    (broadcast được, NaN -> NaN). Cùng công thức với dwh.haversine_km (07_create_etl_functions.sql).
+    """
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(v, dtype='float64')) for v in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def aggregate_items_encoded(df_orders, df_items, seller_keys):
+    """
+    Bước 2-3 của build_fact_frame trên code KeyDictionary: tổng hợp items theo code order_id
+    rồi lấy dòng order theo vị trí, thay cho groupby + merge trên chuỗi order_id.
+    seller_code là code seller_id trong seller_keys (-1: không có trong Dimension, NaN: NULL
+    để 'first' bỏ qua như trên chuỗi).
+    """
+    order_keys = KeyDictionary(df_orders['order_id'])
+    order_codes = order_keys.encode(df_items['order_id'])
+    matched = order_codes >= 0
+    seller_codes = seller_keys.encode(df_items['seller_id']).astype(float)
+    seller_codes[df_items['seller_id'].isna().to_numpy()] = np.nan
+
+    df_matched = df_items.loc[matched, ['order_item_id', 'freight_value', 'price']]
+    df_matched['seller_code'] = seller_codes[matched]
+    df_items_agg = df_matched.groupby(order_codes[matched]).agg(
+        item_count=('order_item_id', 'count'),
+        total_freight_value=('freight_value', 'sum'),
+        total_price=('price', 'sum'),
+        seller_code=('seller_code', 'first')
+    )
+    df_fact = df_orders.iloc[order_keys.positions[df_items_agg.index.to_numpy()]].reset_index(drop=True)
+    for col in df_items_agg.columns:
+        df_fact[col] = df_items_agg[col].to_numpy()
+    return df_fact
+
+
+def build_fact_frame(df_orders, df_items, df_dim_date, df_dim_cust, df_dim_seller, date_lookup='array',
+                     key_lookup='dictionary', key_dictionaries=None):
+    """
+    Transform orders/items từ staging thành các dòng của fact_order_delivery:
+    tổng hợp items, tính measures và lookup dimension keys.
+
+    date_lookup: 'array' (mặc định, DateKeyLookup) hoặc 'merge' (merge với dim_date).
+    key_lookup: 'dictionary' (mặc định, join trên code KeyDictionary) hoặc 'merge' (merge trên chuỗi id).
+    key_dictionaries: kết quả build_key_dictionaries của chính các DataFrame Dimension truyền vào
+    (None: tạo mới trong lần gọi này).
+    """
+    if key_lookup not in ('dictionary', 'merge'):
+        raise ValueError(f"Unknown dimension key lookup: {key_lookup}")
+    if key_lookup == 'dictionary' and key_dictionaries is None:
+        key_dictionaries = build_key_dictionaries(df_dim_cust, df_dim_seller)
+
+    # --- 2. Xử lý và Tổng hợp Order Items ---
+    logging.info("Tổng hợp dữ liệu Order Items...")
+    with span('fact.build.items', rows=len(df_items)):
+        # Seller 'first' của order là seller của item có order_item_id (số) nhỏ nhất, giống ORDER BY
+        # trong FACT_INSERT_SQL, thay vì phụ thuộc thứ tự staging trả về (iter_fact_source không ORDER BY)
+        df_items = df_items.sort_values('order_item_id', key=lambda s: pd.to_numeric(s, errors='coerce'), kind='stable')
+        df_items['price'] = pd.to_numeric(df_items['price'], errors='coerce').fillna(0)
+        df_items['freight_value'] = pd.to_numeric(df_items['freight_value'], errors='coerce').fillna(0)
+        if key_lookup == 'dictionary':
+            # --- 3. Kết hợp Orders và Items Aggregated (theo code) ---
+            df_fact = aggregate_items_encoded(df_orders, df_items, key_dictionaries['seller_id'])
+        else:
+            df_items_agg = df_items.groupby('order_id').agg(
+                item_count=('order_item_id', 'count'),
+                total_freight_value=('freight_value', 'sum'),
+                total_price=('price', 'sum'),
+                seller_id=('seller_id', 'first')
+            ).reset_index()
+
+            # --- 3. Kết hợp Orders và Items Aggregated ---
+            logging.info("Kết hợp Orders và Items Aggregated...")
+            df_fact = pd.merge(df_orders, df_items_agg, on='order_id', how='inner')
+
+    # --- 4. Chuyển đổi kiểu dữ liệu Ngày tháng trong Orders ---
+    logging.info("Chuyển đổi kiểu dữ liệu ngày tháng...")
+    with span('fact.build.measures', rows=len(df_fact)):
+        for col in FACT_DATE_COLUMNS:
+            df_fact[col] = pd.to_datetime(df_fact[col], errors='coerce')
+
+        # --- 5. Tính toán các Measures ---
+        logging.info("Tính toán các Measures...")
+        df_fact = compute_fact_measures(df_fact)
+
+    # --- 6. Lookup Dimension Keys ---
+    logging.info("Lookup Dimension Keys...")
+    with span('fact.build.date_keys', rows=len(df_fact)):
+        date_lookup_cols = {
+            'purchase_date': 'purchase_date_key',
+            'approved_date': 'approved_date_key',
+            'delivered_carrier_date': 'delivered_carrier_date_key',
+            'delivered_customer_date': 'delivered_customer_date_key',
+            'estimated_delivery_date': 'estimated_delivery_date_key'
+        }
+        if date_lookup == 'array':
+            df_fact = lookup_date_keys_array(df_fact, df_dim_date, date_lookup_cols)
+        elif date_lookup == 'merge':
+            df_fact = lookup_date_keys_merge(df_fact, df_dim_date, date_lookup_cols)
+        else:
+            raise ValueError(f"Unknown date key lookup: {date_lookup}")
+
+    with span('fact.build.dimension_keys', rows=len(df_fact)):
+        if key_lookup == 'dictionary':
+            customer_keys = key_dictionaries['customer_id']
+            customer_codes = customer_keys.encode(df_fact['customer_id'])
+            for col in ['customer_key', 'customer_lat', 'customer_lng']:
+                df_fact[col] = customer_keys.lookup(customer_codes, df_dim_cust[col])
+            seller_codes = np.nan_to_num(df_fact.pop('seller_code').to_numpy(), nan=-1).astype(np.int32)
+            for col in ['seller_key', 'seller_lat', 'seller_lng']:
+                df_fact[col] = key_dictionaries['seller_id'].lookup(seller_codes, df_dim_seller[col])
+        else:
+            # Join với dim_customer
+            df_fact = pd.merge(
+                df_fact,
+                df_dim_cust[['customer_key', 'customer_id', 'customer_lat', 'customer_lng']],
+                on='customer_id',
+                how='left'
+            )
+
+            # Join với dim_seller
+            df_fact = pd.merge(
+                df_fact,
+                df_dim_seller[['seller_key', 'seller_id', 'seller_lat', 'seller_lng']],
+                on='seller_id',
+                how='left'
+            )
+
+        # Khoảng cách customer - seller (centroid zip prefix của hai bên)
+        df_fact['customer_seller_distance_km'] = haversine_km(
+            df_fact['customer_lat'], df_fact['customer_lng'], df_fact['seller_lat'], df_fact['seller_lng']
+        ).round(2)
+
+    logging.info("Handling failed lookups and preparing key data types...")
+    date_key_cols_list = list(date_lookup_cols.values())
+    dim_key_cols_list = ['customer_key', 'seller_key']
+    all_key_cols = date_key_cols_list + dim_key_cols_list
+
+    for col in all_key_cols:
+        if col not in df_fact.columns:
+            logging.warning(f"Key column '{col}' missing after merges. Adding as pd.NA.")
+            df_fact[col] = pd.NA
+        else:
+            # Dimension key không tìm thấy -> dòng Unknown (-1, seed_unknown_members).
+            # Natural key chưa có trong Dimension đã có bản ghi inferred (create_inferred_members),
+            # nên chỉ natural key NULL mới rơi vào -1. Date key để NULL.
+            if col in dim_key_cols_list:
+                df_fact[col] = df_fact[col].fillna(UNKNOWN_MEMBER_KEY)
+
+        # Chuyển đổi sang kiểu số nullable để to_sql xử lý NaN/NA thành NULL
+        # Sử dụng float trước để xử lý các kiểu dữ liệu không đồng nhất có thể có
+        df_fact[col] = pd.to_numeric(df_fact[col], errors='coerce')
+        # Chuyển sang Int64 của Pandas để biểu diễn integer nullable
+        # Điều này giúp to_sql hiểu rõ hơn ý định gửi NULL
+        df_fact[col] = df_fact[col].astype('Int64') # 'Int64' (chữ I viết hoa) là nullable integer type
+
+    # --- 7. Chuẩn bị dữ liệu cuối cùng cho Fact ---
+    logging.info("Chuẩn bị dữ liệu cuối cùng cho fact_order_delivery...")
+    df_fact = df_fact.rename(columns={'order_id': 'order_id', 'order_status': 'order_status'})
+    df_fact['order_count'] = 1
+    df_fact['dw_load_timestamp'] = pd.Timestamp.now()
+    final_fact_columns = list(FACT_COLUMNS)
+    if 'source_row_hash' not in df_fact.columns:
+        final_fact_columns.remove('source_row_hash')
+    missing_cols = [col for col in final_fact_columns if col not in df_fact.columns]
+    if missing_cols:
+        logging.error(f"Thiếu các cột trong Fact DataFrame: {missing_cols}")
+        raise ValueError(f"Missing columns required for fact table: {missing_cols}")
+    return df_fact[final_fact_columns]
+
+
+def build_fact_item_frame(df_orders, df_items, df_dim_date, df_dim_cust, df_dim_seller, df_dim_product,
+                          key_lookup='dictionary', key_dictionaries=None):
+    """
+    Transform orders/items từ staging thành các dòng của fact_order_item (một dòng mỗi item):
+    lookup date keys (ngày mua, shipping limit) và các dimension key, không tổng hợp.
+
+    key_lookup / key_dictionaries: như build_fact_frame.
+    """
+    if key_lookup not in ('dictionary', 'merge'):
+        raise ValueError(f"Unknown dimension key lookup: {key_lookup}")
+    item_cols = ['order_item_id', 'product_id', 'seller_id', 'shipping_limit_date', 'price', 'freight_value']
+    order_cols = ['order_status', 'order_purchase_timestamp']
+    dim_keys = [
+        (df_dim_cust, 'customer_id', 'customer_key'),
+        (df_dim_seller, 'seller_id', 'seller_key'),
+        (df_dim_product, 'product_id', 'product_key'),
+    ]
+    if key_lookup == 'dictionary':
+        if key_dictionaries is None:
+            key_dictionaries = build_key_dictionaries(df_dim_cust, df_dim_seller, df_dim_product)
+        order_keys = KeyDictionary(df_orders['order_id'])
+        order_codes = order_keys.encode(df_items['order_id'])
+        matched = order_codes >= 0
+        order_codes = order_codes[matched]
+        order_rows = order_keys.positions[order_codes]
+
+        df_item = df_items.loc[matched, item_cols].reset_index(drop=True)
+        df_item.insert(0, 'order_id', order_keys.decode(order_codes))
+        for col in order_cols:
+            df_item[col] = df_orders[col].to_numpy()[order_rows]
+        # customer_id thuộc order: encode trên orders (ít dòng hơn items) rồi lấy theo vị trí
+        dim_codes = {
+            'customer_id': key_dictionaries['customer_id'].encode(df_orders['customer_id'])[order_rows],
+            'seller_id': key_dictionaries['seller_id'].encode(df_item['seller_id']),
+            'product_id': key_dictionaries['product_id'].encode(df_item['product_id']),
+        }
+    else:
+        df_item = pd.merge(
+            df_items[['order_id'] + item_cols],
+            df_orders[['order_id', 'customer_id'] + order_cols],
+            on='order_id',
+            how='inner'
+        )
+    df_item['order_item_id'] = pd.to_numeric(df_item['order_item_id'], errors='coerce').astype('Int64')
+    df_item['price'] = pd.to_numeric(df_item['price'], errors='coerce').fillna(0)
+    df_item['freight_value'] = pd.to_numeric(df_item['freight_value'], errors='coerce').fillna(0)
+    for col in ['order_purchase_timestamp', 'shipping_limit_date']:
+        df_item[col] = pd.to_datetime(df_item[col], errors='coerce')
+    df_item = lookup_date_keys_array(df_item, df_dim_date, {
+        'order_purchase_timestamp': 'purchase_date_key',
+        'shipping_limit_date': 'shipping_limit_date_key',
+    })
+
+    for df_dim, natural_key, key_col in dim_keys:
+        if key_lookup == 'dictionary':
+            df_item[key_col] = key_dictionaries[natural_key].lookup(dim_codes[natural_key], df_dim[key_col])
+        else:
+            keys = df_dim.drop_duplicates(subset=[natural_key]).set_index(natural_key)[key_col]
+            df_item[key_col] = df_item[natural_key].map(keys)
+        df_item[key_col] = pd.to_numeric(df_item[key_col], errors='coerce').fillna(UNKNOWN_MEMBER_KEY).astype('Int64')
+
+    df_item['dw_load_timestamp'] = pd.Timestamp.now()
+    return df_item[FACT_ITEM_COLUMNS]
+
+
+def iter_fact_source(connection, partition_size=None):
+    """
+    Sinh các cặp (df_orders, df_items) cho các order trong tmp_fact_source.
+
+    partition_size=None: đọc toàn bộ một lần.
+    partition_size=N: stream orders bằng server-side cursor, mỗi lần N order,
+    và chỉ đọc items của các order đó (qua idx_stg_order_items_order_id),
+    để bộ nhớ tối đa không tăng theo lịch sử.
+    """
+    orders_sql = (
+        "SELECT o.*, t.source_row_hash FROM staging.stg_orders o "
+        "JOIN tmp_fact_source t ON t.order_id = o.order_id"
+    )
+    if not partition_size:
+        logging.info("Đọc dữ liệu từ staging...")
+        df_orders = pd.read_sql(orders_sql, connection)
+        df_items = pd.read_sql(
+            "SELECT i.* FROM staging.stg_order_items i "
+            "JOIN tmp_fact_source t ON t.order_id = i.order_id",
+            connection
+        )
+        yield df_orders, df_items
+        return
+
+    logging.info(f"Stream dữ liệu từ staging theo partition {partition_size} order...")
+    items_sql = text("SELECT * FROM staging.stg_order_items WHERE order_id = ANY(:order_ids)")
+    orders_stream = pd.read_sql(
+        text(orders_sql).execution_options(stream_results=True),
+        connection,
+        chunksize=partition_size
+    )
+    for df_orders in orders_stream:
+        df_items = pd.read_sql(items_sql, connection, params={'order_ids': df_orders['order_id'].tolist()})
+        yield df_orders, df_items
+
+
+def month_start_of(month):
+    """'YYYY-MM', date hoặc Timestamp -> date ngày đầu tháng."""
+    return pd.Timestamp(month).to_period('M').start_time.date()
+
+
+def fact_partition_name(month_start):
+    """Tên partition tháng của Fact: dwh.fact_order_delivery_YYYYMM."""
+    return f"dwh.fact_order_delivery_{month_start:%Y%m}"
+
+
+def fact_partition_bounds(month_start):
+    """Khoảng purchase_date_key [YYYYMM01, YYYYMM01 của tháng sau) của một partition tháng."""
+    next_month = (pd.Timestamp(month_start) + pd.offsets.MonthBegin(1)).date()
+    return int(f"{month_start:%Y%m}01"), int(f"{next_month:%Y%m}01")
+
+
+def is_fact_partitioned(connection):
+    """True nếu dwh.fact_order_delivery được tạo theo 05_create_fact_table.sql dạng partitioned."""
+    return connection.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'dwh.fact_order_delivery'::regclass);"
+    )).scalar()
+
+
+def ensure_fact_partitions(connection, months):
+    """
+    Tạo các partition tháng còn thiếu của Fact (range theo purchase_date_key).
+    Trả về danh sách partition vừa tạo.
+    """
+    existing = set(connection.execute(text("""
+        SELECT c.oid::regclass::text
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'dwh.fact_order_delivery'::regclass;
+    """)).scalars())
+    created = []
+    for month_start in sorted(set(months)):
+        partition = fact_partition_name(month_start)
+        if partition in existing:
+            continue
+        lower, upper = fact_partition_bounds(month_start)
+        connection.execute(text(
+            f"CREATE TABLE {partition} PARTITION OF dwh.fact_order_delivery FOR VALUES FROM ({lower}) TO ({upper});"
+        ))
+        created.append(partition)
+    if created:
+        logging.info(f"Tạo {len(created)} partition mới cho Fact: {', '.join(created)}")
+    return created
+
+
+def truncate_fact(connection, month_start=None):
+    """
+    TRUNCATE toàn bộ Fact, hoặc chỉ partition của một tháng.
+    fact_order_item (không partition) bị xóa theo cùng phạm vi purchase_date_key.
+    """
+    target = fact_partition_name(month_start) if month_start else 'dwh.fact_order_delivery'
+    logging.info(f"Truncating {target}...")
+    connection.execute(text(f"TRUNCATE TABLE {target};"))
+    if month_start:
+        lower, upper = fact_partition_bounds(month_start)
+        connection.execute(text(
+            "DELETE FROM dwh.fact_order_item WHERE purchase_date_key >= :lower AND purchase_date_key < :upper;"
+        ), {'lower': lower, 'upper': upper})
+    else:
+        connection.execute(text("TRUNCATE TABLE dwh.fact_order_item;"))
+
+
+# Materialized view tổng hợp cho Superset (08_create_aggregate_views.sql), theo thứ tự refresh
+AGGREGATE_VIEWS = ['dwh.agg_delivery_daily', 'dwh.agg_delivery_monthly']
+
+
+def refresh_aggregate_views(db_engine, concurrently=True, views=None):
+    """
+    Refresh các materialized view tổng hợp sau khi load Fact.
+    CONCURRENTLY: dashboard vẫn đọc được dữ liệu cũ trong lúc refresh.
+    View chưa được tạo (chưa chạy 08_create_aggregate_views.sql) thì bỏ qua.
+    views: chỉ refresh các view này (mặc định AGGREGATE_VIEWS, theo thứ tự phụ thuộc).
+    """
+    mode = ' CONCURRENTLY' if concurrently else ''
+    with db_engine.connect() as connection:
+        for view_name in views or AGGREGATE_VIEWS:
+            if connection.execute(text("SELECT to_regclass(:name);"), {'name': view_name}).scalar() is None:
+                logging.warning(f"Không tìm thấy {view_name}, bỏ qua refresh.")
+                continue
+            with span(f"fact.refresh.{view_name.split('.')[-1]}"):
+                connection.execute(text(f"REFRESH MATERIALIZED VIEW{mode} {view_name};"))
+                connection.commit()
+
+
+@instrumented('fact')
+def transform_and_load_fact(db_engine, mode='full', transform_engine='pandas', partition_size=None,
+                            refresh_aggregates=True, month=None, bulk_load=False, skip_unchanged=False):
     """
     Transform dữ liệu từ staging, lookup keys từ Dimensions,
-    và load vào fact_order_delivery
+    và load vào fact_order_delivery (grain order) cùng fact_order_item (grain item)
+    trong một transaction, từ cùng tập order.
+
+    mode: 'full' (TRUNCATE + load lại toàn bộ)
+          hoặc 'incremental' (chỉ xử lý các order mới/thay đổi kể từ lần load trước,
+          phát hiện qua source_row_hash, rồi upsert qua uidx_fod_order_id; dòng cũ của order
+          có ngày mua thay đổi bị xóa trước).
+    transform_engine: 'pandas' (đọc về DataFrame, build_fact_frame)
+          hoặc 'sql' (một câu INSERT ... SELECT chạy hoàn toàn trong PostgreSQL).
+    partition_size: (engine 'pandas') số order mỗi partition khi stream staging;
+          None = đọc toàn bộ staging vào bộ nhớ một lần.
+    refresh_aggregates: refresh các materialized view tổng hợp (AGGREGATE_VIEWS) sau khi load.
+    month: 'YYYY-MM' -> chỉ xử lý các order mua trong tháng đó; với mode 'full'
+          chỉ TRUNCATE và load lại partition của tháng (cần Fact dạng partitioned).
+    bulk_load: (mode 'full', không có month) drop index/FK của cả hai Fact trước khi load,
+          build lại song song và validate FK sau khi load.
+    skip_unchanged=True: (không có month) bỏ qua, kể cả refresh aggregate, nếu staging
+          orders/items và các Dimension không thay đổi kể từ lần build Fact trước.
     """
-    logging.info("Bắt đầu quá trình Transform và Load Fact Table...")
+    if mode not in ('full', 'incremental'):
+        raise ValueError(f"Unknown fact load mode: {mode}")
+    if transform_engine not in ('pandas', 'sql'):
+        raise ValueError(f"Unknown fact transform engine: {transform_engine}")
+    if bulk_load and (mode != 'full' or month):
+        raise ValueError("bulk_load requires mode='full' without month")
+
+    month_start = month_start_of(month) if month else None
+
+    logging.info(f"Bắt đầu quá trình Transform và Load Fact Table (mode={mode}, engine={transform_engine}, month={month})...")
     with db_engine.connect() as connection:
         with connection.begin():
             try:
-                # --- 1. Đọc dữ liệu cần thiết ---
-                logging.info("Đọc dữ liệu từ staging và dimensions...")
-                df_orders = pd.read_sql("SELECT * FROM staging.stg_orders", connection)
-                df_items = pd.read_sql("SELECT * FROM staging.stg_order_items", connection)
-                df_dim_date = pd.read_sql('SELECT date_key, full_date FROM dwh.dim_date', connection, parse_dates=['full_date'])
-                df_dim_cust = pd.read_sql('SELECT customer_key, customer_id FROM dwh.dim_customer WHERE is_current = TRUE', connection)
-                df_dim_seller = pd.read_sql('SELECT seller_key, seller_id FROM dwh.dim_seller WHERE is_current = TRUE', connection)
-
-
-                # --- 2. Xử lý và Tổng hợp Order Items ---
-                logging.info("Tổng hợp dữ liệu Order Items...")
-                df_items['price'] = pd.to_numeric(df_items['price'], errors='coerce').fillna(0)
-                df_items['freight_value'] = pd.to_numeric(df_items['freight_value'], errors='coerce').fillna(0)
-                df_items_agg = df_items.groupby('order_id').agg(
-                    item_count=('order_item_id', 'count'),
-                    total_freight_value=('freight_value', 'sum'),
-                    total_price=('price', 'sum'),
-                    seller_id=('seller_id', 'first')
-                ).reset_index()
-
-                # --- 3. Kết hợp Orders và Items Aggregated ---
-                logging.info("Kết hợp Orders và Items Aggregated...")
-                df_fact = pd.merge(df_orders, df_items_agg, on='order_id', how='inner')
-
-                # --- 4. Chuyển đổi kiểu dữ liệu Ngày tháng trong Orders ---
-                logging.info("Chuyển đổi kiểu dữ liệu ngày tháng...")
-                date_cols_ts = [
-                    'order_purchase_timestamp', 'order_approved_at',
-                    'order_delivered_carrier_date', 'order_delivered_customer_date',
-                    'order_estimated_delivery_date'
-                ]
-                for col in date_cols_ts:
-                    df_fact[col] = pd.to_datetime(df_fact[col], errors='coerce')
-
-                date_cols_date = {
-                    'order_purchase_timestamp': 'purchase_date',
-                    'order_approved_at': 'approved_date',
-                    'order_delivered_carrier_date': 'delivered_carrier_date',
-                    'order_delivered_customer_date': 'delivered_customer_date',
-                    'order_estimated_delivery_date': 'estimated_delivery_date'
-                }
-                for ts_col, date_col in date_cols_date.items():
-                     df_fact[date_col] = df_fact[ts_col].dt.date
-
-                # --- 5. Tính toán các Measures ---
-                logging.info("Tính toán các Measures...")
-                df_fact['delivery_time_days'] = (pd.to_datetime(df_fact['delivered_customer_date'], errors='coerce') - pd.to_datetime(df_fact['approved_date'], errors='coerce')).dt.days
-                df_fact['estimated_delivery_time_days'] = (pd.to_datetime(df_fact['estimated_delivery_date'], errors='coerce') - pd.to_datetime(df_fact['approved_date'], errors='coerce')).dt.days
-                df_fact['delivery_time_difference_days'] = (pd.to_datetime(df_fact['delivered_customer_date'], errors='coerce') - pd.to_datetime(df_fact['estimated_delivery_date'], errors='coerce')).dt.days
-                df_fact['time_to_approve_hours'] = (df_fact['order_approved_at'] - df_fact['order_purchase_timestamp']) / pd.Timedelta(hours=1)
-                df_fact['seller_processing_hours'] = (df_fact['order_delivered_carrier_date'] - df_fact['order_approved_at']) / pd.Timedelta(hours=1)
-                df_fact['carrier_shipping_hours'] = (df_fact['order_delivered_customer_date'] - df_fact['order_delivered_carrier_date']) / pd.Timedelta(hours=1)
-                hour_cols = ['time_to_approve_hours', 'seller_processing_hours', 'carrier_shipping_hours']
-                for col in hour_cols:
-                    df_fact[col] = df_fact[col].round(2)
-                df_fact['is_late_delivery_flag'] = (df_fact['delivery_time_difference_days'] > 0) & (df_fact['delivered_customer_date'].notna())
-                df_fact['is_late_delivery_flag'] = df_fact['is_late_delivery_flag'].fillna(False).astype(bool)
-
-                # ----  CHECK các giá trị ÂM -------
-                logging.info("Setting negative time measures to None...")
-                time_measure_cols = [
-                    'delivery_time_days', 'estimated_delivery_time_days', 'delivery_time_difference_days',
-                    'time_to_approve_hours', 'seller_processing_hours', 'carrier_shipping_hours'
-                ]
-                for col in time_measure_cols:
-                    if col in df_fact.columns:
-                        df_fact.loc[df_fact[col] < 0, col] = None
-                    else:
-                         logging.warning(f"Column {col} not found for negative check.")
-
-                # --- 6. Lookup Dimension Keys ---
-                logging.info("Lookup Dimension Keys...")
-                date_lookup_cols = {
-                    'purchase_date': 'purchase_date_key',
-                    'approved_date': 'approved_date_key',
-                    'delivered_carrier_date': 'delivered_carrier_date_key',
-                    'delivered_customer_date': 'delivered_customer_date_key',
-                    'estimated_delivery_date': 'estimated_delivery_date_key'
-                }
-                # Chuyển cột date trong fact sang datetime để join
-                for date_col_fact in date_lookup_cols.keys():
-                     df_fact[date_col_fact] = pd.to_datetime(df_fact[date_col_fact], errors='coerce')
-
-                # Join với DimDate cho từng cột ngày
-                for date_col_fact, date_key_col in date_lookup_cols.items():
-                    temp_dim_date = df_dim_date.rename(columns={'date_key': date_key_col})
-                    df_fact = pd.merge(
-                        df_fact,
-                        temp_dim_date[['full_date', date_key_col]],
-                        left_on=date_col_fact,
-                        right_on='full_date',
-                        how='left'
+                partitioned = is_fact_partitioned(connection)
+                if month_start and not partitioned:
+                    raise ValueError("month requires a partitioned dwh.fact_order_delivery (05_create_fact_table.sql)")
+                if not month_start:
+                    input_fingerprint = stage_input_fingerprint(connection, 'fact')
+                    if skip_unchanged and stage_is_current(connection, 'fact', input_fingerprint):
+                        logging.info("Input của Fact không thay đổi kể từ lần build trước, bỏ qua.")
+                        return
+                    record_stage_state(connection, 'fact', input_fingerprint)
+
+                # --- 1. Xác định các order cần xử lý ---
+                logging.info("Tính hash nội dung các order trong staging...")
+                with span('fact.source') as source_span:
+                    connection.execute(text(FACT_SOURCE_SQL))
+                    if month_start:
+                        skipped = connection.execute(text(FACT_MONTH_FILTER_SQL), {'month_start': month_start}).rowcount
+                        logging.info(f"Bỏ qua {skipped} order ngoài tháng {month_start:%Y-%m}.")
+                    if mode == 'incremental':
+                        unchanged = connection.execute(text(FACT_DELTA_SQL)).rowcount
+                        logging.info(f"Bỏ qua {unchanged} order không thay đổi.")
+                    connection.execute(text("ANALYZE tmp_fact_source;"))
+                    delta_count = source_span.rows = connection.execute(text("SELECT COUNT(*) FROM tmp_fact_source;")).scalar()
+                logging.info(f"Số order cần xử lý: {delta_count}")
+                if mode == 'incremental' and delta_count == 0:
+                    logging.info("Không có order mới hoặc thay đổi, bỏ qua load Fact.")
+                    return
+
+                # Key -1 luôn thỏa FK; natural key chưa có trong Dimension nhận bản ghi inferred
+                # để một key lỗi không làm rollback cả transaction load Fact
+                with span('fact.inferred_members') as inferred_span:
+                    seed_unknown_members(connection)
+                    inferred = create_inferred_members(connection)
+                    inferred_span.rows = sum(inferred.values())
+                if inferred_span.rows:
+                    logging.warning(
+                        "Tạo bản ghi inferred cho natural key chưa có trong Dimension: "
+                        + ", ".join(f"{table_name} {count}" for table_name, count in inferred.items() if count)
                     )
-                    df_fact = df_fact.drop(columns=['full_date']) 
-
-                # Join với dim_customer
-                df_fact = pd.merge(
-                    df_fact,
-                    df_dim_cust[['customer_key', 'customer_id']],
-                    on='customer_id',
-                    how='left'
-                )
 
-                # Join với dim_seller
-                df_fact = pd.merge(
-                    df_fact,
-                    df_dim_seller[['seller_key', 'seller_id']],
-                    on='seller_id',
-                    how='left'
-                )
+                if partitioned:
+                    months = connection.execute(text(FACT_SOURCE_MONTHS_SQL)).scalars().all()
+                    ensure_fact_partitions(connection, months + ([month_start] if month_start else []))
+                dropped = [
+                    drop_indexes_for_bulk_load(connection, table_name)
+                    for table_name in ('dwh.fact_order_delivery', 'dwh.fact_order_item')
+                ] if bulk_load else []
+                if mode == 'incremental' or month_start:
+                    # Load một phần: dòng cũ của các order sắp load có thể nằm ngoài phạm vi được
+                    # TRUNCATE/upsert (item, hoặc order có ngày mua đã đổi sang tháng/ngày khác)
+                    connection.execute(text(FACT_ITEM_DELTA_DELETE_SQL))
+                    moved = connection.execute(text(FACT_MOVED_ORDERS_DELETE_SQL)).rowcount
+                    if moved:
+                        logging.warning(f"Xóa {moved} dòng Fact của order có ngày mua thay đổi trước khi load lại.")
 
-                logging.info("Handling failed lookups and preparing key data types...")
-                date_key_cols_list = list(date_lookup_cols.values())
-                dim_key_cols_list = ['customer_key', 'seller_key']
-                all_key_cols = date_key_cols_list + dim_key_cols_list
-
-                for col in all_key_cols:
-                    if col not in df_fact.columns:
-                        logging.warning(f"Key column '{col}' missing after merges. Adding as pd.NA.")
-                        df_fact[col] = pd.NA
-                    else:
-                        # QUAN TRỌNG: KHÔNG fillna(-1) một cách mù quáng nữa.
-                        # Chỉ fillna(-1) cho customer/seller keys NẾU bạn đã tạo dòng Unknown=-1 trong Dim.
-                        # Nếu không, hãy để NaN/NA để nó thành NULL trong DB.
-                        if col in dim_key_cols_list:
-                            # Tạm thời vẫn fill -1 cho dimension keys nếu bạn muốn (cần có dòng -1 trong dim)
-                            # Hoặc comment dòng fillna này để nó thành NULL
-                            df_fact[col] = df_fact[col].fillna(-1)
-                            pass
-
-                    # Chuyển đổi sang kiểu số nullable để to_sql xử lý NaN/NA thành NULL
-                    # Sử dụng float trước để xử lý các kiểu dữ liệu không đồng nhất có thể có
-                    df_fact[col] = pd.to_numeric(df_fact[col], errors='coerce')
-                    # Chuyển sang Int64 của Pandas để biểu diễn integer nullable
-                    # Điều này giúp to_sql hiểu rõ hơn ý định gửi NULL
-                    df_fact[col] = df_fact[col].astype('Int64') # 'Int64' (chữ I viết hoa) là nullable integer type
-
-                # --- 7. Chuẩn bị dữ liệu cuối cùng cho Fact ---
-                logging.info("Chuẩn bị dữ liệu cuối cùng cho fact_order_delivery...")
-                df_fact = df_fact.rename(columns={'order_id': 'order_id', 'order_status': 'order_status'})
-                df_fact['order_count'] = 1
-                df_fact['dw_load_timestamp'] = pd.Timestamp.now()
-                final_fact_columns = [
-                    'order_id', 'purchase_date_key', 'approved_date_key', 'delivered_carrier_date_key',
-                    'delivered_customer_date_key', 'estimated_delivery_date_key', 'customer_key', 'seller_key',
-                    'order_status', 'delivery_time_days', 'estimated_delivery_time_days', 'delivery_time_difference_days',
-                    'is_late_delivery_flag', 'time_to_approve_hours', 'seller_processing_hours', 'carrier_shipping_hours',
-                    'item_count', 'total_freight_value', 'total_price', 'order_count', 'dw_load_timestamp'
-                ]
-                missing_cols = [col for col in final_fact_columns if col not in df_fact.columns]
-                if missing_cols:
-                    logging.error(f"Thiếu các cột trong Fact DataFrame: {missing_cols}")
-                    raise ValueError(f"Missing columns required for fact table: {missing_cols}")
-                df_fact_final = df_fact[final_fact_columns]
-
-
-                # --- 8. Load dữ liệu vào Fact Table ---
-                logging.info(f"Load {len(df_fact_final)} dòng vào dwh.fact_order_delivery...")
-                start_time = time.time()
-                logging.info("Truncating dwh.fact_order_delivery...")
-                connection.execute(text("TRUNCATE TABLE dwh.fact_order_delivery;"))
-                df_fact_final.to_sql(
-                    name='fact_order_delivery',
-                    con=connection,
-                    schema='dwh',
-                    if_exists='append',
-                    index=False,
-                    chunksize=10000,
-                    # method='multi' # Có thể thử method='multi' nếu mặc định chậm
-                )
-                end_time = time.time()
-                logging.info(f"Hoàn thành load fact_order_delivery trong {end_time - start_time:.2f} giây.")
+                if transform_engine == 'sql':
+                    with span('fact.load') as load_span:
+                        if mode == 'full':
+                            truncate_fact(connection, month_start)
+                        on_conflict = FACT_ON_CONFLICT_SQL if mode == 'incremental' else ''
+                        loaded = load_span.rows = connection.execute(text(FACT_INSERT_SQL.format(on_conflict=on_conflict))).rowcount
+                    with span('fact.load_items') as load_span:
+                        loaded_items = load_span.rows = connection.execute(text(FACT_ITEM_INSERT_SQL)).rowcount
+                    logging.info(f"Hoàn thành load {loaded} dòng vào fact_order_delivery, {loaded_items} dòng vào fact_order_item (in-database).")
+                else:
+                    # --- Đọc dữ liệu Dimension (một lần cho mọi partition) ---
+                    logging.info("Đọc dữ liệu từ dimensions...")
+                    with span('fact.read_dimensions'):
+                        df_dim_date = pd.read_sql('SELECT date_key, full_date FROM dwh.dim_date', connection, parse_dates=['full_date'])
+                        df_dim_cust = pd.read_sql('SELECT customer_key, customer_id, customer_lat, customer_lng FROM dwh.dim_customer WHERE is_current = TRUE', connection)
+                        df_dim_seller = pd.read_sql('SELECT seller_key, seller_id, seller_lat, seller_lng FROM dwh.dim_seller WHERE is_current = TRUE', connection)
+                        df_dim_product = pd.read_sql('SELECT product_key, product_id FROM dwh.dim_product WHERE is_current = TRUE', connection)
+                        # Natural key -> code int32 một lần; các partition join trên code
+                        key_dictionaries = build_key_dictionaries(df_dim_cust, df_dim_seller, df_dim_product)
+
+                    if mode == 'full':
+                        truncate_fact(connection, month_start)
+
+                    loaded = loaded_items = 0
+                    for partition_no, (df_orders, df_items) in enumerate(iter_fact_source(connection, partition_size), start=1):
+                        df_item_final = build_fact_item_frame(df_orders, df_items, df_dim_date, df_dim_cust, df_dim_seller,
+                                                              df_dim_product, key_dictionaries=key_dictionaries)
+                        df_fact_final = build_fact_frame(df_orders, df_items, df_dim_date, df_dim_cust, df_dim_seller,
+                                                         key_dictionaries=key_dictionaries)
+
+                        # --- 8. Load dữ liệu vào Fact Table ---
+                        logging.info(f"Load {len(df_fact_final)} dòng vào dwh.fact_order_delivery (partition {partition_no})...")
+                        with span('fact.load', rows=len(df_fact_final)):
+                            if mode == 'incremental':
+                                upsert_fact_rows(df_fact_final, connection)
+                            else:
+                                df_fact_final.to_sql(
+                                    name='fact_order_delivery',
+                                    con=connection,
+                                    schema='dwh',
+                                    if_exists='append',
+                                    index=False,
+                                    chunksize=10000,
+                                    # method='multi' # Có thể thử method='multi' nếu mặc định chậm
+                                )
+                        with span('fact.load_items', rows=len(df_item_final)):
+                            copy_dataframe(df_item_final, 'dwh.fact_order_item', connection)
+                        loaded += len(df_fact_final)
+                        loaded_items += len(df_item_final)
+                        if partition_size:
+                            logging.info(f"Partition {partition_no}: RSS {current_rss_mb():.0f} MB (peak process {peak_rss_mb():.0f} MB).")
+                        del df_orders, df_items, df_fact_final, df_item_final
+
+                    logging.info(f"Hoàn thành load {loaded} dòng vào fact_order_delivery, {loaded_items} dòng vào fact_order_item.")
+
+                for table_dropped in dropped:
+                    rebuild_indexes_after_bulk_load(connection, table_dropped)
 
             except Exception as e:
                 logging.error(f"Lỗi trong quá trình Transform và Load Fact Table: {e}")
                 raise e
 
     logging.info("Hoàn thành Transform và Load Fact Table.")
+    if refresh_aggregates:
+        refresh_aggregate_views(db_engine)
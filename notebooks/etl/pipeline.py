@@ -0,0 +1,361 @@
+"""
+Chạy pipeline ETL (staging -> dimensions -> fact -> aggregates) theo DAG.
+
+Mỗi stage khai báo inputs/outputs (bảng staging, Dimension, Fact, materialized view);
+stage A phụ thuộc stage B nếu A đọc một output của B. Stage được chạy ngay khi mọi stage
+phía trước xong, trên một thread pool giới hạn --workers stage cùng lúc; mỗi stage dùng
+connection và transaction riêng (vd. dim_customer, dim_seller, dim_product load song song).
+
+Trạng thái các stage được ghi vào state file sau mỗi stage: --resume bỏ qua các stage đã
+xong của lần chạy trước (nếu lần đó lỗi) và chạy tiếp từ stage lỗi. Cuối run in bảng thời
+gian từng stage và critical path; các span được ghi như mọi run (etl/run_metrics.py).
+
+Chạy từ thư mục notebooks:
+    python -m etl.pipeline --data-dir ../data --workers 4
+    python -m etl.pipeline --data-dir ../data --resume
+"""
+import argparse
+import json
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from tabulate import tabulate
+
+from etl.main_etl import (AGGREGATE_VIEWS, CSV_FILES, DIMENSION_LOADERS, database_uri_from_env,
+                          extract_load_to_staging, load_geo_lookup, refresh_aggregate_views,
+                          transform_and_load_dimensions, transform_and_load_fact, truncate_for_full_reload)
+from etl.run_metrics import RUN_RECORD_DIR, etl_run, span
+
+PIPELINE_STATE_PATH = RUN_RECORD_DIR.parent / 'pipeline_state.json'
+
+# Input của mỗi Dimension; 'geo_lookup' là cache GeoLookup (load_geo_lookup) build từ stg_geolocation
+DIMENSION_INPUTS = {
+    'dim_customer': ['staging.stg_customers', 'geo_lookup'],
+    'dim_seller': ['staging.stg_sellers', 'geo_lookup'],
+    'dim_product': ['staging.stg_products', 'staging.stg_product_category_translation'],
+}
+
+FACT_INPUTS = ['staging.stg_orders', 'staging.stg_order_items', 'dwh.dim_customer', 'dwh.dim_seller', 'dwh.dim_product']
+FACT_OUTPUTS = ['dwh.fact_order_delivery', 'dwh.fact_order_item']
+
+# Nguồn của các materialized view (08_create_aggregate_views.sql)
+AGGREGATE_INPUTS = {
+    'dwh.agg_delivery_daily': ['dwh.fact_order_delivery', 'dwh.dim_customer', 'dwh.dim_seller'],
+    'dwh.agg_delivery_monthly': ['dwh.agg_delivery_daily'],
+}
+
+# Stage đã xong: chạy trong run này hoặc đã xong ở lần chạy được resume
+COMPLETED_STATUSES = ('done', 'resumed')
+
+
+class Stage:
+    """
+    Một bước của pipeline. func() được gọi không tham số; lỗi (exception) đánh dấu stage 'failed'.
+    status: pending -> running -> done/failed, hoặc 'resumed' (đã xong ở lần chạy trước).
+    started/finished: số giây kể từ lúc bắt đầu run_pipeline.
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=()):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.status = 'pending'
+        self.started = None
+        self.finished = None
+
+    @property
+    def seconds(self):
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, status={self.status!r})"
+
+
+def stage_dependencies(stages):
+    """
+    {tên stage: set tên các stage tạo ra một input của nó}. Input không do stage nào tạo ra
+    (vd. dwh.dim_date) được coi là có sẵn. ValueError nếu một output có hai stage cùng tạo
+    ra hoặc các stage tạo thành chu trình.
+    """
+    producers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            if output in producers:
+                raise ValueError(f"{output} is produced by both {producers[output]} and {stage.name}")
+            producers[output] = stage.name
+    dependencies = {
+        stage.name: {producers[i] for i in stage.inputs if i in producers and producers[i] != stage.name}
+        for stage in stages
+    }
+
+    # Kiểm tra chu trình (Kahn): mọi stage phải lần lượt hết phụ thuộc
+    remaining = {name: set(deps) for name, deps in dependencies.items()}
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError(f"Pipeline stages form a cycle: {sorted(remaining)}")
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+    return dependencies
+
+
+def _run_stage(stage, t0):
+    stage.started = time.perf_counter() - t0
+    try:
+        with span(f"pipeline.{stage.name}"):
+            stage.func()
+    finally:
+        stage.finished = time.perf_counter() - t0
+
+
+def run_pipeline(stages, max_workers=4, completed=(), on_stage_done=None):
+    """
+    Chạy các stage trên ThreadPoolExecutor(max_workers): mỗi stage được submit ngay khi mọi
+    stage nó phụ thuộc đã xong. Stage có tên trong completed được đánh dấu 'resumed', không chạy lại.
+    Khi một stage lỗi: không submit stage mới, chờ các stage đang chạy kết thúc rồi raise lỗi
+    đầu tiên; các stage chưa chạy giữ status 'pending'.
+    on_stage_done(stage) được gọi trên thread chính sau mỗi stage kết thúc (vd. ghi state file).
+    Trả về list stages (status, started, finished đã cập nhật).
+    """
+    dependencies = stage_dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    unknown = set(completed) - set(by_name)
+    if unknown:
+        raise ValueError(f"Unknown completed stages: {sorted(unknown)}")
+    for name in completed:
+        by_name[name].status = 'resumed'
+
+    t0 = time.perf_counter()
+    first_error = None
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pipeline') as executor:
+        while True:
+            if first_error is None:
+                for stage in stages:
+                    if stage.status == 'pending' and all(
+                        by_name[dep].status in COMPLETED_STATUSES for dep in dependencies[stage.name]
+                    ):
+                        stage.status = 'running'
+                        running[executor.submit(_run_stage, stage, t0)] = stage
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                error = future.exception()
+                if error is None:
+                    stage.status = 'done'
+                else:
+                    stage.status = 'failed'
+                    logging.error(f"Stage {stage.name} lỗi: {error}")
+                    first_error = first_error or error
+                if on_stage_done is not None:
+                    on_stage_done(stage)
+
+    if first_error is not None:
+        raise first_error
+    return stages
+
+
+def critical_path(stages):
+    """
+    Chuỗi stage quyết định tổng thời gian: bắt đầu từ stage kết thúc muộn nhất, lần ngược
+    theo stage phụ thuộc kết thúc muộn nhất (trong các stage đã chạy ở run này).
+    """
+    dependencies = stage_dependencies(stages)
+    ran = {stage.name: stage for stage in stages if stage.finished is not None}
+    if not ran:
+        return []
+    current = max(ran.values(), key=lambda s: s.finished)
+    path = [current]
+    while True:
+        previous = [ran[dep] for dep in dependencies[current.name] if dep in ran]
+        if not previous:
+            break
+        current = max(previous, key=lambda s: s.finished)
+        path.append(current)
+    return path[::-1]
+
+
+def timing_report(stages):
+    """Bảng thời gian các stage (theo thứ tự bắt đầu), đánh dấu critical path, và dòng tổng kết."""
+    dependencies = stage_dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    on_path = {stage.name for stage in critical_path(stages)}
+    rows = []
+    for stage in sorted(stages, key=lambda s: (s.started is None, s.started or 0)):
+        ready_at = max((by_name[dep].finished or 0 for dep in dependencies[stage.name]), default=0)
+        rows.append({
+            'stage': stage.name,
+            'status': stage.status,
+            'start_s': round(stage.started, 2) if stage.started is not None else None,
+            # Thời gian chờ worker trống sau khi mọi stage phụ thuộc đã xong
+            'queued_s': round(stage.started - ready_at, 2) if stage.started is not None else None,
+            'seconds': round(stage.seconds, 2) if stage.seconds is not None else None,
+            'critical': '*' if stage.name in on_path else '',
+        })
+    ran = [stage for stage in stages if stage.seconds is not None]
+    wall = max((stage.finished for stage in ran), default=0)
+    busy = sum(stage.seconds for stage in ran)
+    path_seconds = sum(by_name[name].seconds for name in on_path)
+    summary = (
+        f"Wall-clock {wall:.2f} giây, tổng thời gian các stage {busy:.2f} giây "
+        f"(song song x{busy / wall if wall else 0:.1f}), critical path {path_seconds:.2f} giây: "
+        + " -> ".join(stage.name for stage in critical_path(stages))
+    )
+    return tabulate(rows, headers='keys', tablefmt='psql') + "\n" + summary
+
+
+def _load_staging_stage(csv_file, table_name, data_dir, db_engine, method, skip_unchanged):
+    load_stats = extract_load_to_staging({csv_file: table_name}, data_dir, db_engine, method=method,
+                                         skip_unchanged=skip_unchanged)
+    # extract_load_to_staging chỉ log lỗi của từng bảng; ở đây bảng lỗi phải làm stage lỗi
+    if table_name not in load_stats:
+        raise RuntimeError(f"Load {csv_file} vào {table_name} thất bại")
+
+
+def _geo_lookup_stage(db_engine, cache_dir):
+    with db_engine.connect() as connection:
+        load_geo_lookup(connection, cache_dir)
+
+
+def _truncate_stage(db_engine):
+    with db_engine.begin() as connection:
+        truncate_for_full_reload(connection)
+
+
+def build_stages(db_engine, data_dir, staging_method='copy', transform_engine='pandas', fact_mode='full',
+                 full_reload=False, skip_unchanged=False, geo_cache_dir=None):
+    """Các stage của pipeline ETL đầy đủ: một stage mỗi bảng staging, Dimension, Fact và materialized view."""
+    stages = [
+        Stage(
+            f"staging.{table_name.split('.')[-1]}",
+            partial(_load_staging_stage, csv_file, table_name, data_dir, db_engine, staging_method, skip_unchanged),
+            outputs=[table_name],
+        )
+        for csv_file, table_name in CSV_FILES.items()
+    ]
+    stages.append(Stage(
+        'dimensions.geo_lookup', partial(_geo_lookup_stage, db_engine, geo_cache_dir),
+        inputs=['staging.stg_geolocation'], outputs=['geo_lookup'],
+    ))
+    truncate_inputs = []
+    if full_reload:
+        # Fact và các Dimension được TRUNCATE một lần trước khi các Dimension load song song; chờ mọi input
+        # của các Dimension để staging/geo_lookup lỗi không để lại DWH rỗng
+        dimension_inputs = sorted({i for inputs in DIMENSION_INPUTS.values() for i in inputs})
+        stages.append(Stage(
+            'dimensions.truncate', partial(_truncate_stage, db_engine),
+            inputs=dimension_inputs, outputs=['full_reload_truncate'],
+        ))
+        truncate_inputs = ['full_reload_truncate']
+    for dim_name in DIMENSION_LOADERS:
+        stages.append(Stage(
+            f"dimensions.{dim_name}",
+            partial(transform_and_load_dimensions, db_engine, full_reload=full_reload, geo_cache_dir=geo_cache_dir,
+                    skip_unchanged=skip_unchanged, dimensions=[dim_name], truncate=False),
+            inputs=DIMENSION_INPUTS[dim_name] + truncate_inputs, outputs=[f"dwh.{dim_name}"],
+        ))
+    stages.append(Stage(
+        'fact',
+        partial(transform_and_load_fact, db_engine, mode=fact_mode, transform_engine=transform_engine,
+                refresh_aggregates=False, skip_unchanged=skip_unchanged),
+        inputs=FACT_INPUTS, outputs=FACT_OUTPUTS,
+    ))
+    for view_name in AGGREGATE_VIEWS:
+        stages.append(Stage(
+            f"aggregates.{view_name.split('.')[-1]}",
+            partial(refresh_aggregate_views, db_engine, views=[view_name]),
+            inputs=AGGREGATE_INPUTS[view_name], outputs=[view_name],
+        ))
+    return stages
+
+
+def load_resume_state(state_path, params):
+    """
+    Tên các stage đã xong của lần chạy trước nếu lần đó chưa hoàn thành; tập rỗng nếu chưa có
+    state file hoặc lần trước đã chạy xong. ValueError nếu lần trước chạy với tham số khác.
+    """
+    if not state_path.exists():
+        logging.info(f"Không có state file {state_path}, chạy toàn bộ pipeline.")
+        return set()
+    state = json.loads(state_path.read_text(encoding='utf-8'))
+    if state['params'] != params:
+        raise ValueError(f"Cannot resume run {state['run_id']}: it used different parameters {state['params']}")
+    completed = {name for name, status in state['stages'].items() if status in COMPLETED_STATUSES}
+    if completed == set(state['stages']):
+        logging.info(f"Lần chạy {state['run_id']} đã hoàn thành, chạy lại toàn bộ pipeline.")
+        return set()
+    logging.info(f"Resume lần chạy {state['run_id']}: bỏ qua {len(completed)}/{len(state['stages'])} stage đã xong.")
+    return completed
+
+
+def write_state(state_path, run_id, params, stages):
+    """Ghi status các stage (ghi file tạm rồi rename để state file không bao giờ dở dang)."""
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    state = {
+        'run_id': run_id,
+        'updated_at': datetime.now().isoformat(timespec='seconds'),
+        'params': params,
+        'stages': {stage.name: stage.status for stage in stages},
+    }
+    tmp_path = state_path.with_suffix('.json.tmp')
+    tmp_path.write_text(json.dumps(state, indent=2, ensure_ascii=False), encoding='utf-8')
+    tmp_path.replace(state_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chạy pipeline ETL theo DAG, các stage độc lập chạy song song")
+    parser.add_argument('--data-dir', type=Path, required=True, help="Thư mục chứa các file CSV Olist")
+    parser.add_argument('--workers', type=int, default=4, help="Số stage chạy đồng thời")
+    parser.add_argument('--staging-method', default='copy')
+    parser.add_argument('--transform-engine', default='pandas', choices=['pandas', 'sql'])
+    parser.add_argument('--fact-mode', default='full', choices=['full', 'incremental'])
+    parser.add_argument('--full-reload', action='store_true', help="Load lại toàn bộ Dimension (TRUNCATE ... CASCADE)")
+    parser.add_argument('--skip-unchanged', action='store_true', help="Bỏ qua file/stage có input không thay đổi")
+    parser.add_argument('--resume', action='store_true', help="Chạy tiếp từ stage lỗi của lần chạy trước")
+    parser.add_argument('--state-file', type=Path, default=PIPELINE_STATE_PATH)
+    parser.add_argument('--run-name', default='pipeline')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(threadName)s - %(levelname)s - %(message)s')
+    load_dotenv()
+    params = {
+        'data_dir': str(args.data_dir.resolve()), 'staging_method': args.staging_method,
+        'transform_engine': args.transform_engine, 'fact_mode': args.fact_mode,
+        'full_reload': args.full_reload, 'skip_unchanged': args.skip_unchanged,
+    }
+    completed = load_resume_state(args.state_file, params) if args.resume else set()
+
+    # Mỗi stage giữ tối đa một connection của engine (staging COPY, transaction Dimension/Fact)
+    engine = create_engine(database_uri_from_env(), pool_size=args.workers, max_overflow=args.workers)
+    stages = build_stages(
+        engine, args.data_dir, staging_method=args.staging_method, transform_engine=args.transform_engine,
+        fact_mode=args.fact_mode, full_reload=args.full_reload, skip_unchanged=args.skip_unchanged,
+    )
+    failed = False
+    try:
+        with etl_run(engine, args.run_name) as run:
+            run_pipeline(
+                stages, max_workers=args.workers, completed=completed,
+                on_stage_done=lambda stage: write_state(args.state_file, run.run_id, params, stages),
+            )
+    except Exception as e:
+        failed = True
+        logging.error(f"Pipeline dừng do lỗi: {e}. Chạy lại với --resume để tiếp tục từ stage lỗi.")
+    finally:
+        engine.dispose()
+
+    print(timing_report(stages))
+    raise SystemExit(1 if failed else 0)
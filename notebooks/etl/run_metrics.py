@@ -0,0 +1,259 @@
+"""
+Đo đạc các bước ETL theo span có tên: wall time, CPU time, peak RSS, số dòng và rows/sec.
+
+Peak RSS của span là max của RSS hiện tại (/proc/self/statm) lấy mẫu trong thời gian span chạy,
+nên mỗi stage có peak riêng; ru_maxrss chỉ tăng chứ không giảm nên chỉ được ghi kèm dưới tên
+process_peak_rss_mb (peak tích lũy của process từ đầu tới khi span kết thúc). Đỉnh RSS ngắn hơn
+RSS_SAMPLE_INTERVAL có thể bị bỏ sót trong peak_rss_mb của span.
+
+Dùng:
+    with etl_run(engine, 'daily'):
+        extract_load_to_staging(...)
+        transform_and_load_fact(...)
+
+Trong các hàm ETL, mỗi bước được bọc bằng `with span('fact.load') as s: ...; s.rows = n`
+(hoặc decorator @instrumented('...')). Khi có run đang chạy, span được ghi vào run record
+(JSON) và bảng dwh.etl_run_metrics (09_create_etl_run_metrics.sql); nếu không chỉ ghi log.
+"""
+import functools
+import json
+import logging
+import os
+import resource
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+from sqlalchemy import text
+
+# Thư mục chứa các file JSON run record
+RUN_RECORD_DIR = Path(os.getenv('ETL_RUN_DIR', Path.home() / '.cache' / 'olist_etl' / 'runs'))
+
+# Chu kỳ lấy mẫu RSS (giây) trong khi có span đang chạy
+RSS_SAMPLE_INTERVAL = float(os.getenv('ETL_RSS_SAMPLE_INTERVAL', '0.02'))
+
+_active_run = None
+_span_stack = threading.local()
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def peak_rss_mb():
+    """Peak RSS tích lũy của process hiện tại (MB, Linux: ru_maxrss tính bằng KB). Không bao giờ giảm."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_rss_mb():
+    """RSS hiện tại của process (MB, từ /proc/self/statm). Ngoài Linux trả về peak_rss_mb()."""
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return peak_rss_mb()
+    return resident_pages * _PAGE_SIZE / 2**20
+
+
+class _RssSampler:
+    """
+    Một thread nền dùng chung: mỗi RSS_SAMPLE_INTERVAL giây đọc RSS hiện tại và cập nhật
+    peak_rss_mb của mọi span đang mở. Span cũng được lấy mẫu lúc bắt đầu và kết thúc,
+    nên span ngắn hơn chu kỳ lấy mẫu vẫn có giá trị.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._spans = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.max_sampled_mb = 0.0  # Mẫu RSS lớn nhất từng đọc được trong process
+
+    def _record(self, spans):
+        rss = current_rss_mb()
+        self.max_sampled_mb = max(self.max_sampled_mb, rss)
+        for open_span in spans:
+            if open_span.peak_rss_mb is None or rss > open_span.peak_rss_mb:
+                open_span.peak_rss_mb = rss
+
+    def start(self, open_span):
+        with self._lock:
+            self._record([open_span])
+            self._spans.add(open_span)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='etl-rss-sampler', daemon=True)
+                self._thread.start()
+            self._wake.set()
+
+    def stop(self, open_span):
+        with self._lock:
+            self._spans.discard(open_span)
+            self._record([open_span])
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._spans:
+                    # Không còn span nào: chờ span tiếp theo thay vì lấy mẫu vô ích
+                    self._wake.clear()
+                    continue
+                self._record(self._spans)
+
+
+_rss_sampler = _RssSampler(RSS_SAMPLE_INTERVAL)
+
+
+class Span:
+    """Một bước được đo. rows có thể gán trong thân with để tính rows/sec."""
+
+    def __init__(self, name, parent=None, rows=None):
+        self.name = name
+        self.parent = parent
+        self.rows = rows
+        self.status = 'ok'
+        self.started_at = datetime.now()
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_rss_mb = None  # Peak RSS trong thời gian span chạy
+        self.process_peak_rss_mb = None  # Peak tích lũy của process (ru_maxrss) khi span kết thúc
+
+    @property
+    def rows_per_second(self):
+        if self.rows is None or not self.wall_seconds:
+            return None
+        return self.rows / self.wall_seconds
+
+    def to_dict(self):
+        return {
+            'span_name': self.name,
+            'parent_span': self.parent,
+            'started_at': self.started_at.isoformat(),
+            'wall_seconds': round(self.wall_seconds, 3),
+            'cpu_seconds': round(self.cpu_seconds, 3),
+            'peak_rss_mb': round(self.peak_rss_mb, 1),
+            'process_peak_rss_mb': round(self.process_peak_rss_mb, 1),
+            'row_count': self.rows,
+            'rows_per_second': round(self.rows_per_second, 1) if self.rows_per_second is not None else None,
+            'status': self.status,
+        }
+
+
+class RunRecord:
+    """Các span của một lần chạy ETL, theo thứ tự kết thúc."""
+
+    def __init__(self, run_name):
+        self.run_id = str(uuid.uuid4())
+        self.run_name = run_name
+        self.started_at = datetime.now()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, finished_span):
+        with self._lock:
+            self.spans.append(finished_span)
+
+    def to_dict(self):
+        return {
+            'run_id': self.run_id,
+            'run_name': self.run_name,
+            'run_started_at': self.started_at.isoformat(),
+            'spans': [s.to_dict() for s in self.spans],
+        }
+
+    def write_json(self, record_dir=None):
+        record_dir = Path(record_dir) if record_dir else RUN_RECORD_DIR
+        record_dir.mkdir(parents=True, exist_ok=True)
+        path = record_dir / f"etl_run_{self.started_at:%Y%m%d_%H%M%S}_{self.run_id[:8]}.json"
+        path.write_text(json.dumps(self.to_dict(), indent=2, ensure_ascii=False), encoding='utf-8')
+        return path
+
+    def save_to_db(self, db_engine):
+        """Ghi các span vào dwh.etl_run_metrics (một dòng mỗi span)."""
+        df_spans = pd.DataFrame([s.to_dict() for s in self.spans])
+        if df_spans.empty:
+            return 0
+        df_spans.insert(0, 'span_seq', range(1, len(df_spans) + 1))
+        df_spans.insert(0, 'run_started_at', self.started_at)
+        df_spans.insert(0, 'run_name', self.run_name)
+        df_spans.insert(0, 'run_id', self.run_id)
+        df_spans['started_at'] = pd.to_datetime(df_spans['started_at'])
+        with db_engine.begin() as connection:
+            df_spans.to_sql('etl_run_metrics', connection, schema='dwh', if_exists='append', index=False)
+        return len(df_spans)
+
+
+@contextmanager
+def span(name, rows=None):
+    """
+    Đo một bước: wall time (perf_counter), CPU time của process (gồm cả các worker thread),
+    peak RSS trong thời gian span chạy (lấy mẫu, xem _RssSampler) và peak tích lũy của process
+    khi kết thúc. Span lồng nhau ghi lại tên span cha (trong cùng thread).
+    """
+    stack = getattr(_span_stack, 'names', None)
+    if stack is None:
+        stack = _span_stack.names = []
+    current = Span(name, parent=stack[-1] if stack else None, rows=rows)
+    stack.append(name)
+    _rss_sampler.start(current)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield current
+    except BaseException:
+        current.status = 'error'
+        raise
+    finally:
+        stack.pop()
+        current.wall_seconds = time.perf_counter() - wall_start
+        current.cpu_seconds = time.process_time() - cpu_start
+        _rss_sampler.stop(current)
+        # ru_maxrss được kernel cập nhật trễ, có thể thấp hơn một chút so với các mẫu RSS đã đọc
+        current.process_peak_rss_mb = max(peak_rss_mb(), _rss_sampler.max_sampled_mb)
+        rate = f", {current.rows} dòng ({current.rows_per_second:,.0f} dòng/giây)" if current.rows_per_second else ""
+        logging.info(
+            f"[{name}] {current.wall_seconds:.2f} giây (CPU {current.cpu_seconds:.2f} giây), "
+            f"peak RSS {current.peak_rss_mb:.0f} MB (process {current.process_peak_rss_mb:.0f} MB){rate}."
+        )
+        if _active_run is not None:
+            _active_run.add(current)
+
+
+def instrumented(name):
+    """Decorator: bọc toàn bộ hàm trong một span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def etl_run(db_engine=None, run_name='etl', record_dir=None):
+    """
+    Ghi lại mọi span trong thân with thành một run record. Khi kết thúc (kể cả khi lỗi):
+    ghi file JSON vào record_dir (mặc định RUN_RECORD_DIR) và, nếu có db_engine,
+    ghi vào dwh.etl_run_metrics. Lỗi khi ghi metrics chỉ được log, không che lỗi của ETL.
+    """
+    global _active_run
+    if _active_run is not None:
+        raise RuntimeError("An ETL run is already being recorded")
+    run = _active_run = RunRecord(run_name)
+    try:
+        with span(f"run.{run_name}"):
+            yield run
+    finally:
+        _active_run = None
+        path = run.write_json(record_dir)
+        logging.info(f"Run record: {path}")
+        if db_engine is not None:
+            try:
+                saved = run.save_to_db(db_engine)
+                logging.info(f"Ghi {saved} span vào dwh.etl_run_metrics.")
+            except Exception as e:
+                logging.error(f"Không thể ghi dwh.etl_run_metrics: {e}")
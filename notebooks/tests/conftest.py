@@ -2,19 +2,30 @@
 import pytest
 import os
 from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
 from dotenv import load_dotenv
 from pathlib import Path
 import sys
 
-# # Giả sử bạn import các hàm ETL chính từ script của bạn
-# from etl.main_etl import extract_load_to_staging, transform_and_load_dimensions, transform_and_load_fact, CSV_FILES
+# Thêm thư mục notebooks vào sys.path để có thể import package etl
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
+from etl.main_etl import CSV_FILES, database_uri_from_env
+
+# Kết nối tới Postgres theo các biến POSTGRES_* (từ môi trường hoặc file .env), giống ETL
+load_dotenv()
+DATABASE_URI = database_uri_from_env()
 
 
 @pytest.fixture(scope='session') 
 def db_engine():
-
     engine = create_engine(DATABASE_URI)
+    try:
+        with engine.connect():
+            pass
+    except OperationalError as e:
+        engine.dispose()
+        pytest.skip(f"Không kết nối được Postgres cho integration test (POSTGRES_* trong .env): {e.orig}")
     yield engine 
     engine.dispose() 
 
@@ -26,18 +37,52 @@ def setup_test_database(db_engine):
         with connection.begin(): # Dùng transaction
              # Truncate theo thứ tự ngược (Fact -> Dim -> Staging) để tránh lỗi FK
             connection.execute(text("TRUNCATE TABLE dwh.fact_order_delivery CASCADE;"))
+            connection.execute(text("TRUNCATE TABLE dwh.fact_order_item CASCADE;"))
             connection.execute(text("TRUNCATE TABLE dwh.dim_customer CASCADE;"))
             connection.execute(text("TRUNCATE TABLE dwh.dim_seller CASCADE;"))
+            connection.execute(text("TRUNCATE TABLE dwh.dim_product CASCADE;"))
             for table_name in reversed(list(CSV_FILES.values())): # Truncate staging
                 connection.execute(text(f"TRUNCATE TABLE {table_name} CASCADE;"))
+            connection.execute(text("TRUNCATE TABLE staging.etl_source_manifest;"))
+            connection.execute(text("TRUNCATE TABLE dwh.etl_stage_state;"))
     yield 
     print("\nTest finished.")
 
 
+@pytest.fixture(scope='function')
+def typed_staging(db_engine, setup_test_database):
+    """Chuyển staging sang layout có kiểu (02b) trong một test, sau đó trả lại layout VARCHAR (02) nếu trước đó là 02."""
+    ddl_dir = Path(__file__).resolve().parents[2] / 'postgres' / 'DDLs'
+    column_type_query = text("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_schema = 'staging' AND table_name = 'stg_order_items' AND column_name = 'order_item_id';
+    """)
+    with db_engine.begin() as connection:
+        was_typed = connection.execute(column_type_query).scalar() == 'integer'
+        if not was_typed:
+            connection.exec_driver_sql((ddl_dir / '02b_create_typed_staging_tables.sql').read_text())
+    yield
+    if not was_typed:
+        with db_engine.begin() as connection:
+            connection.exec_driver_sql((ddl_dir / '02_create_staging_tables.sql').read_text())
+
+
 @pytest.fixture(scope='session')
-def sample_data_dir():
-    """Trả về đường dẫn đến thư mục data mẫu."""
-    return Path(__file__).resolve().parent / 'sample_data'
+def sample_data_dir(tmp_path_factory):
+    """
+    Trả về đường dẫn đến thư mục data mẫu. Nếu tests/sample_data chưa có file sample_*.csv,
+    sinh một bộ Olist tổng hợp nhỏ (benchmarks/synthetic_olist.py) với tên file có tiền tố sample_.
+    """
+    sample_dir = Path(__file__).resolve().parent / 'sample_data'
+    if all((sample_dir / f"sample_{csv_file}").exists() for csv_file in CSV_FILES):
+        return sample_dir
+    from benchmarks.synthetic_olist import generate_olist
+
+    sample_dir = tmp_path_factory.mktemp('sample_data')
+    generate_olist(sample_dir, scale=0.02, seed=7, geo_points_per_prefix=2)
+    for csv_file in CSV_FILES:
+        (sample_dir / csv_file).rename(sample_dir / f"sample_{csv_file}")
+    return sample_dir
 
 @pytest.fixture(scope='session')
 def sample_csv_files_map(sample_data_dir):
@@ -1,4 +1,7 @@
+import argparse
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
@@ -19,13 +22,6 @@ DB_PORT = '5432'
 DB_NAME = os.getenv('POSTGRES_DB')
 
 DATABASE_URI = f'postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
-try:
-    engine = create_engine(DATABASE_URI)
-    with engine.connect() as connection:
-        logging.info("Kết nối database thành công!")
-except Exception as e:
-    logging.error(f"Không thể kết nối database: {e}")
-    exit(1)
 
 
 validation_checks = {
@@ -37,17 +33,29 @@ validation_checks = {
         "type": "compare_count"
     },
     "count_dim_customer_vs_staging": {
-        "description": "So sánh số lượng Customer hiện hành trong Dim với Staging (unique id)",
-        "query_dwh": "SELECT COUNT(*) FROM dwh.dim_customer WHERE is_current = TRUE;",
+        "description": "So sánh số lượng Customer hiện hành trong Dim (trừ dòng Unknown -1 và bản ghi inferred) với Staging (unique id)",
+        "query_dwh": "SELECT COUNT(*) FROM dwh.dim_customer WHERE is_current = TRUE AND NOT is_inferred AND customer_key <> -1;",
         "query_staging": "SELECT COUNT(DISTINCT customer_id) FROM staging.stg_customers;",
         "type": "compare_count"
     },
     "count_dim_seller_vs_staging": {
-        "description": "So sánh số lượng Seller hiện hành trong Dim với Staging (unique id)",
-        "query_dwh": "SELECT COUNT(*) FROM dwh.dim_seller WHERE is_current = TRUE;",
+        "description": "So sánh số lượng Seller hiện hành trong Dim (trừ dòng Unknown -1 và bản ghi inferred) với Staging (unique id)",
+        "query_dwh": "SELECT COUNT(*) FROM dwh.dim_seller WHERE is_current = TRUE AND NOT is_inferred AND seller_key <> -1;",
         "query_staging": "SELECT COUNT(DISTINCT seller_id) FROM staging.stg_sellers;",
         "type": "compare_count"
     },
+    "count_dim_product_vs_staging": {
+        "description": "So sánh số lượng Product hiện hành trong Dim (trừ dòng Unknown -1 và bản ghi inferred) với Staging (unique id)",
+        "query_dwh": "SELECT COUNT(*) FROM dwh.dim_product WHERE is_current = TRUE AND NOT is_inferred AND product_key <> -1;",
+        "query_staging": "SELECT COUNT(DISTINCT product_id) FROM staging.stg_products;",
+        "type": "compare_count"
+    },
+    "count_fact_items_vs_staging": {
+        "description": "So sánh số dòng trong Fact grain item với số item Staging (của các order có trong Staging)",
+        "query_dwh": "SELECT COUNT(*) FROM dwh.fact_order_item;",
+        "query_staging": "SELECT COUNT(*) FROM staging.stg_order_items i WHERE i.order_id IN (SELECT o.order_id FROM staging.stg_orders o);",
+        "type": "compare_count"
+    },
     # === 2. Aggregate Value Validation ===
     "agg_fact_vs_staging_items": {
         "description": "So sánh tổng giá trị/số lượng items (Fact vs Staging)",
@@ -71,6 +79,26 @@ validation_checks = {
         "type": "compare_aggregates",
         "tolerance": 0.01 # Dung sai cho so sánh số thực
     },
+    "agg_fact_items_vs_fact_orders": {
+        "description": "So sánh tổng giá trị/số lượng items giữa Fact grain item và Fact grain order",
+        "query_dwh": """
+            SELECT
+                COALESCE(SUM(price), 0) AS total_price,
+                COALESCE(SUM(freight_value), 0) AS total_freight_value,
+                COUNT(*) AS item_count
+            FROM dwh.fact_order_item
+            WHERE order_id IN (SELECT fd.order_id FROM dwh.fact_order_delivery fd);
+        """,
+        "query_staging": """
+            SELECT
+                COALESCE(SUM(total_price), 0) AS total_price,
+                COALESCE(SUM(total_freight_value), 0) AS total_freight_value,
+                COALESCE(SUM(item_count), 0) AS item_count
+            FROM dwh.fact_order_delivery;
+        """,
+        "type": "compare_aggregates",
+        "tolerance": 0.01
+    },
     # === 3. Key Integrity Validation ===
     "key_null_purchase_date": {
         "description": "Kiểm tra NULL purchase_date_key trong Fact (không nên có)",
@@ -122,6 +150,26 @@ validation_checks = {
         """,
         "type": "expect_zero"
     },
+    "key_unknown_product": {
+        "description": "Kiểm tra product_key = -1 trong Fact grain item (nếu dùng)",
+        "query": "SELECT COUNT(*) FROM dwh.fact_order_item WHERE product_key = -1;",
+        "type": "report_count"
+    },
+    "inferred_customers": {
+        "description": "Số Customer inferred (order tham chiếu customer_id chưa có trong staging.stg_customers)",
+        "query": "SELECT COUNT(*) FROM dwh.dim_customer WHERE is_current = TRUE AND is_inferred;",
+        "type": "report_count"
+    },
+    "inferred_sellers": {
+        "description": "Số Seller inferred (item tham chiếu seller_id chưa có trong staging.stg_sellers)",
+        "query": "SELECT COUNT(*) FROM dwh.dim_seller WHERE is_current = TRUE AND is_inferred;",
+        "type": "report_count"
+    },
+    "inferred_products": {
+        "description": "Số Product inferred (item tham chiếu product_id chưa có trong staging.stg_products)",
+        "query": "SELECT COUNT(*) FROM dwh.dim_product WHERE is_current = TRUE AND is_inferred;",
+        "type": "report_count"
+    },
     "key_orphan_approved_date": {
         "description": "Kiểm tra khóa ngoại Approved Date không tồn tại trong Dim Date (trừ NULL/-1)",
          "query": """
@@ -144,12 +192,24 @@ validation_checks = {
         "description": "Kiểm tra người bán hiện hành bị trùng lặp (theo seller_id)",
         "query": "SELECT seller_id, COUNT(*) FROM dwh.dim_seller WHERE is_current = TRUE GROUP BY seller_id HAVING COUNT(*) > 1;",
         "type": "expect_empty_dataframe"
+    },
+    "duplicate_current_products": {
+        "description": "Kiểm tra sản phẩm hiện hành bị trùng lặp (theo product_id)",
+        "query": "SELECT product_id, COUNT(*) FROM dwh.dim_product WHERE is_current = TRUE GROUP BY product_id HAVING COUNT(*) > 1;",
+        "type": "expect_empty_dataframe"
     },
      "duplicate_fact_orders": {
         "description": "Kiểm tra order_id bị trùng lặp trong Fact",
         "query": "SELECT order_id, COUNT(*) FROM dwh.fact_order_delivery GROUP BY order_id HAVING COUNT(*) > 1;",
         "type": "expect_empty_dataframe"
     },
+    "fact_order_in_one_partition": {
+        "description": "Kiểm tra mỗi order_id chỉ nằm trong một partition tháng của Fact (uidx_fod_order_id gồm cả purchase_date_key nên DB không đảm bảo)",
+        "query": "SELECT order_id, COUNT(DISTINCT purchase_date_key) AS purchase_date_keys FROM dwh.fact_order_delivery GROUP BY order_id HAVING COUNT(DISTINCT purchase_date_key) > 1;",
+        "type": "expect_empty_dataframe",
+        # Dòng cũ của order có thể nằm ở tháng ngoài phạm vi --since: luôn kiểm tra trên toàn bộ Fact
+        "scoped": False
+    },
     # === 5. Business Rule Validation ===
     "rule_negative_delivery_time": {
         "description": "Kiểm tra delivery_time_days < 0 (không nên có)",
@@ -228,7 +288,84 @@ validation_checks = {
 
 }
 
-def run_validation(check_name, check_config, db_engine):
+# Tham chiếu tới một bảng được giới hạn phạm vi, có thể kèm alias (vd. "dwh.fact_order_delivery fod")
+SCOPED_TABLE_REF = r"\b{table}\b(?:\s+(?:AS\s+)?(?!(?:WHERE|GROUP|ORDER|LEFT|RIGHT|INNER|FULL|CROSS|NATURAL|JOIN|ON|WINDOW|LIMIT|OFFSET|FETCH|HAVING|UNION|EXCEPT|INTERSECT)\b)(\w+))?"
+
+
+class ValidationScope:
+    """
+    Giới hạn phạm vi của các check để chi phí validation tỉ lệ với lần load, không với kích thước DWH.
+
+    table_predicates: {bảng: điều kiện}, mỗi tham chiếu tới bảng trong câu truy vấn được thay bằng
+        subquery chỉ chứa các dòng thỏa điều kiện (giữ nguyên alias).
+    sample_percent: với các check compare_aggregates, Fact được lấy mẫu bằng
+        TABLESAMPLE SYSTEM (sample_percent) REPEATABLE (seed) - cùng một mẫu cho cả phía DWH và Staging.
+        Chỉ tổng trên mẫu được so sánh, nên đây là kiểm tra nhanh chứ không phải ước lượng tỉ lệ order sai lệch.
+    Check có "scoped": False luôn chạy trên toàn bộ bảng (không gộp, không giới hạn phạm vi).
+    """
+
+    def __init__(self, table_predicates=None, sample_percent=None, seed=42):
+        self.table_predicates = dict(table_predicates or {})
+        self.sample_percent = sample_percent
+        self.seed = seed
+
+    @classmethod
+    def since(cls, db_engine, since, sample_percent=None):
+        """
+        Phạm vi của các dòng Fact được load từ `since`: khoảng purchase_date_key mà lần load chạm tới
+        (cùng các dòng load từ `since` dù purchase_date_key NULL), và các order Staging trong khoảng đó.
+        """
+        since = pd.Timestamp(since)
+        bounds = pd.read_sql(
+            text("SELECT MIN(purchase_date_key) AS start_key, MAX(purchase_date_key) AS end_key "
+                 "FROM dwh.fact_order_delivery WHERE dw_load_timestamp >= :since"),
+            db_engine, params={'since': since.to_pydatetime()}
+        ).iloc[0]
+        if pd.isna(bounds['start_key']):
+            logging.info(f"Không có dòng Fact nào được load từ {since}.")
+            fact_predicate = f"dw_load_timestamp >= '{since.isoformat()}'"
+            staging_predicate = "FALSE"
+        else:
+            start_key, end_key = int(bounds['start_key']), int(bounds['end_key'])
+            start_date = pd.to_datetime(str(start_key), format='%Y%m%d').date()
+            end_date = pd.to_datetime(str(end_key), format='%Y%m%d').date()
+            logging.info(f"Giới hạn validation trong purchase date {start_date} .. {end_date} (load từ {since}).")
+            fact_predicate = (
+                f"(purchase_date_key BETWEEN {start_key} AND {end_key} "
+                f"OR dw_load_timestamp >= '{since.isoformat()}')"
+            )
+            staging_predicate = (
+                f"dwh.try_cast_timestamp(order_purchase_timestamp)::DATE BETWEEN '{start_date}' AND '{end_date}'"
+            )
+        return cls({
+            'dwh.fact_order_delivery': fact_predicate,
+            'dwh.fact_order_item': fact_predicate,
+            'staging.stg_orders': staging_predicate,
+        }, sample_percent=sample_percent)
+
+    def apply(self, sql, sample=False):
+        """Viết lại câu truy vấn theo phạm vi; sample=True thì lấy mẫu Fact (nếu có sample_percent)."""
+        if sql is None:
+            return None
+        tables = dict(self.table_predicates)
+        if sample and self.sample_percent:
+            tables.setdefault('dwh.fact_order_delivery', None)
+        for table, predicate in tables.items():
+            source = table
+            if sample and self.sample_percent and table == 'dwh.fact_order_delivery':
+                source += f" TABLESAMPLE SYSTEM ({self.sample_percent}) REPEATABLE ({self.seed})"
+            where = f" WHERE {predicate}" if predicate else ""
+            default_alias = table.split('.')[1]
+            sql = re.sub(
+                SCOPED_TABLE_REF.format(table=re.escape(table)),
+                lambda m: f"(SELECT * FROM {source}{where}) AS {m.group(1) or default_alias}",
+                sql,
+                flags=re.I
+            )
+        return sql
+
+
+def run_validation(check_name, check_config, db_engine, scope=None):
     """Chạy một kiểm tra validation và trả về kết quả."""
     logging.info(f"Running check: {check_name} - {check_config['description']}")
     start_time = time.time()
@@ -241,6 +378,9 @@ def run_validation(check_name, check_config, db_engine):
         query = check_config.get("query")
         query_dwh = check_config.get("query_dwh")
         query_staging = check_config.get("query_staging")
+        if scope is not None and check_config.get("scoped", True):
+            sample = check_type == "compare_aggregates"
+            query, query_dwh, query_staging = (scope.apply(sql, sample=sample) for sql in (query, query_dwh, query_staging))
         tolerance = check_config.get("tolerance", 0.0)
 
         if check_type == "compare_count":
@@ -275,6 +415,14 @@ def run_validation(check_name, check_config, db_engine):
             else:
                 message = f"Aggregate mismatch: {'; '.join(mismatches)}"
             details = {"dwh": df_dwh.to_dict('records')[0], "staging": df_staging.to_dict('records')[0]}
+            if scope is not None and scope.sample_percent:
+                sampled_orders = int(pd.read_sql(
+                    scope.apply("SELECT COUNT(*) FROM dwh.fact_order_delivery", sample=True), db_engine
+                ).iloc[0, 0])
+                details["sampled_orders"] = sampled_orders
+                # Chỉ so sánh tổng trên mẫu, không so từng order: sai lệch giữa các order có thể bù trừ nhau,
+                # nên tổng khớp không cho cận trên nào về số order sai lệch
+                message += f" (sample {scope.sample_percent}%: {sampled_orders} orders)"
 
 
         elif check_type in ["expect_zero", "expect_zero_or_warning"]:
@@ -336,14 +484,236 @@ def run_validation(check_name, check_config, db_engine):
         "duration": duration
     }
 
+# Check dạng "SELECT COUNT(*) FROM <bảng> WHERE <điều kiện>" hoặc "SELECT <cột> FROM <bảng> WHERE <điều kiện>"
+# (không JOIN/GROUP BY/subquery) có thể gộp với các check khác trên cùng bảng thành một lần scan.
+FUSABLE_QUERY_PATTERNS = {
+    "count": re.compile(r"^\s*SELECT\s+COUNT\(\*\)\s+FROM\s+(?P<table>[\w.]+)\s+WHERE\s+(?P<predicate>.+?)\s*;?\s*$", re.I | re.S),
+    "rows": re.compile(r"^\s*SELECT\s+[\w\s,.]+?\s+FROM\s+(?P<table>[\w.]+)\s+WHERE\s+(?P<predicate>.+?)\s*;?\s*$", re.I | re.S),
+}
+FUSABLE_CHECK_TYPES = {
+    "expect_zero": "count",
+    "expect_zero_or_warning": "count",
+    "report_count": "count",
+    "expect_empty_dataframe": "rows",
+}
+NOT_FUSABLE_PREDICATE = re.compile(r"\b(SELECT|JOIN|GROUP\s+BY|HAVING|ORDER\s+BY|LIMIT|UNION)\b", re.I)
+
+
+def fusable_check(check_config):
+    """Trả về (table, predicate) nếu check có thể chạy trong truy vấn gộp, ngược lại None."""
+    query_kind = FUSABLE_CHECK_TYPES.get(check_config["type"])
+    if query_kind is None or not check_config.get("query") or not check_config.get("scoped", True):
+        return None
+    match = FUSABLE_QUERY_PATTERNS[query_kind].match(check_config["query"])
+    if match is None or NOT_FUSABLE_PREDICATE.search(match.group("predicate")):
+        return None
+    return match.group("table"), match.group("predicate")
+
+
+def plan_validations(checks):
+    """
+    Chia các check thành các nhóm gộp theo bảng ({table: [(check_name, predicate)]})
+    và các check chạy riêng (list check_name). Nhóm chỉ có một check được chạy riêng.
+    """
+    fused_groups = {}
+    single_checks = []
+    for check_name, check_config in checks.items():
+        fusable = fusable_check(check_config)
+        if fusable is None:
+            single_checks.append(check_name)
+        else:
+            table, predicate = fusable
+            fused_groups.setdefault(table, []).append((check_name, predicate))
+    for table in [table for table, members in fused_groups.items() if len(members) == 1]:
+        single_checks.append(fused_groups.pop(table)[0][0])
+    return fused_groups, single_checks
+
+
+def _read_details(query, db_engine):
+    """
+    Đọc các dòng chi tiết của một check. Trên connection (nhóm gộp chạy trong một transaction),
+    truy vấn chạy trong savepoint: lỗi/timeout chỉ rollback savepoint, các check sau trong nhóm
+    không bị "current transaction is aborted".
+    """
+    if not hasattr(db_engine, 'begin_nested'):
+        return pd.read_sql(query, db_engine)
+    with db_engine.begin_nested():
+        return pd.read_sql(query, db_engine)
+
+
+def _fused_check_result(check_name, check_config, count, table, predicate, db_engine, duration, scope=None):
+    """Dựng kết quả giống run_validation từ count của truy vấn gộp; chỉ lấy dòng chi tiết khi check không PASS."""
+    check_type = check_config["type"]
+    start_time = time.time()
+    status = "FAIL"
+    details = None
+    try:
+        if check_type == "report_count":
+            status = "INFO"
+            message = f"Reported count: {count}"
+            details = count
+        elif count == 0:
+            status = "PASS"
+            message = "No records found, as expected." if check_type == "expect_empty_dataframe" else "Count is zero as expected."
+        elif check_type == "expect_empty_dataframe":
+            query = scope.apply(check_config["query"]) if scope is not None else check_config["query"]
+            details = _read_details(query, db_engine)
+            message = f"Found {len(details)} unexpected records."
+        else:
+            message = f"Found {count} records, expected zero."
+            if check_type == "expect_zero_or_warning":
+                status = "WARNING"
+            try:
+                query = f"SELECT * FROM {table} WHERE {predicate} LIMIT 5"
+                details = _read_details(scope.apply(query) if scope is not None else query, db_engine)
+            except Exception:
+                details = f"Count: {count}"
+    except Exception as e:
+        status = "ERROR"
+        message = f"Error executing check: {e}"
+        logging.exception(f"Exception occurred during check '{check_name}'")
+
+    duration += time.time() - start_time
+    logging.info(f"Check '{check_name}' completed in {duration:.2f}s with status: {status}")
+    return {
+        "name": check_name,
+        "description": check_config['description'],
+        "status": status,
+        "message": message,
+        "details": details,
+        "duration": duration
+    }
+
+
+def run_fused_validations(table, members, checks, db_engine, scope=None):
+    """
+    Chạy mọi check của một bảng trong một lần scan: SELECT COUNT(*) FILTER (WHERE ...) cho từng check.
+    Thời gian của truy vấn gộp được chia đều cho các check; lỗi -> mọi check của nhóm là ERROR.
+    """
+    logging.info(f"Running {len(members)} fused checks on {table}: {', '.join(name for name, _ in members)}")
+    start_time = time.time()
+    select_list = ",\n    ".join(
+        f"COUNT(*) FILTER (WHERE {predicate}) AS check_{i}" for i, (_, predicate) in enumerate(members)
+    )
+    fused_query = f"SELECT\n    {select_list}\nFROM {table};"
+    if scope is not None:
+        fused_query = scope.apply(fused_query)
+    try:
+        counts = pd.read_sql(fused_query, db_engine).iloc[0]
+    except Exception as e:
+        logging.exception(f"Exception occurred during fused checks on '{table}'")
+        duration = (time.time() - start_time) / len(members)
+        return [{
+            "name": check_name,
+            "description": checks[check_name]['description'],
+            "status": "ERROR",
+            "message": f"Error executing check: {e}",
+            "details": None,
+            "duration": duration
+        } for check_name, _ in members]
+
+    shared_duration = (time.time() - start_time) / len(members)
+    return [
+        _fused_check_result(
+            check_name, checks[check_name], int(counts[f"check_{i}"]), table, predicate, db_engine, shared_duration, scope
+        )
+        for i, (check_name, predicate) in enumerate(members)
+    ]
+
+
+def _run_single_validation(check_name, checks, db_engine, scope=None):
+    return [run_validation(check_name, checks[check_name], db_engine, scope=scope)]
+
+
+def _run_pooled(pool_engine, statement_timeout_ms, func, *args, **kwargs):
+    """Chạy func(*args, db_engine=connection, **kwargs) trên một connection riêng lấy từ pool, với statement_timeout riêng."""
+    with pool_engine.connect() as connection:
+        if statement_timeout_ms:
+            # is_local = true: chỉ áp dụng trong transaction của check này, tự reset khi trả connection về pool
+            connection.execute(
+                text("SELECT set_config('statement_timeout', :timeout, true);"),
+                {'timeout': str(int(statement_timeout_ms))}
+            )
+        return func(*args, db_engine=connection, **kwargs)
+
+
+def run_validations(checks, db_engine, max_workers=1, statement_timeout_ms=None, fuse=True, scope=None):
+    """
+    Chạy các check trong `checks` trên một thread pool giới hạn max_workers
+    (pool connection riêng, đúng max_workers connection).
+    fuse=True: các check đếm đơn giản trên cùng một bảng được gộp thành một truy vấn (plan_validations).
+    scope: ValidationScope để giới hạn các check theo lần load (--since) và/hoặc lấy mẫu (--sample).
+    Kết quả trả về theo đúng thứ tự của `checks`, không phụ thuộc thứ tự hoàn thành.
+    """
+    if fuse:
+        fused_groups, single_checks = plan_validations(checks)
+    else:
+        fused_groups, single_checks = {}, list(checks)
+
+    wall_start = time.time()
+    pool_engine = create_engine(db_engine.url, pool_size=max(max_workers, 1), max_overflow=0)
+    try:
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix='validation') as executor:
+            futures = [
+                executor.submit(
+                    _run_pooled, pool_engine, statement_timeout_ms, run_fused_validations, table, members, checks,
+                    scope=scope
+                )
+                for table, members in fused_groups.items()
+            ] + [
+                executor.submit(
+                    _run_pooled, pool_engine, statement_timeout_ms, _run_single_validation, check_name, checks,
+                    scope=scope
+                )
+                for check_name in single_checks
+            ]
+            results_by_name = {result['name']: result for future in futures for result in future.result()}
+    finally:
+        pool_engine.dispose()
+    results = [results_by_name[check_name] for check_name in checks]
+
+    wall_time = time.time() - wall_start
+    sum_check_time = sum(result['duration'] for result in results)
+    logging.info(
+        f"Chạy {len(results)} check ({len(fused_groups)} truy vấn gộp) với {max_workers} worker: "
+        f"wall-clock {wall_time:.2f} giây, tổng thời gian từng check {sum_check_time:.2f} giây."
+    )
+    return results
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chạy các kiểm tra validation của DWH")
+    parser.add_argument('--workers', type=int, default=4, help="Số check chạy song song (1 = tuần tự)")
+    parser.add_argument('--statement-timeout', type=int, default=None, help="statement_timeout cho mỗi check (ms)")
+    parser.add_argument('--no-fuse', action='store_true', help="Không gộp các check đếm trên cùng bảng")
+    parser.add_argument('--since', default=None,
+                        help="Chỉ validate khoảng purchase date mà các dòng Fact load từ thời điểm này chạm tới")
+    parser.add_argument('--sample', type=float, default=None,
+                        help="Lấy mẫu Fact (phần trăm, TABLESAMPLE SYSTEM) cho các check compare_aggregates")
+    args = parser.parse_args()
+
+    try:
+        engine = create_engine(DATABASE_URI)
+        with engine.connect() as connection:
+            logging.info("Kết nối database thành công!")
+    except Exception as e:
+        logging.error(f"Không thể kết nối database: {e}")
+        exit(1)
+
     logging.info("=== STARTING DATA VALIDATION RUN ===")
-    all_results = []
     overall_status = "PASS"
 
-    for check_name, check_config in validation_checks.items():
-        result = run_validation(check_name, check_config, engine)
-        all_results.append(result)
+    scope = None
+    if args.since:
+        scope = ValidationScope.since(engine, args.since, sample_percent=args.sample)
+    elif args.sample:
+        scope = ValidationScope(sample_percent=args.sample)
+
+    all_results = run_validations(
+        validation_checks, engine, max_workers=args.workers, statement_timeout_ms=args.statement_timeout,
+        fuse=not args.no_fuse, scope=scope
+    )
+    for result in all_results:
         if result["status"] == "FAIL":
             overall_status = "FAIL"
         elif result["status"] == "ERROR":
@@ -2,9 +2,9 @@ import pytest
 from sqlalchemy import text
 import pandas as pd
 import sys
+import os
 
-
-# from .etl.main_etl import extract_load_to_staging, transform_and_load_dimensions, transform_and_load_fact
+from etl.main_etl import extract_load_to_staging, transform_and_load_dimensions, transform_and_load_fact
 
 # Sử dụng các fixtures từ conftest.py: db_engine, setup_test_database, sample_data_dir, sample_csv_files_map
 
@@ -109,4 +109,223 @@ def test_fact_load(setup_test_database, db_engine, sample_data_dir, sample_csv_f
         ).first()
         assert fact_data_neg is not None
         assert fact_data_neg[0] is None # delivery_time_days phải là NULL
-        assert fact_data_neg[1] is None # seller_processing_hours phải là NULL
\ No newline at end of file
+        assert fact_data_neg[1] is None # seller_processing_hours phải là NULL
+
+
+def test_fact_sql_engine_matches_pandas_engine(setup_test_database, db_engine, sample_data_dir, sample_csv_files_map):
+    """Engine 'sql' (in-database) phải cho kết quả giống engine 'pandas'."""
+    extract_load_to_staging(sample_csv_files_map, sample_data_dir, db_engine)
+    transform_and_load_dimensions(db_engine)
+
+    fact_query = """
+        SELECT * FROM dwh.fact_order_delivery ORDER BY order_id;
+    """
+    item_query = """
+        SELECT * FROM dwh.fact_order_item ORDER BY order_id, order_item_id;
+    """
+    ignored_cols = ['order_delivery_key', 'dw_load_timestamp']
+    ignored_item_cols = ['order_item_key', 'dw_load_timestamp']
+
+    transform_and_load_fact(db_engine, transform_engine='pandas')
+    with db_engine.connect() as connection:
+        df_pandas = pd.read_sql(fact_query, connection).drop(columns=ignored_cols)
+        df_pandas_items = pd.read_sql(item_query, connection).drop(columns=ignored_item_cols)
+
+    transform_and_load_fact(db_engine, transform_engine='sql')
+    with db_engine.connect() as connection:
+        df_sql = pd.read_sql(fact_query, connection).drop(columns=ignored_cols)
+        df_sql_items = pd.read_sql(item_query, connection).drop(columns=ignored_item_cols)
+
+    assert len(df_sql) == len(df_pandas) > 0
+    # Làm tròn giờ có thể khác nhau ở biên .005 (round-half-even vs round-half-up)
+    pd.testing.assert_frame_equal(df_sql, df_pandas, check_dtype=False, check_exact=False, atol=0.011)
+    assert len(df_sql_items) == len(df_pandas_items) >= len(df_pandas)
+    pd.testing.assert_frame_equal(df_sql_items, df_pandas_items, check_dtype=False)
+
+
+def test_fact_sql_engine_on_typed_staging(typed_staging, db_engine, sample_data_dir, sample_csv_files_map):
+    """Engine 'sql' chạy được trên staging có kiểu (02b: overload no-op của try_cast_*) và khớp engine 'pandas'."""
+    extract_load_to_staging(sample_csv_files_map, sample_data_dir, db_engine, method='typed')
+    transform_and_load_dimensions(db_engine)
+
+    fact_query = "SELECT * FROM dwh.fact_order_delivery ORDER BY order_id;"
+    item_query = "SELECT * FROM dwh.fact_order_item ORDER BY order_id, order_item_id;"
+    ignored_cols = ['order_delivery_key', 'dw_load_timestamp']
+    ignored_item_cols = ['order_item_key', 'dw_load_timestamp']
+
+    transform_and_load_fact(db_engine, transform_engine='pandas')
+    with db_engine.connect() as connection:
+        df_pandas = pd.read_sql(fact_query, connection).drop(columns=ignored_cols)
+        df_pandas_items = pd.read_sql(item_query, connection).drop(columns=ignored_item_cols)
+
+    transform_and_load_fact(db_engine, transform_engine='sql')
+    with db_engine.connect() as connection:
+        df_sql = pd.read_sql(fact_query, connection).drop(columns=ignored_cols)
+        df_sql_items = pd.read_sql(item_query, connection).drop(columns=ignored_item_cols)
+
+    assert len(df_sql) == len(df_pandas) > 0
+    pd.testing.assert_frame_equal(df_sql, df_pandas, check_dtype=False, check_exact=False, atol=0.011)
+    pd.testing.assert_frame_equal(df_sql_items, df_pandas_items, check_dtype=False)
+
+
+def test_fact_month_reload_only_touches_its_partition(setup_test_database, db_engine, sample_data_dir, sample_csv_files_map):
+    """month='YYYY-MM' chỉ TRUNCATE và load lại partition của tháng đó."""
+    extract_load_to_staging(sample_csv_files_map, sample_data_dir, db_engine)
+    transform_and_load_dimensions(db_engine)
+    transform_and_load_fact(db_engine)
+
+    partition_counts_query = text("""
+        SELECT tableoid::regclass::text AS partition, COUNT(*) AS row_count, MAX(dw_load_timestamp) AS loaded_at
+        FROM dwh.fact_order_delivery GROUP BY 1 ORDER BY 1;
+    """)
+    with db_engine.connect() as connection:
+        before = pd.read_sql(partition_counts_query, connection).set_index('partition')
+    month_partition = before.index[0]
+
+    transform_and_load_fact(db_engine, month=f"{month_partition[-6:-2]}-{month_partition[-2:]}")
+    with db_engine.connect() as connection:
+        after = pd.read_sql(partition_counts_query, connection).set_index('partition')
+
+    pd.testing.assert_series_equal(after['row_count'], before['row_count'])
+    assert after.loc[month_partition, 'loaded_at'] > before.loc[month_partition, 'loaded_at']
+    others = before.index.drop(month_partition)
+    pd.testing.assert_series_equal(after.loc[others, 'loaded_at'], before.loc[others, 'loaded_at'])
+
+
+def test_bulk_load_restores_indexes_and_foreign_keys(setup_test_database, db_engine, sample_data_dir, sample_csv_files_map):
+    """bulk_load=True drop index/FK trước khi load và phải tạo lại đúng như cũ (FK đã validate)."""
+    extract_load_to_staging(sample_csv_files_map, sample_data_dir, db_engine)
+    catalog_query = text("""
+        SELECT 'index' AS kind, indexname AS name, indexdef AS definition
+        FROM pg_indexes WHERE schemaname = 'dwh'
+          AND tablename IN ('dim_customer', 'dim_seller', 'dim_product', 'fact_order_delivery', 'fact_order_item')
+        UNION ALL
+        SELECT 'fk', conname, pg_get_constraintdef(oid) || CASE WHEN convalidated THEN '' ELSE ' NOT VALID' END
+        FROM pg_constraint WHERE contype = 'f'
+          AND conrelid IN ('dwh.fact_order_delivery'::regclass, 'dwh.fact_order_item'::regclass)
+        ORDER BY 1, 2;
+    """)
+    with db_engine.connect() as connection:
+        before = pd.read_sql(catalog_query, connection)
+
+    transform_and_load_dimensions(db_engine, full_reload=True, bulk_load=True)
+    transform_and_load_fact(db_engine, bulk_load=True)
+
+    with db_engine.connect() as connection:
+        after = pd.read_sql(catalog_query, connection)
+        fact_count = connection.execute(text("SELECT COUNT(*) FROM dwh.fact_order_delivery;")).scalar()
+    assert fact_count > 0
+    pd.testing.assert_frame_equal(after, before)
+
+
+def test_unchanged_sources_skip_all_stages(setup_test_database, db_engine, sample_data_dir, sample_csv_files_map, tmp_path):
+    """Chạy lại với skip_unchanged=True khi file nguồn không đổi thì bỏ qua cả staging, Dimensions và Fact."""
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    for csv_file in sample_csv_files_map:
+        (data_dir / csv_file).write_bytes((sample_data_dir / csv_file).read_bytes())
+
+    extract_load_to_staging(sample_csv_files_map, data_dir, db_engine, skip_unchanged=True)
+    transform_and_load_dimensions(db_engine, skip_unchanged=True)
+    transform_and_load_fact(db_engine, skip_unchanged=True)
+    state_query = text("SELECT stage_name, input_fingerprint, completed_at FROM dwh.etl_stage_state ORDER BY 1;")
+    with db_engine.connect() as connection:
+        state_before = pd.read_sql(state_query, connection)
+    assert list(state_before['stage_name']) == ['dim_customer', 'dim_product', 'dim_seller', 'fact']
+    assert state_before['input_fingerprint'].notna().all()
+
+    # Ghi lại cùng nội dung (mtime đổi): vẫn bỏ qua sau khi so sánh hash
+    orders_file = next(f for f, t in sample_csv_files_map.items() if t == 'staging.stg_orders')
+    os.utime(data_dir / orders_file)
+    stats = extract_load_to_staging(sample_csv_files_map, data_dir, db_engine, skip_unchanged=True)
+    assert all(s['skipped'] for s in stats.values())
+    transform_and_load_dimensions(db_engine, skip_unchanged=True)
+    transform_and_load_fact(db_engine, skip_unchanged=True)
+    with db_engine.connect() as connection:
+        pd.testing.assert_frame_equal(pd.read_sql(state_query, connection), state_before)
+
+    # Sellers thay đổi: load lại đúng bảng đó, build lại dim_seller và Fact
+    sellers_file = next(f for f, t in sample_csv_files_map.items() if t == 'staging.stg_sellers')
+    with open(data_dir / sellers_file, 'a', encoding='utf-8') as f:
+        f.write('ffffffffffffffffffffffffffffffff,01001,sao paulo,SP\n')
+    stats = extract_load_to_staging(sample_csv_files_map, data_dir, db_engine, skip_unchanged=True)
+    assert [t for t, s in stats.items() if not s['skipped']] == ['staging.stg_sellers']
+    transform_and_load_dimensions(db_engine, skip_unchanged=True)
+    transform_and_load_fact(db_engine, skip_unchanged=True)
+    with db_engine.connect() as connection:
+        state_after = pd.read_sql(state_query, connection)
+    rebuilt = state_after['completed_at'] > state_before['completed_at']
+    assert list(state_after.loc[rebuilt, 'stage_name']) == ['dim_seller', 'fact']
+
+
+@pytest.mark.parametrize('transform_engine', ['pandas', 'sql'])
+def test_late_arriving_customer_gets_inferred_member(setup_test_database, db_engine, sample_data_dir, sample_csv_files_map,
+                                                     transform_engine):
+    """Customer chưa có trong staging: Fact nhận key của bản ghi inferred (không phải -1, không lỗi FK);
+    khi customer xuất hiện, merge SCD2 ghi đè bản ghi inferred và giữ nguyên key."""
+    extract_load_to_staging(sample_csv_files_map, sample_data_dir, db_engine)
+    with db_engine.begin() as connection:
+        customer_id = connection.execute(text("SELECT customer_id FROM staging.stg_orders LIMIT 1;")).scalar()
+        late_customer = pd.read_sql(text("SELECT * FROM staging.stg_customers WHERE customer_id = :c;"),
+                                    connection, params={'c': customer_id})
+        connection.execute(text("DELETE FROM staging.stg_customers WHERE customer_id = :c;"), {'c': customer_id})
+    transform_and_load_dimensions(db_engine, full_reload=True)
+    transform_and_load_fact(db_engine, transform_engine=transform_engine)
+
+    customer_query = text("""
+        SELECT d.customer_key, d.customer_city, d.is_inferred, f.customer_key AS fact_customer_key
+        FROM dwh.dim_customer d
+        JOIN staging.stg_orders o ON o.customer_id = d.customer_id
+        JOIN dwh.fact_order_delivery f ON f.order_id = o.order_id
+        WHERE d.customer_id = :c AND d.is_current;
+    """)
+    with db_engine.connect() as connection:
+        inferred = connection.execute(customer_query, {'c': customer_id}).one()
+        unknown = connection.execute(text("SELECT customer_id FROM dwh.dim_customer WHERE customer_key = -1;")).scalar()
+    assert inferred.is_inferred and inferred.customer_city == 'Unknown'
+    assert inferred.fact_customer_key == inferred.customer_key != -1
+    assert unknown == 'Unknown'
+
+    with db_engine.begin() as connection:
+        late_customer.to_sql('stg_customers', connection, schema='staging', if_exists='append', index=False)
+    transform_and_load_dimensions(db_engine)
+    with db_engine.connect() as connection:
+        resolved = connection.execute(customer_query, {'c': customer_id}).one()
+        versions = connection.execute(text("SELECT COUNT(*) FROM dwh.dim_customer WHERE customer_id = :c;"), {'c': customer_id}).scalar()
+    assert not resolved.is_inferred and resolved.customer_city != 'Unknown'
+    assert resolved.customer_key == resolved.fact_customer_key == inferred.customer_key
+    assert versions == 1
+
+
+@pytest.mark.parametrize('transform_engine', ['pandas', 'sql'])
+def test_incremental_load_moves_order_with_corrected_purchase_date(setup_test_database, db_engine, sample_data_dir,
+                                                                   sample_csv_files_map, transform_engine):
+    """Ngày mua của order được sửa trong nguồn (sang tháng khác): load incremental thay dòng cũ, không thêm dòng thứ hai."""
+    extract_load_to_staging(sample_csv_files_map, sample_data_dir, db_engine)
+    transform_and_load_dimensions(db_engine)
+    transform_and_load_fact(db_engine, transform_engine=transform_engine)
+
+    fact_query = text("SELECT purchase_date_key FROM dwh.fact_order_delivery WHERE order_id = :o;")
+    with db_engine.begin() as connection:
+        order_id = connection.execute(text(
+            "SELECT order_id FROM dwh.fact_order_delivery WHERE purchase_date_key IS NOT NULL ORDER BY order_id LIMIT 1;"
+        )).scalar()
+        old_key = connection.execute(fact_query, {'o': order_id}).scalar()
+        connection.execute(text("""
+            UPDATE staging.stg_orders
+            SET order_purchase_timestamp = (dwh.try_cast_timestamp(order_purchase_timestamp) + INTERVAL '40 days')::TEXT
+            WHERE order_id = :o;
+        """), {'o': order_id})
+
+    transform_and_load_fact(db_engine, mode='incremental', transform_engine=transform_engine)
+    with db_engine.connect() as connection:
+        keys = connection.execute(fact_query, {'o': order_id}).scalars().all()
+        item_keys = set(connection.execute(text(
+            "SELECT purchase_date_key FROM dwh.fact_order_item WHERE order_id = :o;"
+        ), {'o': order_id}).scalars())
+        duplicates = connection.execute(text(
+            "SELECT COUNT(*) FROM (SELECT order_id FROM dwh.fact_order_delivery GROUP BY order_id HAVING COUNT(*) > 1) d;"
+        )).scalar()
+    assert len(keys) == 1 and keys[0] != old_key
+    assert item_keys == {keys[0]}
+    assert duplicates == 0
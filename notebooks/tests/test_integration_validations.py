@@ -0,0 +1,69 @@
+
+from sqlalchemy import text
+
+from etl.main_etl import (FACT_COLUMNS, extract_load_to_staging, transform_and_load_dimensions,
+                          transform_and_load_fact)
+from run_validations import ValidationScope, run_validation, run_validations, validation_checks
+
+# Sử dụng fixture db_engine từ conftest.py; dwh.dim_date được populate bởi DDL 06
+
+
+def test_failed_detail_query_does_not_abort_fused_group(db_engine):
+    """
+    Check gộp đầu tiên lỗi khi đọc dòng chi tiết (cột không tồn tại chỉ có trong SELECT, không có trong predicate):
+    check đó là ERROR, check sau trong cùng nhóm (cùng transaction) vẫn đọc được chi tiết nhờ savepoint.
+    """
+    checks = {
+        "broken_details": {
+            "description": "Chi tiết tham chiếu cột không tồn tại",
+            "query": "SELECT no_such_column FROM dwh.dim_date WHERE date_key = 20180101;",
+            "type": "expect_empty_dataframe"
+        },
+        "found_rows": {
+            "description": "Có dòng -> FAIL kèm chi tiết",
+            "query": "SELECT date_key, full_date FROM dwh.dim_date WHERE date_key = 20180102;",
+            "type": "expect_empty_dataframe"
+        },
+        "found_count": {
+            "description": "Đếm khác 0 -> FAIL kèm dòng chi tiết",
+            "query": "SELECT COUNT(*) FROM dwh.dim_date WHERE date_key = 20180103;",
+            "type": "expect_zero"
+        },
+    }
+    results = {result['name']: result for result in run_validations(checks, db_engine, max_workers=1)}
+
+    assert results['broken_details']['status'] == 'ERROR'
+    assert results['found_rows']['status'] == 'FAIL'
+    assert list(results['found_rows']['details']['date_key']) == [20180102]
+    assert results['found_count']['status'] == 'FAIL'
+    assert list(results['found_count']['details']['date_key']) == [20180103]
+
+
+def test_order_in_two_partitions_fails_even_when_scoped(setup_test_database, db_engine, sample_data_dir,
+                                                        sample_csv_files_map):
+    """
+    uidx_fod_order_id gồm purchase_date_key nên DB cho phép một order ở hai tháng. fact_order_in_one_partition
+    phát hiện được, kể cả khi --since chỉ bao tháng của dòng mới (dòng cũ nằm ngoài phạm vi).
+    """
+    extract_load_to_staging(sample_csv_files_map, sample_data_dir, db_engine)
+    transform_and_load_dimensions(db_engine, full_reload=True)
+    transform_and_load_fact(db_engine, mode='full')
+
+    columns = [col for col in FACT_COLUMNS if col not in ('purchase_date_key', 'dw_load_timestamp')]
+    with db_engine.begin() as connection:
+        since = connection.execute(text("SELECT LOCALTIMESTAMP;")).scalar()
+        connection.execute(text(f"""
+            INSERT INTO dwh.fact_order_delivery (purchase_date_key, {', '.join(columns)})
+            SELECT (SELECT MIN(date_key) FROM dwh.dim_date), {', '.join(columns)}
+            FROM dwh.fact_order_delivery
+            ORDER BY order_id LIMIT 1;
+        """))
+
+    scope = ValidationScope.since(db_engine, since)
+    check = validation_checks['fact_order_in_one_partition']
+    result = run_validation('fact_order_in_one_partition', check, db_engine, scope=scope)
+    assert result['status'] == 'FAIL'
+    assert len(result['details']) == 1 and result['details']['purchase_date_keys'].iloc[0] == 2
+    # Check trùng lặp thường bị giới hạn trong phạm vi nên không thấy dòng cũ
+    assert run_validation('duplicate_fact_orders', validation_checks['duplicate_fact_orders'],
+                          db_engine, scope=scope)['status'] == 'PASS'
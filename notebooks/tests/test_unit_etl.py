@@ -1,9 +1,12 @@
 # tests/test_unit_etl.py
+import os
 import pandas as pd
 import numpy as np
 import pytest
 from datetime import datetime, timedelta
 
+from etl.main_etl import GeoLookup, build_dim_product, haversine_km, source_fingerprint
+
 
 # --- Fixtures (Dữ liệu mẫu) ---
 @pytest.fixture
@@ -15,6 +18,18 @@ def sample_geo_df():
     }
     return pd.DataFrame(data)
 
+@pytest.fixture
+def sample_geo_points_df():
+    # 12345: ba điểm gần nhau + một điểm lệch xa (> 1 độ) và một điểm ngoài Brazil
+    data = {
+        'geolocation_zip_code_prefix': ['12345', '12345', '12345', '12345', '12345', '54321'],
+        'geolocation_lat': ['-23.0', '-23.2', '-23.1', '-15.0', '40.7', '-22.9'],
+        'geolocation_lng': ['-46.0', '-46.2', '-46.1', '-47.0', '-74.0', 'abc'],
+        'geolocation_city': ['sao paulo'] * 5 + ['rio de janeiro'],
+        'geolocation_state': ['SP'] * 5 + ['RJ'],
+    }
+    return pd.DataFrame(data)
+
 @pytest.fixture
 def sample_orders_df():
     data = {
@@ -59,6 +74,92 @@ def test_geo_mapping_creation(sample_geo_df):
     assert geo_map.loc['12345', 'geolocation_city'] == 'são paulo' # Giữ lại dòng đầu tiên
     assert geo_map.loc['54321', 'geolocation_state'] == 'RJ'
 
+def test_geo_lookup_matches_geo_mapping(sample_geo_df, tmp_path):
+    """GeoLookup cho cùng kết quả với geo_map (chuẩn hóa + giữ bản ghi đầu tiên), kể cả sau khi đọc từ cache."""
+    geo_lookup = GeoLookup.from_frame(sample_geo_df)
+    zip_prefixes = pd.Series(['12345', '99999', '00000', None, 'abcde', '54321'])
+    expected = pd.DataFrame({
+        'city': ['são paulo', 'belo horizonte', np.nan, np.nan, np.nan, 'rio de janeiro'],
+        'state': ['SP', 'MG', np.nan, np.nan, np.nan, 'RJ'],
+    })
+    expected['lat'] = np.nan
+    expected['lng'] = np.nan
+
+    assert len(geo_lookup) == 3
+    pd.testing.assert_frame_equal(geo_lookup.lookup(zip_prefixes), expected)
+
+    geo_lookup.save(tmp_path / 'geo_lookup.npz')
+    cached = GeoLookup.load(tmp_path / 'geo_lookup.npz')
+    pd.testing.assert_frame_equal(cached.lookup(zip_prefixes), expected)
+
+
+def test_geo_lookup_centroids_reject_outliers(sample_geo_points_df):
+    """Centroid = trung bình các điểm của prefix, bỏ điểm ngoài Brazil và điểm xa median."""
+    geo = GeoLookup.from_frame(sample_geo_points_df).lookup(pd.Series(['12345', '54321']))
+
+    assert geo.loc[0, 'lat'] == pytest.approx(-23.1)
+    assert geo.loc[0, 'lng'] == pytest.approx(-46.1)
+    assert pd.isna(geo.loc[1, 'lat'])  # lng không hợp lệ -> không có centroid
+    assert geo.loc[1, 'city'] == 'rio de janeiro'
+
+
+def test_haversine_km_vectorized():
+    distances = haversine_km(
+        np.array([-23.5505, -22.9068, np.nan]), np.array([-46.6333, -43.1729, -43.0]),
+        -22.9068, -43.1729  # broadcast một điểm (Rio de Janeiro)
+    )
+    assert distances[0] == pytest.approx(360.7, abs=0.5)
+    assert distances[1] == 0
+    assert np.isnan(distances[2])
+
+
+def test_build_dim_product_translates_categories():
+    """Category được dịch sang tiếng Anh; thiếu bản dịch giữ tên gốc, thiếu category -> 'Unknown'."""
+    df_products = pd.DataFrame({
+        'product_id': ['p1', 'p2', 'p3', 'p1'],
+        'product_category_name': ['beleza_saude', 'pc_gamer', None, 'perfumaria'],
+        'product_name_lenght': ['40', '44', None, '41'],
+        'product_description_lenght': ['287', 'abc', None, '287'],
+        'product_photos_qty': ['1', '2', None, '1'],
+        'product_weight_g': ['225', '1000', None, '225'],
+        'product_length_cm': ['16', '30', None, '16'],
+        'product_height_cm': ['10', '18', None, '10'],
+        'product_width_cm': ['14', '20', None, '14'],
+    })
+    df_translation = pd.DataFrame({
+        'product_category_name': ['beleza_saude', 'perfumaria'],
+        'product_category_name_english': ['health_beauty', 'perfumery'],
+    })
+
+    df_dim = build_dim_product(df_products, df_translation).set_index('product_id')
+
+    assert list(df_dim.index) == ['p2', 'p3', 'p1']  # p1 trùng lặp -> giữ bản ghi cuối
+    assert df_dim.loc['p1', 'product_category_name_english'] == 'perfumery'
+    assert df_dim.loc['p1', 'product_name_length'] == 41
+    assert df_dim.loc['p2', 'product_category_name_english'] == 'pc_gamer'
+    assert pd.isna(df_dim.loc['p2', 'product_description_length'])
+    assert df_dim.loc['p3', 'product_category_name'] == 'Unknown'
+    assert df_dim.loc['p3', 'product_category_name_english'] == 'Unknown'
+    assert df_dim['product_weight_g'].dtype == 'Int64'
+
+def test_source_fingerprint_reuses_hash_when_size_and_mtime_match(tmp_path):
+    """Size + mtime khớp manifest -> dùng lại hash cũ; file ghi lại cùng nội dung -> hash giống."""
+    csv_path = tmp_path / 'orders.csv'
+    csv_path.write_text('order_id\n1\n')
+    first = source_fingerprint(csv_path)
+    assert len(first['content_hash']) == 64
+
+    assert source_fingerprint(csv_path, previous={**first, 'content_hash': 'cached'})['content_hash'] == 'cached'
+
+    os.utime(csv_path, ns=(first['file_mtime_ns'] + 10**9, first['file_mtime_ns'] + 10**9))
+    touched = source_fingerprint(csv_path, previous=first)
+    assert touched['file_mtime_ns'] != first['file_mtime_ns']
+    assert touched['content_hash'] == first['content_hash']
+
+    csv_path.write_text('order_id\n2\n')
+    assert source_fingerprint(csv_path, previous=first)['content_hash'] != first['content_hash']
+
+
 def test_calculate_time_diffs_days(sample_orders_df):
     """Kiểm tra tính toán số ngày (delivery_time_days, etc.)."""
     df = sample_orders_df.copy()
@@ -0,0 +1,213 @@
+# tests/test_unit_fact.py
+import pandas as pd
+import pytest
+
+from etl.main_etl import (
+    FACT_COLUMNS, FACT_ITEM_COLUMNS, DateKeyLookup, KeyDictionary, build_fact_frame, build_fact_item_frame,
+    build_key_dictionaries, fact_partition_bounds, fact_partition_name, month_start_of
+)
+
+
+@pytest.fixture
+def staging_orders_df():
+    return pd.DataFrame({
+        'order_id': ['o1', 'o2', 'o3'],
+        'customer_id': ['c1', 'c2', 'c_missing'],
+        'order_status': ['delivered', 'delivered', 'shipped'],
+        'order_purchase_timestamp': ['2018-01-01 10:00:00', '2018-01-05 12:00:00', '2018-01-10 08:00:00'],
+        'order_approved_at': ['2018-01-01 11:00:00', '2018-01-05 13:00:00', None],
+        'order_delivered_carrier_date': ['2018-01-02 14:00:00', '2018-01-04 15:00:00', None],
+        'order_delivered_customer_date': ['2018-01-04 16:00:00', '2018-01-12 18:00:00', None],
+        'order_estimated_delivery_date': ['2018-01-06 00:00:00', '2018-01-09 00:00:00', '2018-01-20 00:00:00'],
+        'source_row_hash': ['h1', 'h2', 'h3'],
+    })
+
+
+@pytest.fixture
+def staging_items_df():
+    return pd.DataFrame({
+        'order_id': ['o1', 'o1', 'o2', 'o3', 'o_without_order'],
+        'order_item_id': ['1', '2', '1', '1', '1'],
+        'product_id': ['p1', 'p2', 'p1', 'p_missing', 'p1'],
+        'seller_id': ['s1', 's2', 's2', 's_missing', 's1'],
+        'shipping_limit_date': ['2018-01-03 10:00:00', '2018-01-03 10:00:00', '2018-01-07 12:00:00', None, '2018-01-01 00:00:00'],
+        'price': ['10.50', '4.50', '100', 'abc', '1'],
+        'freight_value': ['1.25', '1.25', '10', '2', '1'],
+    })
+
+
+@pytest.fixture
+def dim_frames():
+    dates = pd.date_range('2017-12-01', '2018-02-28', freq='D')
+    df_dim_date = pd.DataFrame({'date_key': dates.strftime('%Y%m%d').astype(int), 'full_date': dates})
+    # c1: São Paulo, s1: Campinas, c2/s2: Rio de Janeiro; s2 không có centroid
+    df_dim_cust = pd.DataFrame({
+        'customer_key': [1, 2], 'customer_id': ['c1', 'c2'],
+        'customer_lat': [-23.5505, -22.9068], 'customer_lng': [-46.6333, -43.1729],
+    })
+    df_dim_seller = pd.DataFrame({
+        'seller_key': [10, 20], 'seller_id': ['s1', 's2'],
+        'seller_lat': [-22.9056, None], 'seller_lng': [-47.0608, None],
+    })
+    return df_dim_date, df_dim_cust, df_dim_seller
+
+
+@pytest.fixture
+def dim_product_df():
+    return pd.DataFrame({'product_key': [100, 200], 'product_id': ['p1', 'p2']})
+
+
+def test_build_fact_frame_measures_and_keys(staging_orders_df, staging_items_df, dim_frames):
+    df_fact = build_fact_frame(staging_orders_df, staging_items_df, *dim_frames).set_index('order_id')
+
+    assert list(df_fact.reset_index().columns) == FACT_COLUMNS
+    assert sorted(df_fact.index) == ['o1', 'o2', 'o3']  # inner join với items
+
+    o1 = df_fact.loc['o1']
+    assert o1['item_count'] == 2
+    assert o1['total_price'] == pytest.approx(15.0)
+    assert o1['total_freight_value'] == pytest.approx(2.5)
+    assert o1['seller_key'] == 10  # seller của item đầu tiên
+    assert o1['customer_key'] == 1
+    assert o1['purchase_date_key'] == 20180101
+    assert o1['delivered_customer_date_key'] == 20180104
+    assert o1['delivery_time_days'] == 3
+    assert o1['seller_processing_hours'] == pytest.approx(27.0)
+    assert pd.isna(o1['delivery_time_difference_days'])  # -2 -> NULL
+    assert not o1['is_late_delivery_flag']
+    assert o1['customer_seller_distance_km'] == pytest.approx(83.97)
+    assert o1['source_row_hash'] == 'h1'
+
+    o2 = df_fact.loc['o2']
+    assert pd.isna(o2['seller_processing_hours'])  # carrier trước approved -> NULL
+    assert o2['delivery_time_difference_days'] == 3
+    assert o2['is_late_delivery_flag']
+    assert pd.isna(o2['customer_seller_distance_km'])  # seller không có centroid
+
+
+def test_build_fact_frame_failed_lookups(staging_orders_df, staging_items_df, dim_frames):
+    df_fact = build_fact_frame(staging_orders_df, staging_items_df, *dim_frames).set_index('order_id')
+
+    o3 = df_fact.loc['o3']
+    assert o3['customer_key'] == -1
+    assert o3['seller_key'] == -1
+    assert o3['total_price'] == 0  # giá không hợp lệ -> 0
+    assert pd.isna(o3['approved_date_key'])
+    assert pd.isna(o3['delivery_time_days'])
+    assert not o3['is_late_delivery_flag']
+
+
+@pytest.mark.parametrize('key_lookup', ['dictionary', 'merge'])
+def test_build_fact_frame_first_seller_by_numeric_item_id(staging_orders_df, staging_items_df, dim_frames, key_lookup):
+    """Seller của order lấy theo order_item_id dạng số (2 < 10), không theo thứ tự dòng trong staging."""
+    staging_items_df['order_item_id'] = ['10', '2', '1', '1', '1']
+    df_fact = build_fact_frame(staging_orders_df, staging_items_df, *dim_frames, key_lookup=key_lookup)
+    assert df_fact.set_index('order_id').loc['o1', 'seller_key'] == 20
+
+
+def test_build_fact_item_frame_one_row_per_item(staging_orders_df, staging_items_df, dim_frames, dim_product_df):
+    df_item = build_fact_item_frame(staging_orders_df, staging_items_df, *dim_frames, dim_product_df)
+
+    assert list(df_item.columns) == FACT_ITEM_COLUMNS
+    # Một dòng mỗi item của các order có trong staging (item không có order bị bỏ)
+    assert list(zip(df_item['order_id'], df_item['order_item_id'])) == [('o1', 1), ('o1', 2), ('o2', 1), ('o3', 1)]
+    df_item = df_item.set_index(['order_id', 'order_item_id'])
+
+    o1_2 = df_item.loc[('o1', 2)]
+    assert o1_2['product_key'] == 200
+    assert o1_2['seller_key'] == 20  # seller của chính item này, không phải item đầu tiên
+    assert o1_2['customer_key'] == 1
+    assert o1_2['purchase_date_key'] == 20180101
+    assert o1_2['shipping_limit_date_key'] == 20180103
+    assert o1_2['price'] == pytest.approx(4.5)
+    assert o1_2['order_status'] == 'delivered'
+
+    o3_1 = df_item.loc[('o3', 1)]
+    assert (o3_1['product_key'], o3_1['seller_key'], o3_1['customer_key']) == (-1, -1, -1)
+    assert o3_1['price'] == 0  # giá không hợp lệ -> 0
+    assert pd.isna(o3_1['shipping_limit_date_key'])
+
+    # Tổng theo item khớp với Fact grain order
+    df_fact = build_fact_frame(staging_orders_df, staging_items_df, *dim_frames).set_index('order_id')
+    totals = df_item.groupby(level='order_id')[['price', 'freight_value']].sum()
+    assert totals['price'].tolist() == pytest.approx(df_fact.loc[totals.index, 'total_price'].tolist())
+    assert totals['freight_value'].tolist() == pytest.approx(df_fact.loc[totals.index, 'total_freight_value'].tolist())
+
+
+def test_date_key_lookup_computes_yyyymmdd_and_validates_range():
+    lookup = DateKeyLookup(pd.date_range('2016-01-01', '2019-12-31', freq='D'))
+    values = pd.Series(pd.to_datetime([
+        '2016-02-29 23:59:59', '2018-12-31 00:00:00', '2019-12-31 10:00:00', '2020-01-01 00:00:00', '2015-12-31 08:00:00', None
+    ]))
+
+    keys = lookup.lookup(values)
+
+    assert keys.dtype == 'Int64'
+    assert keys.tolist()[:3] == [20160229, 20181231, 20191231]
+    assert keys.isna().tolist() == [False, False, False, True, True, True]
+
+
+def test_date_lookup_array_matches_merge(staging_orders_df, staging_items_df, dim_frames):
+    df_array = build_fact_frame(staging_orders_df.copy(), staging_items_df.copy(), *dim_frames, date_lookup='array')
+    df_merge = build_fact_frame(staging_orders_df.copy(), staging_items_df.copy(), *dim_frames, date_lookup='merge')
+
+    pd.testing.assert_frame_equal(
+        df_array.drop(columns=['dw_load_timestamp']),
+        df_merge.drop(columns=['dw_load_timestamp'])
+    )
+
+
+
+def test_key_dictionary_encode_decode_and_lookup():
+    """Trùng lặp giữ lần đầu, NULL và giá trị lạ -> -1; lookup lấy thuộc tính của dòng sinh ra code."""
+    keys = KeyDictionary(pd.Series(['a', None, 'b', 'a'], index=[10, 11, 12, 13]))
+    assert len(keys) == 2
+    codes = keys.encode(pd.Series(['b', 'x', None, 'a']))
+    assert codes.tolist() == [1, -1, -1, 0]
+    assert keys.decode(codes).tolist() == ['b', None, None, 'a']
+    assert keys.lookup(codes, [1, 2, 3, 4]).tolist()[::3] == [3.0, 1.0]
+    assert pd.isna(keys.lookup(codes, [1, 2, 3, 4])[1:3]).all()
+    assert pd.isna(KeyDictionary([]).lookup(KeyDictionary([]).encode(['a']), [])).all()
+
+
+def test_key_lookup_dictionary_matches_merge(staging_orders_df, staging_items_df, dim_frames, dim_product_df):
+    """Join trên code KeyDictionary cho cùng kết quả như merge trên chuỗi, kể cả seller đầu tiên NULL."""
+    staging_items_df.loc[0, 'seller_id'] = None
+    key_dictionaries = build_key_dictionaries(*dim_frames[1:], dim_product_df)
+    for build, dims in [(build_fact_frame, dim_frames), (build_fact_item_frame, (*dim_frames, dim_product_df))]:
+        df_dictionary = build(staging_orders_df.copy(), staging_items_df.copy(), *dims, key_dictionaries=key_dictionaries)
+        df_merge = build(staging_orders_df.copy(), staging_items_df.copy(), *dims, key_lookup='merge')
+        pd.testing.assert_frame_equal(
+            df_dictionary.drop(columns=['dw_load_timestamp']),
+            df_merge.drop(columns=['dw_load_timestamp'])
+        )
+    df_fact = build_fact_frame(staging_orders_df.copy(), staging_items_df.copy(), *dim_frames).set_index('order_id')
+    assert df_fact.loc['o1', 'seller_key'] == 20
+    with pytest.raises(ValueError):
+        build_fact_item_frame(staging_orders_df, staging_items_df, *dim_frames, dim_product_df, key_lookup='hash')
+
+def test_build_fact_frame_typed_staging_matches_varchar(staging_orders_df, staging_items_df, dim_frames):
+    """Staging có kiểu (02b): timestamp/numeric đã parse sẵn cho cùng kết quả như staging VARCHAR."""
+    typed_orders = staging_orders_df.copy()
+    for col in typed_orders.columns:
+        if col.startswith('order_') and col not in ('order_id', 'order_status'):
+            typed_orders[col] = pd.to_datetime(typed_orders[col])
+    typed_items = staging_items_df.copy()
+    typed_items['price'] = pd.to_numeric(typed_items['price'], errors='coerce')
+    typed_items['freight_value'] = typed_items['freight_value'].astype(float)
+
+    df_typed = build_fact_frame(typed_orders, typed_items, *dim_frames)
+    df_varchar = build_fact_frame(staging_orders_df.copy(), staging_items_df.copy(), *dim_frames)
+
+    pd.testing.assert_frame_equal(
+        df_typed.drop(columns=['dw_load_timestamp']),
+        df_varchar.drop(columns=['dw_load_timestamp'])
+    )
+
+
+def test_fact_partition_bounds_cover_one_month_of_date_keys():
+    month_start = month_start_of('2017-12-15')
+    assert str(month_start) == '2017-12-01'
+    assert fact_partition_name(month_start) == 'dwh.fact_order_delivery_201712'
+    assert fact_partition_bounds(month_start) == (20171201, 20180101)
+    assert fact_partition_bounds(month_start_of('2018-02')) == (20180201, 20180301)
@@ -0,0 +1,96 @@
+# tests/test_unit_pipeline.py
+import threading
+import time
+
+import pytest
+
+from etl.pipeline import (Stage, build_stages, critical_path, load_resume_state, run_pipeline, stage_dependencies,
+                          write_state)
+
+
+def _diamond(calls, fail=None, parallel=True):
+    """staging -> (dim_a, dim_b) -> fact; parallel: dim_a và dim_b phải chạy cùng lúc mới qua được barrier."""
+    barrier = threading.Barrier(2, timeout=5)
+
+    def step(name, wait_for_sibling=False):
+        def func():
+            if wait_for_sibling and parallel:
+                barrier.wait()
+            if name == fail:
+                raise RuntimeError(f"{name} failed")
+            calls.append(name)
+        return func
+
+    return [
+        Stage('fact', step('fact'), inputs=['dwh.dim_a', 'dwh.dim_b', 'dwh.dim_date'], outputs=['dwh.fact']),
+        Stage('dim_a', step('dim_a', True), inputs=['staging.a'], outputs=['dwh.dim_a']),
+        Stage('dim_b', step('dim_b', True), inputs=['staging.b'], outputs=['dwh.dim_b']),
+        Stage('staging', step('staging'), outputs=['staging.a', 'staging.b']),
+    ]
+
+
+def test_stages_run_after_dependencies_and_in_parallel():
+    """Thứ tự khai báo không quan trọng; hai Dimension độc lập chạy song song; critical path đi qua stage chậm hơn."""
+    calls = []
+    stages = _diamond(calls)
+    assert stage_dependencies(stages) == {
+        'fact': {'dim_a', 'dim_b'}, 'dim_a': {'staging'}, 'dim_b': {'staging'}, 'staging': set(),
+    }
+    run_pipeline(stages, max_workers=2)
+
+    assert calls[0] == 'staging' and calls[-1] == 'fact' and set(calls[1:3]) == {'dim_a', 'dim_b'}
+    assert all(stage.status == 'done' for stage in stages)
+    by_name = {stage.name: stage for stage in stages}
+    assert by_name['fact'].started >= max(by_name['dim_a'].finished, by_name['dim_b'].finished)
+    path = [stage.name for stage in critical_path(stages)]
+    assert path[0] == 'staging' and path[1] in ('dim_a', 'dim_b') and path[2] == 'fact'
+
+
+def test_failed_stage_stops_dependents_and_resume_skips_completed(tmp_path):
+    """Stage lỗi: stage phụ thuộc không chạy, state file ghi lại; resume chỉ chạy stage lỗi và phía sau."""
+    calls = []
+    stages = _diamond(calls, fail='dim_b')
+    state_path = tmp_path / 'pipeline_state.json'
+    params = {'data_dir': 'data'}
+    with pytest.raises(RuntimeError, match='dim_b failed'):
+        run_pipeline(stages, max_workers=2, on_stage_done=lambda stage: write_state(state_path, 'run-1', params, stages))
+    assert {stage.name: stage.status for stage in stages} == {
+        'fact': 'pending', 'dim_a': 'done', 'dim_b': 'failed', 'staging': 'done',
+    }
+
+    completed = load_resume_state(state_path, params)
+    assert completed == {'staging', 'dim_a'}
+    with pytest.raises(ValueError):
+        load_resume_state(state_path, {'data_dir': 'other'})
+
+    calls.clear()
+    stages = _diamond(calls, parallel=False)
+    run_pipeline(stages, completed=completed, on_stage_done=lambda stage: write_state(state_path, 'run-2', params, stages))
+    assert calls == ['dim_b', 'fact']
+    assert load_resume_state(state_path, params) == set() # lần chạy đã hoàn thành -> chạy lại toàn bộ
+
+
+def test_cycles_and_duplicate_outputs_are_rejected():
+    with pytest.raises(ValueError, match='cycle'):
+        stage_dependencies([
+            Stage('a', time.sleep, inputs=['y'], outputs=['x']),
+            Stage('b', time.sleep, inputs=['x'], outputs=['y']),
+        ])
+    with pytest.raises(ValueError, match='produced by both'):
+        stage_dependencies([Stage('a', time.sleep, outputs=['x']), Stage('b', time.sleep, outputs=['x'])])
+
+
+@pytest.mark.parametrize('full_reload', [False, True])
+def test_full_reload_truncates_once_before_dimensions(tmp_path, full_reload):
+    """full_reload: một stage dimensions.truncate chạy trước mọi Dimension; các Dimension không tự TRUNCATE."""
+    stages = build_stages(None, tmp_path, full_reload=full_reload)
+    dependencies = stage_dependencies(stages)
+    dim_stages = [stage for stage in stages if stage.name.startswith('dimensions.dim_')]
+
+    assert ('dimensions.truncate' in dependencies) == full_reload
+    if full_reload:
+        assert 'dimensions.geo_lookup' in dependencies['dimensions.truncate']
+        assert 'staging.stg_customers' in dependencies['dimensions.truncate']
+    assert all(stage.func.keywords['truncate'] is False for stage in dim_stages)
+    for stage in dim_stages:
+        assert ('dimensions.truncate' in dependencies[stage.name]) == full_reload
@@ -0,0 +1,70 @@
+# tests/test_unit_run_metrics.py
+import json
+import time
+
+import numpy as np
+import pytest
+
+from etl.run_metrics import RSS_SAMPLE_INTERVAL, etl_run, instrumented, span
+
+
+@instrumented('work')
+def _work(n):
+    with span('work.inner', rows=n):
+        return sum(range(n))
+
+
+def test_spans_record_rows_and_parent(tmp_path):
+    """Span lồng nhau ghi lại tên span cha, rows và rows/sec; run record được ghi ra JSON."""
+    with etl_run(run_name='unit', record_dir=tmp_path) as run:
+        assert _work(1000) == sum(range(1000))
+
+    names = [s.name for s in run.spans]
+    assert names == ['work.inner', 'work', 'run.unit']
+    inner, work, root = run.spans
+    assert inner.parent == 'work' and work.parent == 'run.unit' and root.parent is None
+    assert inner.rows == 1000 and inner.rows_per_second > 0
+    assert work.rows is None and work.rows_per_second is None
+    assert all(s.status == 'ok' and s.wall_seconds >= 0 and s.peak_rss_mb > 0 for s in run.spans)
+    assert all(s.process_peak_rss_mb >= s.peak_rss_mb for s in run.spans)
+
+    [record_path] = tmp_path.glob('etl_run_*.json')
+    record = json.loads(record_path.read_text(encoding='utf-8'))
+    assert record['run_id'] == run.run_id
+    assert [s['span_name'] for s in record['spans']] == names
+    assert record['spans'][0]['row_count'] == 1000
+
+
+def test_failed_run_still_writes_record(tmp_path):
+    """Lỗi trong ETL vẫn được raise, span lỗi có status='error' và run record vẫn được ghi."""
+    with pytest.raises(ValueError):
+        with etl_run(run_name='failed', record_dir=tmp_path) as run:
+            with span('fact.load'):
+                raise ValueError('boom')
+
+    assert [(s.name, s.status) for s in run.spans] == [('fact.load', 'error'), ('run.failed', 'error')]
+    assert len(list(tmp_path.glob('etl_run_*.json'))) == 1
+
+    # Span ngoài run chỉ ghi log, không bị gắn vào run đã kết thúc
+    with span('outside'):
+        pass
+    assert len(run.spans) == 2
+
+
+def test_span_peak_rss_is_per_span(tmp_path):
+    """Peak RSS của span là peak trong thời gian span chạy: không mang theo peak của span trước."""
+    with etl_run(run_name='memory', record_dir=tmp_path) as run:
+        with span('big'):
+            block = np.ones(200 * 2**20 // 8)  # ~200 MB, được giải phóng trước khi span kết thúc
+            time.sleep(RSS_SAMPLE_INTERVAL * 10)
+            del block
+        with span('small'):
+            pass
+
+    big, small, root = run.spans
+    assert big.peak_rss_mb - small.peak_rss_mb > 150
+    assert root.peak_rss_mb >= big.peak_rss_mb
+    # Peak tích lũy của process (ru_maxrss) vẫn giữ peak của span 'big'
+    assert small.process_peak_rss_mb >= big.peak_rss_mb
+    record = json.loads(next(tmp_path.glob('etl_run_*.json')).read_text(encoding='utf-8'))
+    assert record['spans'][1]['process_peak_rss_mb'] >= record['spans'][1]['peak_rss_mb']
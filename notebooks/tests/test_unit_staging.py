@@ -0,0 +1,98 @@
+# tests/test_unit_staging.py
+import io
+import csv
+
+import pandas as pd
+import pytest
+
+from etl.main_etl import CsvCopyStream, land_csv_to_parquet, read_landed
+
+
+LOAD_TS = '2024-01-01 00:00:00'
+
+
+def _read_all(stream, size):
+    chunks = []
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def test_copy_stream_appends_load_timestamp():
+    """Mỗi record được nối thêm _load_timestamp, header được tách riêng."""
+    raw = b'"seller_id","seller_zip_code_prefix","seller_city","seller_state"\n' \
+          b'"s1","13023",campinas,SP\n' \
+          b's2,"13844",mogi guacu,SP\n'
+    stream = CsvCopyStream(io.BytesIO(raw), LOAD_TS)
+
+    assert stream.columns == ['seller_id', 'seller_zip_code_prefix', 'seller_city', 'seller_state']
+    rows = list(csv.reader(io.StringIO(_read_all(stream, 7).decode())))
+    assert rows == [
+        ['s1', '13023', 'campinas', 'SP', LOAD_TS],
+        ['s2', '13844', 'mogi guacu', 'SP', LOAD_TS],
+    ]
+    assert stream.rows == 2
+
+
+def test_copy_stream_handles_bom_crlf_and_blank_lines():
+    """File dịch category có BOM và CRLF."""
+    raw = b'\xef\xbb\xbfproduct_category_name,product_category_name_english\r\n' \
+          b'beleza_saude,health_beauty\r\n' \
+          b'\r\n'
+    stream = CsvCopyStream(io.BytesIO(raw), LOAD_TS)
+
+    assert stream.columns == ['product_category_name', 'product_category_name_english']
+    assert stream.read() == b'beleza_saude,health_beauty,' + LOAD_TS.encode() + b'\n'
+    assert stream.rows == 1
+
+
+@pytest.mark.parametrize('size', [-1, 1, 16])
+def test_copy_stream_keeps_multiline_quoted_field(size):
+    """Field có xuống dòng bên trong dấu nháy không bị chèn timestamp ở giữa."""
+    raw = b'id,comment\n1,"dong 1\ndong ""2"""\n2,ok\n'
+    stream = CsvCopyStream(io.BytesIO(raw), LOAD_TS)
+
+    rows = list(csv.reader(io.StringIO(_read_all(stream, size).decode())))
+    assert rows == [['1', 'dong 1\ndong "2"', LOAD_TS], ['2', 'ok', LOAD_TS]]
+    assert stream.rows == 2
+
+
+def test_land_csv_to_parquet_types_and_reuse(tmp_path):
+    """CSV được chuyển sang Parquet có kiểu một lần; nội dung không đổi thì dùng lại file cũ."""
+    csv_path = tmp_path / 'olist_order_items_dataset.csv'
+    csv_path.write_text(
+        'order_id,order_item_id,product_id,seller_id,shipping_limit_date,price,freight_value\n'
+        'o1,1,p1,s1,2017-09-19 09:45:35,58.90,13.29\n'
+        'o1,2,p2,s2,2017-09-19 09:45:35,abc,\n'
+    )
+
+    parquet_path = land_csv_to_parquet(csv_path)
+    assert parquet_path.parent == tmp_path / 'landing'
+    mtime = parquet_path.stat().st_mtime_ns
+    assert land_csv_to_parquet(csv_path) == parquet_path
+    assert parquet_path.stat().st_mtime_ns == mtime
+
+    df = read_landed(csv_path, columns=['order_item_id', 'shipping_limit_date', 'price'])
+    assert list(df.columns) == ['order_item_id', 'shipping_limit_date', 'price']
+    assert df['order_item_id'].tolist() == [1, 2]
+    assert df['shipping_limit_date'][0] == pd.Timestamp('2017-09-19 09:45:35')
+    assert df['price'][0] == pytest.approx(58.9)
+    assert pd.isna(df['price'][1])
+
+
+def test_land_csv_to_parquet_replaces_stale_version(tmp_path):
+    """Zip prefix giữ số 0 ở đầu; file thay đổi -> Parquet mới, bản cũ bị xóa."""
+    csv_path = tmp_path / 'olist_sellers_dataset.csv'
+    csv_path.write_text('seller_id,seller_zip_code_prefix,seller_city,seller_state\ns1,01023,sao paulo,SP\n')
+    old_path = land_csv_to_parquet(csv_path)
+    assert pd.read_parquet(old_path)['seller_zip_code_prefix'].tolist() == ['01023']
+
+    csv_path.write_text('seller_id,seller_zip_code_prefix,seller_city,seller_state\ns2,13844,mogi guacu,SP\n')
+    new_path = land_csv_to_parquet(csv_path)
+
+    assert new_path != old_path
+    assert not old_path.exists()
+    assert list((tmp_path / 'landing').iterdir()) == [new_path]
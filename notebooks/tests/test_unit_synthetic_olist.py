@@ -0,0 +1,57 @@
+# tests/test_unit_synthetic_olist.py
+import pandas as pd
+
+from benchmarks.synthetic_olist import OLIST_FILES, generate_olist
+from etl.main_etl import CSV_FILES
+
+
+def _read(out_dir, key):
+    return pd.read_csv(out_dir / OLIST_FILES[key], dtype=str, keep_default_na=False, na_values=[''])
+
+
+def test_generated_files_are_olist_shaped(tmp_path):
+    """Đủ 5 file ETL đọc, khóa nhất quán giữa các file, NULL đi theo order_status."""
+    rows = generate_olist(tmp_path, scale=0.02, seed=7, chunk_orders=700, geo_points_per_prefix=2)
+    assert set(CSV_FILES) == set(rows)
+
+    df_orders = _read(tmp_path, 'orders')
+    df_items = _read(tmp_path, 'order_items')
+    df_customers = _read(tmp_path, 'customers')
+    df_sellers = _read(tmp_path, 'sellers')
+    df_geo = _read(tmp_path, 'geolocation')
+    df_products = _read(tmp_path, 'products')
+    df_translation = _read(tmp_path, 'category_translation')
+    assert len(df_orders) == rows['olist_orders_dataset.csv'] == round(99_441 * 0.02)
+
+    assert df_orders['order_id'].is_unique and df_orders['order_id'].str.len().eq(32).all()
+    assert df_customers['customer_id'].is_unique
+    assert set(df_orders['customer_id']) == set(df_customers['customer_id'])
+    assert set(df_items['order_id']) <= set(df_orders['order_id'])
+    assert set(df_items['seller_id']) <= set(df_sellers['seller_id'])
+    assert set(df_items['product_id']) <= set(df_products['product_id'])
+    assert df_products['product_id'].is_unique
+    categories = set(df_products['product_category_name'].dropna())
+    assert len(categories - set(df_translation['product_category_name'])) <= 2
+    assert not df_items.duplicated(['order_id', 'order_item_id']).any()
+    zip_prefixes = set(df_geo['geolocation_zip_code_prefix'])
+    assert set(df_customers['customer_zip_code_prefix']) <= zip_prefixes
+    assert set(df_sellers['seller_zip_code_prefix']) <= zip_prefixes
+
+    delivered = df_orders['order_status'] == 'delivered'
+    assert df_orders.loc[~delivered & (df_orders['order_status'] != 'shipped'), 'order_delivered_carrier_date'].isna().all()
+    assert df_orders.loc[delivered, 'order_delivered_customer_date'].notna().mean() > 0.99
+    assert df_orders['order_purchase_timestamp'].notna().all()
+
+
+def test_generation_is_reproducible(tmp_path):
+    """Cùng (scale, seed) cho cùng dữ liệu dù chia chunk; lần gọi lại với cùng tham số bỏ qua việc sinh."""
+    params = dict(scale=0.01, seed=3, chunk_orders=400, geo_points_per_prefix=1)
+    generate_olist(tmp_path / 'a', **params)
+    generate_olist(tmp_path / 'b', **params)
+    for file_name in OLIST_FILES.values():
+        assert (tmp_path / 'a' / file_name).read_bytes() == (tmp_path / 'b' / file_name).read_bytes()
+
+    orders_path = tmp_path / 'a' / OLIST_FILES['orders']
+    mtime = orders_path.stat().st_mtime_ns
+    generate_olist(tmp_path / 'a', **params)
+    assert orders_path.stat().st_mtime_ns == mtime
@@ -0,0 +1,246 @@
+# tests/test_unit_validations.py
+import threading
+import time
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+import run_validations
+from run_validations import (
+    ValidationScope, _fused_check_result, fusable_check, plan_validations, run_validations as run_checks
+)
+
+
+# --- Fixtures (Dữ liệu mẫu) ---
+@pytest.fixture
+def sqlite_engine(tmp_path):
+    """Database SQLite (file, để mọi connection của pool thấy cùng dữ liệu) với một bảng orders nhỏ."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'validation.db'}")
+    pd.DataFrame({
+        'order_id': ['o1', 'o2', 'o3', 'o4'],
+        'order_status': ['delivered', 'delivered', 'canceled', 'shipped'],
+        'total_price': [10.0, None, 5.0, 0.0],
+    }).to_sql('orders', engine, index=False)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def simple_checks():
+    return {
+        "null_price": {
+            "description": "Giá NULL",
+            "query": "SELECT COUNT(*) FROM orders WHERE total_price IS NULL;",
+            "type": "expect_zero"
+        },
+        "zero_price": {
+            "description": "Giá bằng 0",
+            "query": "SELECT COUNT(*) FROM orders WHERE total_price = 0;",
+            "type": "expect_zero_or_warning"
+        },
+        "canceled_orders": {
+            "description": "Số order bị hủy",
+            "query": "SELECT COUNT(*) FROM orders WHERE order_status = 'canceled';",
+            "type": "report_count"
+        },
+        "unknown_status": {
+            "description": "Status lạ",
+            "query": "SELECT order_id FROM orders WHERE order_status = 'unknown';",
+            "type": "expect_empty_dataframe"
+        },
+        "status_counts": {
+            "description": "Số order theo status",
+            "query": "SELECT order_status, COUNT(*) AS n FROM orders GROUP BY order_status;",
+            "type": "report_dataframe"
+        },
+    }
+
+
+# --- Test Cases ---
+def test_module_imports_without_database():
+    """Import module không kết nối database (engine chỉ được tạo khi chạy như script)."""
+    assert not hasattr(run_validations, 'engine')
+    assert run_validations.validation_checks
+
+
+@pytest.mark.parametrize('fuse', [True, False])
+def test_run_validations_results_follow_check_order(sqlite_engine, simple_checks, fuse):
+    results = run_checks(simple_checks, sqlite_engine, max_workers=3, fuse=fuse)
+
+    assert [r['name'] for r in results] == list(simple_checks)
+    statuses = {r['name']: r['status'] for r in results}
+    assert statuses == {
+        'null_price': 'FAIL', 'zero_price': 'WARNING', 'canceled_orders': 'INFO',
+        'unknown_status': 'PASS', 'status_counts': 'INFO',
+    }
+    assert results[2]['details'] == 1
+
+
+def test_run_validations_bounds_concurrency_to_max_workers(sqlite_engine, monkeypatch):
+    """Không quá max_workers check chạy cùng lúc, mỗi check nhận một connection riêng của pool."""
+    active = []
+    max_active = []
+    connections = set()
+    lock = threading.Lock()
+
+    def fake_run_validation(check_name, check_config, db_engine, scope=None):
+        with lock:
+            active.append(check_name)
+            max_active.append(len(active))
+            connections.add(id(db_engine))
+        time.sleep(0.05)
+        with lock:
+            active.remove(check_name)
+        return {"name": check_name, "description": "", "status": "PASS", "message": "", "details": None, "duration": 0.05}
+
+    monkeypatch.setattr(run_validations, 'run_validation', fake_run_validation)
+    checks = {f"check_{i}": {"description": "", "query": "SELECT 1", "type": "report_count"} for i in range(6)}
+    results = run_checks(checks, sqlite_engine, max_workers=2, fuse=False)
+
+    assert [r['name'] for r in results] == list(checks)
+    assert max(max_active) == 2
+    assert len(connections) >= 2
+
+
+def test_plan_fuses_simple_fact_checks_only():
+    """Với bộ check hiện tại: 15 check đếm đơn giản trên dwh.fact_order_delivery được gộp, còn lại chạy riêng."""
+    fused_groups, single_checks = plan_validations(run_validations.validation_checks)
+
+    assert list(fused_groups) == ['dwh.fact_order_delivery']
+    fused_names = [name for name, _ in fused_groups['dwh.fact_order_delivery']]
+    assert len(fused_names) == 15
+    assert {'key_null_customer', 'key_unknown_seller', 'null_total_freight'} <= set(fused_names)
+    # JOIN, GROUP BY/HAVING, compare_* và report_dataframe không gộp được
+    assert {'key_orphan_customer', 'duplicate_fact_orders', 'count_fact_vs_staging_orders',
+            'agg_fact_vs_staging_items', 'rule_distinct_order_statuses'} <= set(single_checks)
+    assert sorted(fused_names + single_checks) == sorted(run_validations.validation_checks)
+
+
+@pytest.mark.parametrize('query, expected', [
+    ("SELECT COUNT(*) FROM dwh.t WHERE a IS NULL;", ('dwh.t', 'a IS NULL')),
+    ("SELECT COUNT(*) FROM dwh.t t JOIN dwh.u u ON t.k = u.k WHERE u.k IS NULL;", None),
+    ("SELECT COUNT(*) FROM dwh.t WHERE k IN (SELECT k FROM dwh.u);", None),
+    ("SELECT COUNT(*) FROM dwh.t WHERE a > 0 GROUP BY b;", None),
+    ("SELECT COUNT(DISTINCT a) FROM dwh.t WHERE a > 0;", None),
+    ("SELECT COUNT(*) FROM dwh.t;", None),
+])
+def test_fusable_check_patterns(query, expected):
+    assert fusable_check({"query": query, "type": "expect_zero"}) == expected
+
+
+def test_plan_runs_single_member_group_alone(simple_checks):
+    """Bảng chỉ có một check gộp được -> check đó chạy riêng, không tạo truy vấn gộp."""
+    checks = dict(simple_checks, other_table={
+        "description": "", "query": "SELECT COUNT(*) FROM sellers WHERE seller_id IS NULL;", "type": "expect_zero"
+    })
+    fused_groups, single_checks = plan_validations(checks)
+
+    assert list(fused_groups) == ['orders']
+    assert [name for name, _ in fused_groups['orders']] == ['null_price', 'zero_price', 'canceled_orders', 'unknown_status']
+    assert single_checks == ['status_counts', 'other_table']
+
+
+@pytest.mark.parametrize('check_type, count, status', [
+    ('expect_zero', 0, 'PASS'),
+    ('expect_zero', 2, 'FAIL'),
+    ('expect_zero_or_warning', 0, 'PASS'),
+    ('expect_zero_or_warning', 2, 'WARNING'),
+    ('report_count', 0, 'INFO'),
+    ('report_count', 2, 'INFO'),
+    ('expect_empty_dataframe', 0, 'PASS'),
+    ('expect_empty_dataframe', 1, 'FAIL'),
+])
+def test_fused_check_result_status_from_count(sqlite_engine, check_type, count, status):
+    check_config = {"description": "", "query": "SELECT order_id FROM orders WHERE total_price IS NULL;", "type": check_type}
+    result = _fused_check_result('check', check_config, count, 'orders', 'total_price IS NULL', sqlite_engine, 0.1)
+
+    assert result['status'] == status
+    if check_type == 'report_count':
+        assert result['details'] == count
+    elif count:
+        assert list(result['details']['order_id']) == ['o2']
+    else:
+        assert result['details'] is None
+
+
+def test_fused_check_result_falls_back_to_count_when_details_fail(sqlite_engine):
+    """Không đọc được dòng chi tiết (vd. predicate tham chiếu alias) -> details là số đếm, status vẫn theo count."""
+    check_config = {"description": "", "query": "", "type": "expect_zero"}
+    result = _fused_check_result('check', check_config, 3, 'orders', 'missing_column > 0', sqlite_engine, 0.1)
+
+    assert result['status'] == 'FAIL'
+    assert result['message'] == "Found 3 records, expected zero."
+    assert result['details'] == "Count: 3"
+
+
+@pytest.fixture
+def load_scope():
+    return ValidationScope({'dwh.fact_order_delivery': 'p = 1', 'staging.stg_orders': 's = 2'}, sample_percent=5)
+
+
+FACT_SCOPED = "(SELECT * FROM dwh.fact_order_delivery WHERE p = 1)"
+FACT_SAMPLED = "(SELECT * FROM dwh.fact_order_delivery TABLESAMPLE SYSTEM (5) REPEATABLE (42) WHERE p = 1)"
+ORDERS_SCOPED = "(SELECT * FROM staging.stg_orders WHERE s = 2)"
+
+
+@pytest.mark.parametrize('sql, expected', [
+    # Không alias -> alias là tên bảng
+    ("SELECT COUNT(*) FROM dwh.fact_order_delivery WHERE x IS NULL;",
+     f"SELECT COUNT(*) FROM {FACT_SCOPED} AS fact_order_delivery WHERE x IS NULL;"),
+    # Alias và AS alias được giữ nguyên
+    ("SELECT COUNT(fod.k) FROM dwh.fact_order_delivery fod LEFT JOIN dwh.dim_customer dc ON fod.c = dc.c",
+     f"SELECT COUNT(fod.k) FROM {FACT_SCOPED} AS fod LEFT JOIN dwh.dim_customer dc ON fod.c = dc.c"),
+    ("SELECT COUNT(*) FROM dwh.fact_order_delivery AS f WHERE f.x > 0",
+     f"SELECT COUNT(*) FROM {FACT_SCOPED} AS f WHERE f.x > 0"),
+    # Tham chiếu lồng trong IN (SELECT ...); bảng ngoài phạm vi không đổi
+    ("SELECT COUNT(*) FROM staging.stg_order_items i WHERE i.order_id IN (SELECT o.order_id FROM staging.stg_orders o)",
+     f"SELECT COUNT(*) FROM staging.stg_order_items i WHERE i.order_id IN (SELECT o.order_id FROM {ORDERS_SCOPED} AS o)"),
+    # Từ khóa ngay sau tên bảng không bị hiểu là alias
+    ("SELECT order_id FROM dwh.fact_order_delivery EXCEPT SELECT order_id FROM staging.stg_orders",
+     f"SELECT order_id FROM {FACT_SCOPED} AS fact_order_delivery EXCEPT SELECT order_id FROM {ORDERS_SCOPED} AS stg_orders"),
+    ("SELECT order_id FROM dwh.fact_order_delivery INTERSECT SELECT order_id FROM staging.stg_orders",
+     f"SELECT order_id FROM {FACT_SCOPED} AS fact_order_delivery INTERSECT SELECT order_id FROM {ORDERS_SCOPED} AS stg_orders"),
+    ("SELECT * FROM dwh.fact_order_delivery NATURAL JOIN dwh.x",
+     f"SELECT * FROM {FACT_SCOPED} AS fact_order_delivery NATURAL JOIN dwh.x"),
+    ("SELECT * FROM dwh.fact_order_delivery OFFSET 5", f"SELECT * FROM {FACT_SCOPED} AS fact_order_delivery OFFSET 5"),
+    ("SELECT * FROM dwh.fact_order_delivery FETCH FIRST 5 ROWS ONLY",
+     f"SELECT * FROM {FACT_SCOPED} AS fact_order_delivery FETCH FIRST 5 ROWS ONLY"),
+    ("SELECT SUM(x) OVER w FROM dwh.fact_order_delivery WINDOW w AS (ORDER BY x)",
+     f"SELECT SUM(x) OVER w FROM {FACT_SCOPED} AS fact_order_delivery WINDOW w AS (ORDER BY x)"),
+    # Tên bảng khác chỉ trùng tiền tố (partition) không bị viết lại
+    ("SELECT COUNT(*) FROM dwh.fact_order_delivery_201801", "SELECT COUNT(*) FROM dwh.fact_order_delivery_201801"),
+])
+def test_scope_apply_rewrites_table_references(load_scope, sql, expected):
+    assert load_scope.apply(sql) == expected
+
+
+def test_scope_apply_places_tablesample_inside_scoped_subquery(load_scope):
+    """TABLESAMPLE đứng ngay sau bảng Fact, trước điều kiện phạm vi; Staging không bị lấy mẫu."""
+    sql = ("SELECT SUM(i.price) FROM staging.stg_order_items i "
+           "WHERE i.order_id IN (SELECT order_id FROM dwh.fact_order_delivery) "
+           "AND i.order_id IN (SELECT order_id FROM staging.stg_orders)")
+    assert load_scope.apply(sql, sample=True) == (
+        "SELECT SUM(i.price) FROM staging.stg_order_items i "
+        f"WHERE i.order_id IN (SELECT order_id FROM {FACT_SAMPLED} AS fact_order_delivery) "
+        f"AND i.order_id IN (SELECT order_id FROM {ORDERS_SCOPED} AS stg_orders)"
+    )
+    sample_only = ValidationScope(sample_percent=5)
+    assert sample_only.apply("SELECT COUNT(*) FROM dwh.fact_order_delivery fod", sample=True) == (
+        "SELECT COUNT(*) FROM (SELECT * FROM dwh.fact_order_delivery TABLESAMPLE SYSTEM (5) REPEATABLE (42)) AS fod"
+    )
+    assert sample_only.apply("SELECT COUNT(*) FROM dwh.fact_order_delivery fod") == "SELECT COUNT(*) FROM dwh.fact_order_delivery fod"
+    assert sample_only.apply(None) is None
+
+
+def test_unscoped_check_ignores_scope(sqlite_engine, simple_checks):
+    """Check "scoped": False chạy trên toàn bộ bảng, không gộp, dù có ValidationScope."""
+    scope = ValidationScope({'main.orders': "order_status = 'delivered'"})
+    check_config = dict(simple_checks['zero_price'], query="SELECT COUNT(*) FROM main.orders WHERE total_price = 0;")
+    assert run_validations.run_validation('zero_price', check_config, sqlite_engine, scope=scope)['status'] == 'PASS'
+
+    check_config['scoped'] = False
+    assert fusable_check(check_config) is None
+    result = run_validations.run_validation('zero_price', check_config, sqlite_engine, scope=scope)
+    assert result['status'] == 'WARNING'
+    assert result['message'] == "Found 1 records, expected zero."
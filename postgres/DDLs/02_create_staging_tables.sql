@@ -3,6 +3,9 @@ DROP TABLE IF EXISTS staging.stg_order_items CASCADE;
 DROP TABLE IF EXISTS staging.stg_customers CASCADE;
 DROP TABLE IF EXISTS staging.stg_sellers CASCADE;
 DROP TABLE IF EXISTS staging.stg_geolocation CASCADE;
+DROP TABLE IF EXISTS staging.stg_products CASCADE;
+DROP TABLE IF EXISTS staging.stg_product_category_translation CASCADE;
+DROP TABLE IF EXISTS staging.etl_source_manifest CASCADE;
 
 CREATE TABLE staging.stg_orders (
     order_id VARCHAR(32),
@@ -53,9 +56,43 @@ CREATE TABLE staging.stg_geolocation (
     _load_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+CREATE TABLE staging.stg_products (
+    product_id VARCHAR(32),
+    product_category_name VARCHAR(100),
+    product_name_lenght VARCHAR(10), -- Column names keep the source spelling
+    product_description_lenght VARCHAR(10),
+    product_photos_qty VARCHAR(10),
+    product_weight_g VARCHAR(10),
+    product_length_cm VARCHAR(10),
+    product_height_cm VARCHAR(10),
+    product_width_cm VARCHAR(10),
+    _load_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE staging.stg_product_category_translation (
+    product_category_name VARCHAR(100),
+    product_category_name_english VARCHAR(100),
+    _load_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Fingerprint of the source file last loaded into each staging table, written by
+-- extract_load_to_staging in the same transaction as the load. Dropped together with
+-- the staging tables, so re-running this script forces a full reload.
+CREATE TABLE staging.etl_source_manifest (
+    table_name VARCHAR(100) PRIMARY KEY,
+    file_name VARCHAR(255) NOT NULL,
+    file_size BIGINT NOT NULL,
+    file_mtime_ns BIGINT NOT NULL,
+    content_hash CHAR(64) NOT NULL, -- sha256 of the file content
+    row_count BIGINT NOT NULL,
+    loaded_at TIMESTAMP NOT NULL
+);
+
 CREATE INDEX IF NOT EXISTS idx_stg_orders_order_id ON staging.stg_orders(order_id);
 CREATE INDEX IF NOT EXISTS idx_stg_order_items_order_id ON staging.stg_order_items(order_id);
 CREATE INDEX IF NOT EXISTS idx_stg_order_items_seller_id ON staging.stg_order_items(seller_id);
+CREATE INDEX IF NOT EXISTS idx_stg_order_items_product_id ON staging.stg_order_items(product_id);
 CREATE INDEX IF NOT EXISTS idx_stg_customers_customer_id ON staging.stg_customers(customer_id);
 CREATE INDEX IF NOT EXISTS idx_stg_sellers_seller_id ON staging.stg_sellers(seller_id);
-CREATE INDEX IF NOT EXISTS idx_stg_geolocation_zip_prefix ON staging.stg_geolocation(geolocation_zip_code_prefix);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_stg_geolocation_zip_prefix ON staging.stg_geolocation(geolocation_zip_code_prefix);
+CREATE INDEX IF NOT EXISTS idx_stg_products_product_id ON staging.stg_products(product_id);
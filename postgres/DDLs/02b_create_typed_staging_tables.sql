@@ -0,0 +1,112 @@
+-- Optional typed staging layer: run this file INSTEAD OF 02_create_staging_tables.sql.
+-- Load with extract_load_to_staging(..., method='typed'): values are parsed once at load time,
+-- rows with values that cannot be cast are written to staging.stg_rejects instead.
+DROP TABLE IF EXISTS staging.stg_orders CASCADE;
+DROP TABLE IF EXISTS staging.stg_order_items CASCADE;
+DROP TABLE IF EXISTS staging.stg_customers CASCADE;
+DROP TABLE IF EXISTS staging.stg_sellers CASCADE;
+DROP TABLE IF EXISTS staging.stg_geolocation CASCADE;
+DROP TABLE IF EXISTS staging.stg_products CASCADE;
+DROP TABLE IF EXISTS staging.stg_product_category_translation CASCADE;
+DROP TABLE IF EXISTS staging.stg_rejects CASCADE;
+DROP TABLE IF EXISTS staging.etl_source_manifest CASCADE;
+
+CREATE TABLE staging.stg_orders (
+    order_id VARCHAR(32),
+    customer_id VARCHAR(32),
+    order_status VARCHAR(20),
+    order_purchase_timestamp TIMESTAMP,
+    order_approved_at TIMESTAMP,
+    order_delivered_carrier_date TIMESTAMP,
+    order_delivered_customer_date TIMESTAMP,
+    order_estimated_delivery_date TIMESTAMP,
+    _load_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE staging.stg_order_items (
+    order_id VARCHAR(32),
+    order_item_id INTEGER,
+    product_id VARCHAR(32),
+    seller_id VARCHAR(32),
+    shipping_limit_date TIMESTAMP,
+    price NUMERIC(10, 2),
+    freight_value NUMERIC(10, 2),
+    _load_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE staging.stg_customers (
+    customer_id VARCHAR(32),
+    customer_unique_id VARCHAR(32),
+    customer_zip_code_prefix VARCHAR(5), -- Keep as text: leading zeros are significant
+    customer_city VARCHAR(100),
+    customer_state VARCHAR(2),
+    _load_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE staging.stg_sellers (
+    seller_id VARCHAR(32),
+    seller_zip_code_prefix VARCHAR(5),
+    seller_city VARCHAR(100),
+    seller_state VARCHAR(2),
+    _load_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE staging.stg_geolocation (
+    geolocation_zip_code_prefix VARCHAR(5),
+    geolocation_lat DOUBLE PRECISION,
+    geolocation_lng DOUBLE PRECISION,
+    geolocation_city VARCHAR(100),
+    geolocation_state VARCHAR(2),
+    _load_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE staging.stg_products (
+    product_id VARCHAR(32),
+    product_category_name VARCHAR(100),
+    product_name_lenght INTEGER, -- Column names keep the source spelling
+    product_description_lenght INTEGER,
+    product_photos_qty INTEGER,
+    product_weight_g INTEGER,
+    product_length_cm INTEGER,
+    product_height_cm INTEGER,
+    product_width_cm INTEGER,
+    _load_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE staging.stg_product_category_translation (
+    product_category_name VARCHAR(100),
+    product_category_name_english VARCHAR(100),
+    _load_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Rows rejected by the typed load (raw values kept as JSON)
+CREATE TABLE staging.stg_rejects (
+    reject_id BIGSERIAL PRIMARY KEY,
+    table_name VARCHAR(100) NOT NULL,
+    raw_record JSONB NOT NULL,
+    reject_reason TEXT NOT NULL,
+    _load_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Fingerprint of the source file last loaded into each staging table, written by
+-- extract_load_to_staging in the same transaction as the load. Dropped together with
+-- the staging tables, so re-running this script forces a full reload.
+CREATE TABLE staging.etl_source_manifest (
+    table_name VARCHAR(100) PRIMARY KEY,
+    file_name VARCHAR(255) NOT NULL,
+    file_size BIGINT NOT NULL,
+    file_mtime_ns BIGINT NOT NULL,
+    content_hash CHAR(64) NOT NULL, -- sha256 of the file content
+    row_count BIGINT NOT NULL,
+    loaded_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_stg_orders_order_id ON staging.stg_orders(order_id);
+CREATE INDEX IF NOT EXISTS idx_stg_order_items_order_id ON staging.stg_order_items(order_id);
+CREATE INDEX IF NOT EXISTS idx_stg_order_items_seller_id ON staging.stg_order_items(seller_id);
+CREATE INDEX IF NOT EXISTS idx_stg_order_items_product_id ON staging.stg_order_items(product_id);
+CREATE INDEX IF NOT EXISTS idx_stg_customers_customer_id ON staging.stg_customers(customer_id);
+CREATE INDEX IF NOT EXISTS idx_stg_sellers_seller_id ON staging.stg_sellers(seller_id);
+CREATE INDEX IF NOT EXISTS idx_stg_geolocation_zip_prefix ON staging.stg_geolocation(geolocation_zip_code_prefix);
+CREATE INDEX IF NOT EXISTS idx_stg_products_product_id ON staging.stg_products(product_id);
+CREATE INDEX IF NOT EXISTS idx_stg_rejects_table_name ON staging.stg_rejects(table_name);
@@ -1,6 +1,10 @@
 DROP TABLE IF EXISTS dwh.dim_customer CASCADE;
 DROP TABLE IF EXISTS dwh.dim_seller CASCADE;
+DROP TABLE IF EXISTS dwh.dim_product CASCADE;
+DROP TABLE IF EXISTS dwh.etl_stage_state CASCADE;
 
+-- Each dimension also holds an 'Unknown' member with surrogate key -1 (natural key 'Unknown'),
+-- seeded by the ETL (seed_unknown_members) on every load, including after TRUNCATE.
 -- Create customer dimension
 CREATE TABLE dwh.dim_customer (
     customer_key SERIAL PRIMARY KEY, -- Surrogate Key
@@ -9,11 +13,14 @@ CREATE TABLE dwh.dim_customer (
     customer_zip_code_prefix VARCHAR(5) NOT NULL,
     customer_city VARCHAR(100) NOT NULL, -- Standardized in ETL
     customer_state VARCHAR(2) NOT NULL, -- Standardized in ETL
+    customer_lat DOUBLE PRECISION NULL, -- Centroid of the zip code prefix (GeoLookup)
+    customer_lng DOUBLE PRECISION NULL,
     customer_state_name VARCHAR(50) NULL, -- Optional: Populated in ETL
     customer_region VARCHAR(50) NULL, -- Optional: Populated in ETL
     effective_start_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, -- For SCD Type 2
     effective_end_date TIMESTAMP NULL, -- For SCD Type 2
-    is_current BOOLEAN NOT NULL DEFAULT TRUE -- For SCD Type 2
+    is_current BOOLEAN NOT NULL DEFAULT TRUE, -- For SCD Type 2
+    is_inferred BOOLEAN NOT NULL DEFAULT FALSE -- Stub created by the fact load for a natural key not yet in staging
 );
 
 -- Indexes for DimCustomer
@@ -32,11 +39,14 @@ CREATE TABLE dwh.dim_seller (
     seller_zip_code_prefix VARCHAR(5) NOT NULL,
     seller_city VARCHAR(100) NOT NULL, -- Standardized in ETL
     seller_state VARCHAR(2) NOT NULL, -- Standardized in ETL
+    seller_lat DOUBLE PRECISION NULL, -- Centroid of the zip code prefix (GeoLookup)
+    seller_lng DOUBLE PRECISION NULL,
     seller_state_name VARCHAR(50) NULL, -- Optional: Populated in ETL
     seller_region VARCHAR(50) NULL, -- Optional: Populated in ETL
     effective_start_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, -- For SCD Type 2
     effective_end_date TIMESTAMP NULL, -- For SCD Type 2
-    is_current BOOLEAN NOT NULL DEFAULT TRUE -- For SCD Type 2
+    is_current BOOLEAN NOT NULL DEFAULT TRUE, -- For SCD Type 2
+    is_inferred BOOLEAN NOT NULL DEFAULT FALSE -- Stub created by the fact load for a natural key not yet in staging
 );
 
 -- Indexes for DimSeller
@@ -44,4 +54,41 @@ CREATE INDEX idx_dim_seller_seller_id ON dwh.dim_seller(seller_id); -- Index nat
 CREATE UNIQUE INDEX uidx_dim_seller_id_end_date ON dwh.dim_seller(seller_id, effective_end_date); -- Ensure only one current record per seller
 CREATE INDEX idx_dim_seller_state ON dwh.dim_seller(seller_state);
 CREATE INDEX idx_dim_seller_city ON dwh.dim_seller(seller_city);
-CREATE INDEX idx_dim_seller_is_current ON dwh.dim_seller(is_current);
\ No newline at end of file
+CREATE INDEX idx_dim_seller_is_current ON dwh.dim_seller(is_current);
+
+
+-- Create product dimension (olist_products_dataset + category translation)
+CREATE TABLE dwh.dim_product (
+    product_key SERIAL PRIMARY KEY, -- Surrogate Key
+    product_id VARCHAR(32) NOT NULL, -- Natural/Business Key from source
+    product_category_name VARCHAR(100) NOT NULL, -- Portuguese category name, 'Unknown' if missing
+    product_category_name_english VARCHAR(100) NOT NULL, -- From product_category_name_translation, falls back to the Portuguese name
+    product_name_length INTEGER NULL,
+    product_description_length INTEGER NULL,
+    product_photos_qty INTEGER NULL,
+    product_weight_g INTEGER NULL,
+    product_length_cm INTEGER NULL,
+    product_height_cm INTEGER NULL,
+    product_width_cm INTEGER NULL,
+    effective_start_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, -- For SCD Type 2
+    effective_end_date TIMESTAMP NULL, -- For SCD Type 2
+    is_current BOOLEAN NOT NULL DEFAULT TRUE, -- For SCD Type 2
+    is_inferred BOOLEAN NOT NULL DEFAULT FALSE -- Stub created by the fact load for a natural key not yet in staging
+);
+
+-- Indexes for DimProduct
+CREATE INDEX idx_dim_product_product_id ON dwh.dim_product(product_id); -- Index natural key
+CREATE UNIQUE INDEX uidx_dim_product_id_end_date ON dwh.dim_product(product_id, effective_end_date); -- Ensure only one current record per product
+CREATE INDEX idx_dim_product_category_english ON dwh.dim_product(product_category_name_english);
+CREATE INDEX idx_dim_product_is_current ON dwh.dim_product(is_current);
+
+-- Inputs of the last successful build of each ETL stage (dim_customer, dim_seller,
+-- dim_product, fact), written in the stage's transaction. input_fingerprint hashes the
+-- content_hash of the stage's staging inputs (staging.etl_source_manifest) and the last
+-- build of its upstream stages; a run with skip_unchanged=True skips the stage when it
+-- matches. NULL = inputs unknown.
+CREATE TABLE dwh.etl_stage_state (
+    stage_name VARCHAR(50) PRIMARY KEY,
+    input_fingerprint CHAR(64) NULL,
+    completed_at TIMESTAMP NOT NULL
+);
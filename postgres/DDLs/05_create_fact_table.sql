@@ -1,8 +1,20 @@
 DROP TABLE IF EXISTS dwh.fact_order_delivery CASCADE;
+DROP TABLE IF EXISTS dwh.fact_order_item CASCADE;
+-- The fact tables are recreated empty: the next run must not skip the fact stage
+-- (etl_stage_state is created in 04; skip the reset when 05 is run on its own before it)
+DO $$
+BEGIN
+    IF to_regclass('dwh.etl_stage_state') IS NOT NULL THEN
+        DELETE FROM dwh.etl_stage_state WHERE stage_name = 'fact';
+    END IF;
+END
+$$;
 
--- Create fact table
+-- Create fact table, range-partitioned by month of purchase_date_key (YYYYMMDD).
+-- Monthly partitions (dwh.fact_order_delivery_YYYYMM) are created by the ETL
+-- (ensure_fact_partitions) before each load.
 CREATE TABLE dwh.fact_order_delivery (
-    order_delivery_key BIGSERIAL PRIMARY KEY, -- Surrogate Key for Fact
+    order_delivery_key BIGSERIAL NOT NULL, -- Surrogate Key for Fact
     order_id VARCHAR(32) NOT NULL, -- Degenerate Dimension (Natural key of the order)
 
     -- Foreign Keys to Dimensions
@@ -25,6 +37,7 @@ CREATE TABLE dwh.fact_order_delivery (
     time_to_approve_hours NUMERIC(10, 2) NULL, -- approved_at - purchase_timestamp
     seller_processing_hours NUMERIC(10, 2) NULL, -- delivered_carrier_date - approved_at
     carrier_shipping_hours NUMERIC(10, 2) NULL, -- delivered_customer_date - delivered_carrier_date
+    customer_seller_distance_km NUMERIC(10, 2) NULL, -- Haversine distance between customer and seller zip centroids
     item_count INTEGER NOT NULL, -- Aggregated from order_items
     total_freight_value NUMERIC(10, 2) NOT NULL, -- Aggregated from order_items
     total_price NUMERIC(10, 2) NOT NULL, -- Aggregated from order_items (sum of price)
@@ -32,6 +45,7 @@ CREATE TABLE dwh.fact_order_delivery (
 
     -- Metadata
     dw_load_timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    source_row_hash CHAR(32) NULL, -- md5 of the staging order + items, used for incremental loads
 
     -- Foreign Key Constraints (using snake_case names)
     CONSTRAINT fk_fod_purchase_date FOREIGN KEY (purchase_date_key) REFERENCES dwh.dim_date(date_key),
@@ -40,10 +54,21 @@ CREATE TABLE dwh.fact_order_delivery (
     CONSTRAINT fk_fod_delivered_customer_date FOREIGN KEY (delivered_customer_date_key) REFERENCES dwh.dim_date(date_key),
     CONSTRAINT fk_fod_estimated_date FOREIGN KEY (estimated_delivery_date_key) REFERENCES dwh.dim_date(date_key),
     CONSTRAINT fk_fod_customer FOREIGN KEY (customer_key) REFERENCES dwh.dim_customer(customer_key),
-    CONSTRAINT fk_fod_seller FOREIGN KEY (seller_key) REFERENCES dwh.dim_seller(seller_key)
-);
+    CONSTRAINT fk_fod_seller FOREIGN KEY (seller_key) REFERENCES dwh.dim_seller(seller_key),
+
+    -- Unique constraints on a partitioned table must include the partition key
+    CONSTRAINT pk_fact_order_delivery PRIMARY KEY (order_delivery_key, purchase_date_key)
+) PARTITION BY RANGE (purchase_date_key);
+
+-- Catches rows of months without a partition; stays empty when the ETL creates partitions first
+CREATE TABLE dwh.fact_order_delivery_default PARTITION OF dwh.fact_order_delivery DEFAULT;
 
-CREATE UNIQUE INDEX uidx_fod_order_id ON dwh.fact_order_delivery(order_id); -- Ensure one row per order
+-- Upsert key of the fact. It must include the partition key, so the database only guarantees one row
+-- per (order_id, purchase_date_key), not one row per order: an order whose purchase date changes would
+-- get a second row in another month. One row per order is kept by the ETL alone, which deletes the old
+-- row first (FACT_MOVED_ORDERS_DELETE_SQL in main_etl.py, incremental and single-month loads), and is
+-- checked by the fact_order_in_one_partition validation (tests/run_validations.py).
+CREATE UNIQUE INDEX uidx_fod_order_id ON dwh.fact_order_delivery(order_id, purchase_date_key);
 CREATE INDEX idx_fod_fk_purchase_date ON dwh.fact_order_delivery(purchase_date_key);
 CREATE INDEX idx_fod_fk_approved_date ON dwh.fact_order_delivery(approved_date_key);
 CREATE INDEX idx_fod_fk_delivered_cust_date ON dwh.fact_order_delivery(delivered_customer_date_key);
@@ -51,4 +76,42 @@ CREATE INDEX idx_fod_fk_estimated_date ON dwh.fact_order_delivery(estimated_deli
 CREATE INDEX idx_fod_fk_customer ON dwh.fact_order_delivery(customer_key);
 CREATE INDEX idx_fod_fk_seller ON dwh.fact_order_delivery(seller_key);
 CREATE INDEX idx_fod_status ON dwh.fact_order_delivery(order_status);
-CREATE INDEX idx_fod_late_flag ON dwh.fact_order_delivery(is_late_delivery_flag);
\ No newline at end of file
+CREATE INDEX idx_fod_late_flag ON dwh.fact_order_delivery(is_late_delivery_flag);
+
+
+-- Item-grain fact: one row per order item, loaded together with fact_order_delivery
+-- (same staging delta, same transaction). Kept narrow for category/product dashboards.
+CREATE TABLE dwh.fact_order_item (
+    order_item_key BIGSERIAL PRIMARY KEY, -- Surrogate Key for Fact
+    order_id VARCHAR(32) NOT NULL, -- Degenerate Dimension
+    order_item_id SMALLINT NOT NULL, -- Sequence of the item within the order
+
+    -- Foreign Keys to Dimensions
+    purchase_date_key INTEGER NOT NULL,
+    shipping_limit_date_key INTEGER NULL,
+    customer_key INTEGER NOT NULL, -- FK to dim_customer
+    seller_key INTEGER NOT NULL, -- FK to dim_seller (seller of this item)
+    product_key INTEGER NOT NULL, -- FK to dim_product
+
+    -- Descriptive Attributes from Order
+    order_status VARCHAR(20) NOT NULL,
+
+    -- Measures
+    price NUMERIC(10, 2) NOT NULL,
+    freight_value NUMERIC(10, 2) NOT NULL,
+
+    -- Metadata
+    dw_load_timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT fk_foi_purchase_date FOREIGN KEY (purchase_date_key) REFERENCES dwh.dim_date(date_key),
+    CONSTRAINT fk_foi_shipping_limit_date FOREIGN KEY (shipping_limit_date_key) REFERENCES dwh.dim_date(date_key),
+    CONSTRAINT fk_foi_customer FOREIGN KEY (customer_key) REFERENCES dwh.dim_customer(customer_key),
+    CONSTRAINT fk_foi_seller FOREIGN KEY (seller_key) REFERENCES dwh.dim_seller(seller_key),
+    CONSTRAINT fk_foi_product FOREIGN KEY (product_key) REFERENCES dwh.dim_product(product_key)
+);
+
+CREATE UNIQUE INDEX uidx_foi_order_item ON dwh.fact_order_item(order_id, order_item_id);
+CREATE INDEX idx_foi_fk_purchase_date ON dwh.fact_order_item(purchase_date_key);
+CREATE INDEX idx_foi_fk_customer ON dwh.fact_order_item(customer_key);
+CREATE INDEX idx_foi_fk_seller ON dwh.fact_order_item(seller_key);
+CREATE INDEX idx_foi_fk_product ON dwh.fact_order_item(product_key);
@@ -0,0 +1,80 @@
+-- Helper functions used by the in-database (set-based SQL) ETL steps.
+-- Equivalent of pd.to_numeric / pd.to_datetime with errors='coerce': invalid values become NULL.
+
+CREATE OR REPLACE FUNCTION dwh.try_cast_numeric(value TEXT)
+RETURNS NUMERIC
+LANGUAGE plpgsql IMMUTABLE
+AS $$
+BEGIN
+    RETURN value::NUMERIC;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION dwh.try_cast_timestamp(value TEXT)
+RETURNS TIMESTAMP
+LANGUAGE plpgsql IMMUTABLE
+AS $$
+BEGIN
+    RETURN value::TIMESTAMP;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION dwh.try_cast_double(value TEXT)
+RETURNS DOUBLE PRECISION
+LANGUAGE plpgsql IMMUTABLE
+AS $$
+BEGIN
+    RETURN value::DOUBLE PRECISION;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION dwh.try_cast_integer(value TEXT)
+RETURNS INTEGER
+LANGUAGE plpgsql IMMUTABLE
+AS $$
+BEGIN
+    RETURN value::INTEGER;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$;
+
+-- Overloads for the typed staging layer (02b): values are already parsed, so these are
+-- no-ops that the planner inlines.
+CREATE OR REPLACE FUNCTION dwh.try_cast_numeric(value NUMERIC)
+RETURNS NUMERIC
+LANGUAGE sql IMMUTABLE
+AS $$ SELECT value $$;
+
+CREATE OR REPLACE FUNCTION dwh.try_cast_timestamp(value TIMESTAMP)
+RETURNS TIMESTAMP
+LANGUAGE sql IMMUTABLE
+AS $$ SELECT value $$;
+
+CREATE OR REPLACE FUNCTION dwh.try_cast_double(value DOUBLE PRECISION)
+RETURNS DOUBLE PRECISION
+LANGUAGE sql IMMUTABLE
+AS $$ SELECT value $$;
+
+CREATE OR REPLACE FUNCTION dwh.try_cast_integer(value INTEGER)
+RETURNS INTEGER
+LANGUAGE sql IMMUTABLE
+AS $$ SELECT value $$;
+
+-- Great-circle distance in km between two (lat, lng) points; same formula as haversine_km in main_etl.py
+CREATE OR REPLACE FUNCTION dwh.haversine_km(lat1 DOUBLE PRECISION, lng1 DOUBLE PRECISION,
+                                            lat2 DOUBLE PRECISION, lng2 DOUBLE PRECISION)
+RETURNS DOUBLE PRECISION
+LANGUAGE sql IMMUTABLE
+AS $$
+    SELECT 2 * 6371.0088 * ASIN(SQRT(
+        POWER(SIN(RADIANS(lat2 - lat1) / 2), 2)
+        + COS(RADIANS(lat1)) * COS(RADIANS(lat2)) * POWER(SIN(RADIANS(lng2 - lng1) / 2), 2)
+    ));
+$$;
@@ -0,0 +1,71 @@
+-- Aggregate layer for Superset: dashboards read these materialized views instead of joining
+-- fact_order_delivery with dim_date/dim_customer/dim_seller on every chart render.
+-- Refreshed by the ETL (refresh_aggregate_views) with REFRESH MATERIALIZED VIEW CONCURRENTLY
+-- after each fact load; the unique indexes below are required for CONCURRENTLY.
+-- Averages are stored together with their sums and counts so they can be re-aggregated correctly.
+DROP MATERIALIZED VIEW IF EXISTS dwh.agg_delivery_monthly;
+DROP MATERIALIZED VIEW IF EXISTS dwh.agg_delivery_daily;
+
+-- Grain: purchase day x customer_state x seller_state x order_status
+CREATE MATERIALIZED VIEW dwh.agg_delivery_daily AS
+SELECT
+    f.purchase_date_key,
+    d.full_date AS purchase_date,
+    d.year * 100 + d.month_number AS purchase_month_key,
+    DATE_TRUNC('month', d.full_date)::DATE AS purchase_month,
+    COALESCE(c.customer_state, 'NA') AS customer_state,
+    COALESCE(s.seller_state, 'NA') AS seller_state,
+    f.order_status,
+    SUM(f.order_count) AS order_count,
+    SUM(f.item_count) AS item_count,
+    SUM(f.total_price) AS total_price,
+    SUM(f.total_freight_value) AS total_freight_value,
+    COUNT(*) FILTER (WHERE f.is_late_delivery_flag) AS late_delivery_count,
+    COUNT(f.delivery_time_days) AS delivered_order_count,
+    SUM(f.delivery_time_days) AS sum_delivery_time_days,
+    AVG(f.delivery_time_days) AS avg_delivery_time_days,
+    COUNT(f.estimated_delivery_time_days) AS estimated_order_count,
+    SUM(f.estimated_delivery_time_days) AS sum_estimated_delivery_time_days,
+    AVG(f.estimated_delivery_time_days) AS avg_estimated_delivery_time_days,
+    COUNT(f.seller_processing_hours) AS seller_processed_order_count,
+    SUM(f.seller_processing_hours) AS sum_seller_processing_hours,
+    AVG(f.seller_processing_hours) AS avg_seller_processing_hours,
+    COUNT(f.carrier_shipping_hours) AS carrier_shipped_order_count,
+    SUM(f.carrier_shipping_hours) AS sum_carrier_shipping_hours,
+    AVG(f.carrier_shipping_hours) AS avg_carrier_shipping_hours
+FROM dwh.fact_order_delivery f
+JOIN dwh.dim_date d ON d.date_key = f.purchase_date_key
+LEFT JOIN dwh.dim_customer c ON c.customer_key = f.customer_key
+LEFT JOIN dwh.dim_seller s ON s.seller_key = f.seller_key
+GROUP BY f.purchase_date_key, d.full_date, d.year, d.month_number,
+         COALESCE(c.customer_state, 'NA'), COALESCE(s.seller_state, 'NA'), f.order_status
+WITH DATA;
+
+CREATE UNIQUE INDEX uidx_agg_delivery_daily
+    ON dwh.agg_delivery_daily(purchase_date_key, customer_state, seller_state, order_status);
+CREATE INDEX idx_agg_delivery_daily_month ON dwh.agg_delivery_daily(purchase_month_key);
+
+-- Monthly rollup of agg_delivery_daily (refresh after it)
+CREATE MATERIALIZED VIEW dwh.agg_delivery_monthly AS
+SELECT
+    purchase_month_key,
+    purchase_month,
+    customer_state,
+    seller_state,
+    order_status,
+    SUM(order_count) AS order_count,
+    SUM(item_count) AS item_count,
+    SUM(total_price) AS total_price,
+    SUM(total_freight_value) AS total_freight_value,
+    SUM(late_delivery_count) AS late_delivery_count,
+    SUM(delivered_order_count) AS delivered_order_count,
+    SUM(sum_delivery_time_days) / NULLIF(SUM(delivered_order_count), 0) AS avg_delivery_time_days,
+    SUM(sum_estimated_delivery_time_days) / NULLIF(SUM(estimated_order_count), 0) AS avg_estimated_delivery_time_days,
+    SUM(sum_seller_processing_hours) / NULLIF(SUM(seller_processed_order_count), 0) AS avg_seller_processing_hours,
+    SUM(sum_carrier_shipping_hours) / NULLIF(SUM(carrier_shipped_order_count), 0) AS avg_carrier_shipping_hours
+FROM dwh.agg_delivery_daily
+GROUP BY purchase_month_key, purchase_month, customer_state, seller_state, order_status
+WITH DATA;
+
+CREATE UNIQUE INDEX uidx_agg_delivery_monthly
+    ON dwh.agg_delivery_monthly(purchase_month_key, customer_state, seller_state, order_status);
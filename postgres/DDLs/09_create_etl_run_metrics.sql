@@ -0,0 +1,25 @@
+-- Per-stage metrics of each ETL run, written by etl/run_metrics.py (etl_run).
+-- One row per span. Not dropped when the DDLs are re-run, so the history
+-- is kept for tracking stage regressions across runs (e.g. as a Superset dataset).
+CREATE TABLE IF NOT EXISTS dwh.etl_run_metrics (
+    run_id VARCHAR(36) NOT NULL,
+    run_name VARCHAR(50) NOT NULL,
+    run_started_at TIMESTAMP NOT NULL,
+    span_seq INTEGER NOT NULL, -- Order in which the spans finished
+    span_name VARCHAR(100) NOT NULL, -- e.g. staging.load, dimensions.geo_lookup, fact.load
+    parent_span VARCHAR(100) NULL,
+    started_at TIMESTAMP NOT NULL,
+    wall_seconds NUMERIC(12, 3) NOT NULL,
+    cpu_seconds NUMERIC(12, 3) NOT NULL, -- Process CPU time (all threads)
+    peak_rss_mb NUMERIC(12, 1) NOT NULL, -- Peak RSS sampled while the span ran (the span's own peak)
+    process_peak_rss_mb NUMERIC(12, 1) NULL, -- Cumulative process peak (ru_maxrss) when the span finished
+    row_count BIGINT NULL,
+    rows_per_second NUMERIC(14, 1) NULL,
+    status VARCHAR(10) NOT NULL, -- ok / error
+    CONSTRAINT pk_etl_run_metrics PRIMARY KEY (run_id, span_seq)
+);
+
+-- Tables created before process_peak_rss_mb existed: their peak_rss_mb rows hold the cumulative peak
+ALTER TABLE dwh.etl_run_metrics ADD COLUMN IF NOT EXISTS process_peak_rss_mb NUMERIC(12, 1) NULL;
+
+CREATE INDEX IF NOT EXISTS idx_etl_run_metrics_span ON dwh.etl_run_metrics(span_name, run_started_at);